@@ -29,7 +29,6 @@
 
 import os
 import uuid
-from django.core.cache import cache
 from django.db.models import CharField, Value as V
 from django.db.models.functions import Concat
 from lxml import etree
@@ -38,6 +37,7 @@ from .models import Gateway, Bridge, ExtensionUser
 from provision.models import Devices, DeviceLines
 from django.contrib.auth.models import User, Group
 from tenants.pbxsettings import PbxSettings
+from utilities.clearcache import ClearCache
 
 
 class AccountFunctions():
@@ -198,7 +198,6 @@ class AccountFunctions():
 
 class GatewayFunctions():
     esconnected = False
-    configuration_cache_key = 'configuration:sofia.conf'
 
     def __init__(self):
         self.esconnected = False
@@ -206,7 +205,7 @@ class GatewayFunctions():
         self.es_connect()
 
     def rescan_sofia_profile(self, profile):
-        cache.delete(self.configuration_cache_key)
+        ClearCache().sofia(profile)
         cmd = 'api sofia profile %s rescan' % profile
         if self.esconnected:
             self.es.clear_responses()
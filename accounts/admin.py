@@ -32,7 +32,6 @@ from django.contrib.auth.base_user import BaseUserManager
 from django.contrib import admin
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
-from django.core.cache import cache
 from django.contrib import messages
 from .models import (
     Extension, FollowMeDestination, ExtensionUser, Gateway, Bridge,
@@ -48,6 +47,7 @@ from switch.switchfunctions import SipProfileChoice
 from .accountfunctions import AccountFunctions, GatewayFunctions, ExtRelatedFunctions
 from .extensionfunctions import ExtFeatureSyncFunctions
 from voicemail.voicemailfunctions import VoicemailFunctions
+from utilities.clearcache import ClearCache
 
 
 class ExtensionAdminForm(ModelForm):
@@ -286,8 +286,7 @@ class ExtensionAdmin(ImportExportModelAdmin):
 
     def save_model(self, request, obj, form, change):
         obj.updated_by = request.user.username
-        directory_cache_key = 'directory:%s@%s' % (obj.extension, request.session['domain_name'])
-        cache.delete(directory_cache_key)
+        ClearCache().directory_user(request.session['domain_name'], obj.extension)
         if change:
             super().save_model(request, obj, form, change)
             efsf = ExtFeatureSyncFunctions(obj)
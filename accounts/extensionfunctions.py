@@ -27,13 +27,13 @@
 #
 
 import math
-from django.core.cache import cache
 from accounts.models import Extension, FollowMeDestination
 from switch.models import SwitchVariable
 from django.conf import settings
 from pbx.fscmdabslayer import FsCmdAbsLayer
 from tenants.pbxsettings import PbxSettings
 from pbx.devicecfgevent import DeviceCfgEvent
+from utilities.clearcache import ClearCache
 
 
 class ExtFeatureSyncFunctions():
@@ -99,8 +99,7 @@ class ExtFeatureSyncFunctions():
         return ret
 
     def clear_extension_cache(self):
-        directory_cache_key = 'directory:%s@%s' % (self.ext.extension, self.ext.user_context)
-        cache.delete(directory_cache_key)
+        ClearCache().directory_user(self.ext.user_context, self.ext.extension)
 
     def get_extension_object(self, obj):
         if isinstance(obj, Extension):
@@ -43,7 +43,10 @@ import multiprocessing
 import psutil
 from psutil._common import bytes2human
 import time
+import asyncio
+from asgiref.sync import async_to_sync
 from pbx.fscmdabslayer import FsCmdAbsLayer
+from pbx.asyncfscmdabslayer import AsyncFsCmdAbsLayer
 from pbx.commonvalidators import clean_uuid4_list
 
 from tenants.models import Domain, Profile
@@ -308,11 +311,9 @@ class SwDashboard():
         self.get_live_counts()
         self.disconnect()
 
-    def get_count_value(self):
-        self.es.process_events()
-        self.es.get_responses()
+    def get_count_value(self, responses):
         ctotal = 0
-        for resp in self.es.responses:
+        for resp in responses:
             try:
                 ctmp = int(resp.replace(' total.', ''))
             except ValueError:
@@ -321,25 +322,27 @@ class SwDashboard():
         return ctotal
 
     def get_live_counts(self, switchnumber=None):
-        switch = None
-        if switchnumber:
-            switch = self.es.freeswitches[switchnumber]
-        result = False
         if not self.esconnected:
             return
-        self.es.clear_responses()
-        self.es.send('api show calls count', switch)
-        time.sleep(self.s)
-        self.sw_live['Calls'] = {'c': self.get_count_value()}
-        self.es.clear_responses()
-        self.es.send('api show channels count', switch)
-        time.sleep(self.s)
-        self.sw_live['Channels'] = {'c': self.get_count_value()}
-        self.es.clear_responses()
-        self.es.send('api show registrations count', switch)
-        time.sleep(self.s)
-        self.sw_live['Registrations'] = {'c': self.get_count_value()}
+        async_to_sync(self.aget_live_counts)(switchnumber)
 
+    async def aget_live_counts(self, switchnumber=None):
+        # The three counts are requested at the same time.
+        switch = None
+        if switchnumber:
+            switch = self.es.freeswitches[switchnumber]
+        counts = [[], [], []]
+        es = AsyncFsCmdAbsLayer()
+        if await es.connect():
+            counts = await asyncio.gather(
+                es.send('api show calls count', switch),
+                es.send('api show channels count', switch),
+                es.send('api show registrations count', switch)
+                )
+        await es.disconnect()
+        self.sw_live['Calls'] = {'c': self.get_count_value(counts[0])}
+        self.sw_live['Channels'] = {'c': self.get_count_value(counts[1])}
+        self.sw_live['Registrations'] = {'c': self.get_count_value(counts[2])}
 
     def get_config_counts(self):
         self.sw_counts['Destinations'] = {}
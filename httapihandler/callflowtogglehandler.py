@@ -27,12 +27,12 @@
 #    Adrian Fretwell <adrian@djangopbx.com>
 #
 
-from django.core.cache import cache
 from lxml import etree
 from .httapihandler import HttApiHandler
 from callflows.models import CallFlows
 from callflows.callflowfunctions import CfFunctions
 from pbx.commonevents import PresenceIn
+from utilities.clearcache import ClearCache
 
 
 class CallFlowToggleHandler(HttApiHandler):
@@ -86,8 +86,7 @@ class CallFlowToggleHandler(HttApiHandler):
                     etree.SubElement(x_work, 'pause', milliseconds='1000')
                     etree.SubElement(x_work, 'playback', file='voicemail/vm-goodbye.wav')
                     etree.SubElement(x_work, 'hangup')
-                    directory_cache_key = 'dialplan:%s' % self.domain_name
-                    cache.delete(directory_cache_key)
+                    ClearCache().dialplan(self.domain_name)
                     pe = PresenceIn()
                     pe.send(str(q.id), q.status, q.feature_code, self.domain_name, self.hostname)
                 else:
@@ -27,10 +27,10 @@
 #    Adrian Fretwell <adrian@djangopbx.com>
 #
 
-from django.core.cache import cache
 from lxml import etree
 from .httapihandler import HttApiHandler
 from accounts.models import Extension
+from utilities.clearcache import ClearCache
 
 
 class FollowMeToggleHandler(HttApiHandler):
@@ -73,8 +73,7 @@ class FollowMeToggleHandler(HttApiHandler):
             e.follow_me_enabled = 'true'
 
         e.save()
-        directory_cache_key = 'directory:%s@%s' % (e.extension, self.domain_name)
-        cache.delete(directory_cache_key)
+        ClearCache().directory_user(self.domain_name, e.extension)
         etree.SubElement(x_work, 'hangup')
         etree.indent(x_root)
         xml = str(etree.tostring(x_root), "utf-8")
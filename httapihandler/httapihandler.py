@@ -28,11 +28,10 @@
 #
 
 import logging
-from django.core.cache import cache
 from lxml import etree
 from .models import HttApiSession
 from tenants.pbxsettings import PbxSettings
-from pbx.pbxipaddresscheck import loopback_default
+from pbx.pbxipaddresscheck import AllowedAddresses
 
 
 class HttApiHandler():
@@ -99,9 +98,6 @@ class HttApiHandler():
     def get_variables(self):
         pass
 
-    def get_data(self):
-        return self.return_data(self.error_hangup('HF0001'))
-
     def htt_get_variables(self):
         if not self.var_list:
             return False
@@ -158,15 +154,7 @@ class HttApiHandler():
         return xml
 
     def get_allowed_addresses(self):
-        cache_key = 'httapihandler:allowed_addresses'
-        aa = cache.get(cache_key)
-        if aa:
-            return aa
-        aa = PbxSettings().default_settings('httapihandler', 'allowed_address', 'array')
-        if not aa:
-            aa = loopback_default
-        cache.set(cache_key, aa)
-        return aa
+        return AllowedAddresses('httapihandler').matcher()
 
     def get_first_call(self):
         if self.exiting:
@@ -27,11 +27,16 @@
 #    Adrian Fretwell <adrian@djangopbx.com>
 #
 
+import os
 import pika
 import socket
 import logging
 import uuid
 import time
+import itertools
+import threading
+import functools
+from concurrent import futures
 from django.conf import settings
 from tenants.models import DefaultSetting
 
@@ -39,15 +44,210 @@ logger = logging.getLogger(__name__)
 logging.getLogger("pika").setLevel(logging.WARNING)
 
 
+class AmqpRpcClient():
+
+    # One long lived broker connection per worker process, shared by its threads,
+    #  for FreeSWITCH API commands and other messages.  The connection belongs to a
+    #  thread of its own, other threads hand it work with add_callback_threadsafe(),
+    #  the only thread safe method of a pika BlockingConnection.
+    #
+    # The replies to every command come to one exclusive queue, bound to the command
+    #  exchange (a topic exchange) with route_key.*.  Each request gives FreeSWITCH
+    #  its own reply key, route_key.<request id>, as mod_amqp does not copy message
+    #  properties such as correlation_id, and the reply completes the request's
+    #  Future.  The connection is re-established if lost, requests that were in
+    #  flight fail.
+    #
+    # gather() gives each request until its switch's deadline, a switch that missed
+    #  its last one gets a short deadline until it replies again, so that a slow or
+    #  dead switch does not add the full timeout to every command sent to all of them.
+
+    fs_cmd_exchange = 'TAP.Commands'
+    connect_timeout = 5
+    clients = {}
+    lock = threading.Lock()
+    pid = None
+
+    @classmethod
+    def get(cls, mb, hostname):
+        # The client for the broker settings mb, started if new.
+        key = (mb[AmqpCmdEvent.mb_key_host], mb[AmqpCmdEvent.mb_key_port], mb[AmqpCmdEvent.mb_key_user],
+               mb[AmqpCmdEvent.mb_key_pass])
+        with cls.lock:
+            if cls.pid != os.getpid():
+                # Those of the parent process have no thread here.
+                cls.clients = {}
+                cls.pid = os.getpid()
+            client = cls.clients.get(key)
+            if client is None:
+                client = cls.clients[key] = cls(*key, hostname)
+                client.start()
+        return client
+
+    def __init__(self, host, port, user, password, hostname):
+        self.params = pika.ConnectionParameters(
+            host=host, port=port, credentials=pika.PlainCredentials(user, password),
+            client_properties={'connection_name': '%s-AmqpCmdEvent' % hostname})
+        self.host = host
+        self.route_key = str(uuid.uuid4()).replace('-', '')
+        self.ids = itertools.count(1)
+        self.pending = {}
+        self.missed = set()
+        self.timeout = getattr(settings, 'PBX_FREESWITCH_TIMEOUT', 3)
+        self.missed_timeout = getattr(settings, 'PBX_FREESWITCH_MISSED_TIMEOUT', 0.5)
+        self.connection = None
+        self.channel = None
+        self.ready = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='AmqpRpcClient', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        delay = 1
+        while True:
+            try:
+                self.open()
+                delay = 1
+                while True:
+                    self.connection.process_data_events(time_limit=1)
+            except Exception as e:
+                logger.warn('AMQP Cmd Event: Connection to {} lost: {}'.format(self.host, e))
+            self.ready.clear()
+            for request_id in list(self.pending):
+                self.fail(request_id, ConnectionError('AMQP connection lost'))
+            try:
+                if self.connection and self.connection.is_open:
+                    self.connection.close()
+            except Exception:
+                pass
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    def open(self):
+        logger.info('AMQP Cmd Event: Attempting to connect to %s' % self.host)
+        self.connection = pika.BlockingConnection(parameters=self.params)
+        self.channel = self.connection.channel()
+        self.channel.queue_declare(queue=self.route_key, durable=False, exclusive=True, auto_delete=True)
+        self.channel.queue_bind(self.route_key, self.fs_cmd_exchange, routing_key='%s.*' % self.route_key)
+        self.channel.basic_consume(queue=self.route_key, on_message_callback=self.on_response, auto_ack=True)
+        self.ready.set()
+        logger.info('AMQP Cmd Event: Connected Successfully to %s' % self.host)
+
+    def wait_ready(self, timeout=None):
+        return self.ready.wait(self.connect_timeout if timeout is None else timeout)
+
+    def on_response(self, ch, method, props, body):
+        f = self.pending.pop(method.routing_key.rpartition('.')[2], None)
+        if f:
+            self.missed.discard(f.host)
+        if f and not f.done():
+            f.set_result(body.decode().replace('\t', ''))
+
+    def fail(self, request_id, e):
+        f = self.pending.pop(request_id, None)
+        if f and not f.done():
+            f.set_exception(e)
+
+    def request(self, payload, host):
+        # Sends the API command payload to the switch host, returns a Future of its reply.
+        request_id = '%x' % next(self.ids)
+        f = futures.Future()
+        f.request_id = request_id
+        f.host = host
+        self.pending[request_id] = f
+        if not self.call(functools.partial(self.publish_request, request_id, payload, host)):
+            self.fail(request_id, ConnectionError('AMQP not connected'))
+        return f
+
+    def publish_request(self, request_id, payload, host):
+        try:
+            self.channel.basic_publish(
+                exchange=self.fs_cmd_exchange,
+                routing_key='%s_command' % host,
+                properties=pika.BasicProperties(
+                    # Where FreeSWITCH is to send the reply.
+                    headers={'x-fs-api-resp-exchange': self.fs_cmd_exchange,
+                             'x-fs-api-resp-key': '%s.%s' % (self.route_key, request_id)},
+                    correlation_id=request_id,
+                    ),
+                body=payload
+                )
+        except Exception as e:
+            self.fail(request_id, e)
+
+    def gather(self, requests, timeout=None):
+        # Waits for the replies to requests, each for timeout seconds or the missed
+        #  deadline if shorter and its switch missed the last one.  Returns {request: reply},
+        #  None for a request that failed or was not answered by its deadline.
+        now = time.monotonic()
+        deadlines = {f: now + self.deadline(f.host, timeout) for f in requests}
+        replies = {}
+        pending = set(requests)
+        while pending:
+            for f in [f for f in pending if f.done() or deadlines[f] <= now]:
+                pending.discard(f)
+                if not f.done():
+                    self.expire(f)
+                if f.done() and not f.cancelled() and f.exception() is None:
+                    replies[f] = f.result()
+                else:
+                    replies[f] = None
+            if pending:
+                futures.wait(pending, min(deadlines[f] for f in pending) - now, return_when=futures.FIRST_COMPLETED)
+                now = time.monotonic()
+        return replies
+
+    def deadline(self, host, timeout=None):
+        # Seconds to wait for a reply from the switch host.
+        timeout = self.timeout if timeout is None else timeout
+        if host in self.missed:
+            return min(timeout, self.missed_timeout)
+        return timeout
+
+    def expire(self, f):
+        # Fails a request that was not answered by its deadline.
+        self.missed.add(f.host)
+        self.fail(f.request_id, TimeoutError('No reply from %s' % f.host))
+
+    def cancel(self, f):
+        # Forgets a request whose reply is no longer wanted.
+        self.pending.pop(f.request_id, None)
+
+    def publish(self, exchange, routing, body, properties=None):
+        return self.call(functools.partial(self.publish_message, exchange, routing, body, properties))
+
+    def publish_message(self, exchange, routing, body, properties):
+        try:
+            self.channel.basic_publish(exchange, routing, body, properties=properties)
+        except Exception as e:
+            logger.warn('AMQP Cmd Event: Unable to publish {} {}: {}'.format(exchange, routing, e))
+
+    def call(self, callback):
+        # Runs callback on the connection's thread, returns False if not connected.
+        if not self.wait_ready():
+            return False
+        try:
+            self.connection.add_callback_threadsafe(callback)
+        except Exception:
+            return False
+        return True
+
+
 class AmqpCmdEvent:
 
+    # Sends FreeSWITCH API commands and other messages through the process's shared
+    #  AmqpRpcClient.  Replies to the commands sent since clear_responses() are
+    #  collected in responses by process_events(), scatter() sends one command to
+    #  several switches and returns their replies by switch.
+
     mb_key_host = 'message_broker'
     mb_key_port = 'message_broker_port'
     mb_key_user = 'message_broker_user'
     mb_key_pass = 'message_broker_password'
     mb_key_adhoc = 'message_broker_adhoc_publish'
     fs_cmd_exchange = 'TAP.Commands'
-    responses = []
 
     def __init__(self, debug=False):
         self.debug = debug
@@ -55,9 +255,8 @@ class AmqpCmdEvent:
                     self.mb_key_pass: 'djangopbx-insecure', self.mb_key_user: 'guest', self.mb_key_adhoc: False }
         try:
             self.hostname = socket.gethostname()
-        except:
+        except OSError:
             self.hostname = 'localhost'
-        self.inbound_route_key = str(uuid.uuid4()).replace('-', '')
         qs = DefaultSetting.objects.filter(
                 category='cluster',
                 subcategory__istartswith=self.mb_key_host,
@@ -73,122 +272,85 @@ class AmqpCmdEvent:
                     pass
             if mbcf.value_type == 'boolean':
                 self.mb[mbcf.subcategory] = (True if mbcf.value == 'true' else False)
-        self.channel = None
+        self.client = None
+        self.requests = []
+        self.responses = []
         self.freeswitches = settings.PBX_FREESWITCHES
         if len(self.freeswitches) < 1:
             self.freeswitches = [self.hostname]
         self.switchcount = len(self.freeswitches)
         self.singlehostrequest = False
 
-    def on_response(self, ch, method, props, body):
-        if self.debug:
-            print('ch')
-            print(ch)
-            print('method')
-            print(method)
-            print('props')
-            print(props)
-            print(body)
-        self.responses.append(body.decode().replace('\t', ''))
-
     def connect(self):
-        if logger is not None:
-            logger.info('AMQP Cmd Event: Attempting to connect to %s' % self.mb[self.mb_key_host])
-        params = pika.ConnectionParameters(
-            host=self.mb[self.mb_key_host],
-            port=self.mb[self.mb_key_port],
-            credentials=pika.PlainCredentials(self.mb[self.mb_key_user], self.mb[self.mb_key_pass]),
-            client_properties={'connection_name': '%s-AmqpCmdEvent' % self.hostname})
-        try:
-            self.connection = pika.BlockingConnection(parameters=params)
-        except pika.exceptions.ProbableAuthenticationError:
-            if logger is not None:
-                logger.info('AMQP Cmd Event: Connection refused from %s' % self.mb[self.mb_key_host])
+        self.client = AmqpRpcClient.get(self.mb, self.hostname)
+        if not self.client.wait_ready():
+            logger.info('AMQP Cmd Event: Unable to connect to %s' % self.mb[self.mb_key_host])
             return False
-        self.channel = self.connection.channel()
-        if logger is not None:
-            logger.info('AMQP Cmd Event: Connected Successfully to %s' % self.mb[self.mb_key_host])
         return True
 
     def setup_queues(self):
-        result = self.channel.queue_declare(
-            queue=self.inbound_route_key,
-            passive=False,
-            durable=False,
-            auto_delete=True,
-            arguments=None)
-        self.channel.queue_bind(
-            self.inbound_route_key,
-            self.fs_cmd_exchange,
-            routing_key=self.inbound_route_key,
-            arguments=None)
-        self.callback_queue = result.method.queue
+        # The reply queue is set up with the connection.
+        return
+
+    def consume(self):
+        return
 
     def clear_responses(self):
+        self.cancel_requests()
+        self.requests = []
         self.responses = []
 
-    def publish(self, payload, host=None):
-        if self.connection.is_open and self.channel.is_open:
-            if host:
-                self.singlehostrequest = True
-                freeswitch_route_key = '%s_command' % host
-                if self.debug:
-                    print('Publishing to %s' % freeswitch_route_key)
-                self.channel.basic_publish(
-                    exchange=self.fs_cmd_exchange,
-                    routing_key=freeswitch_route_key,
-                    properties=pika.BasicProperties(
-                        headers={'x-fs-api-resp-exchange': self.fs_cmd_exchange, 'x-fs-api-resp-key': self.inbound_route_key} # Add a key/value headers required by FreeSWITCH
-                    ),
-                    body=payload
-                    )
-                return
+    def cancel_requests(self):
+        if self.client:
+            for f in self.requests:
+                self.client.cancel(f)
 
+    def publish(self, payload, host=None):
+        if not self.client and not self.connect():
+            return
+        if host:
+            self.singlehostrequest = True
+            hosts = [host]
+        else:
             self.singlehostrequest = False
-            for fs in self.freeswitches:
-                freeswitch_route_key = '%s_command' % fs
-                if self.debug:
-                    print('Publishing to %s' % freeswitch_route_key)
-                self.channel.basic_publish(
-                    exchange=self.fs_cmd_exchange,
-                    routing_key=freeswitch_route_key,
-                    properties=pika.BasicProperties(
-                        headers={'x-fs-api-resp-exchange': self.fs_cmd_exchange, 'x-fs-api-resp-key': self.inbound_route_key} # Add a key/value headers required by FreeSWITCH
-                    ),
-                    body=payload
-                    )
+            hosts = self.freeswitches
+        for fs in hosts:
+            if self.debug:
+                print('Publishing to %s_command' % fs)
+            self.requests.append(self.client.request(payload, fs))
 
     def adhoc_publish(self, payload, routing='1.2.3.4.5', exchange='TAP.Firewall'):
-        if self.connection.is_open and self.channel.is_open and self.mb[self.mb_key_adhoc]:
-            try:
-                self.channel.basic_publish('TAP.Firewall', routing, payload.encode(),
+        if self.client and self.mb[self.mb_key_adhoc]:
+            if not self.client.publish('TAP.Firewall', routing, payload.encode(),
                     properties=pika.BasicProperties(delivery_mode=2), # Delivery Mode 2 for persistent
-                    )
-            except:
+                    ):
                 logger.warn('AMQP addhoc publish {}: Unable send message {}.'.format(exchange, routing))
 
-    def process_events(self, timeout=3):
-        if self.connection.is_open and self.channel.is_open:
-            t = time.time()
-            while len(self.responses) < self.switchcount:
-                self.connection.process_data_events(time_limit=timeout)
-                if self.singlehostrequest:
-                    break
-                if (time.time() - t) > timeout:
-                    break
+    def event_publish(self, payload, routing, exchange='TAP.Events'):
+        if self.client:
+            self.client.publish(exchange, routing, payload.encode())
 
-    def consume(self):
-        self.channel.basic_consume(
-            queue=self.callback_queue,
-            on_message_callback=self.on_response,
-            auto_ack=True)
+    def scatter(self, payload, hosts=None, timeout=None):
+        # Sends payload to each of hosts, all of the switches by default, at once.
+        #  Returns {host: reply}, None for a switch that did not reply in time.
+        if hosts is None:
+            hosts = self.freeswitches
+        if not self.client and not self.connect():
+            return dict.fromkeys(hosts)
+        if self.debug:
+            print('Publishing to %s' % ', '.join(['%s_command' % fs for fs in hosts]))
+        requests = [self.client.request(payload, fs) for fs in hosts]
+        replies = self.client.gather(requests, timeout)
+        return {f.host: replies[f] for f in requests}
 
-    def disconnect(self):
-        if self.channel.is_open:
-            try:
-                self.channel.close()
-            except pika.exceptions.ChannelClosedByBroker as e:
-                logger.warn('AMQP disconnect : Channel closed by broker {}.'.format(e))
+    def process_events(self, timeout=None):
+        # Waits for the replies to all of the requests, see AmqpRpcClient.gather().
+        replies = self.client.gather(self.requests, timeout) if self.requests else {}
+        self.responses = [replies[f] for f in self.requests if replies[f] is not None]
+        if self.debug:
+            print(self.responses)
 
-        if self.connection.is_open:
-            self.connection.close()
+    def disconnect(self):
+        # The connection is kept for the next use.
+        self.cancel_requests()
+        self.client = None
@@ -14,3 +14,6 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pbx.settings')
 
 application = get_asgi_application()
+
+from pbx.dbconnections import fork_safe_connections  # noqa: E402
+fork_safe_connections()
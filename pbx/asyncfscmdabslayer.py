@@ -0,0 +1,193 @@
+#
+#    DjangoPBX
+#
+#    MIT License
+#
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
+#
+#    Permission is hereby granted, free of charge, to any person obtaining a copy
+#    of this software and associated documentation files (the "Software"), to deal
+#    in the Software without restriction, including without limitation the rights
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#    copies of the Software, and to permit persons to whom the Software is
+#    furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in all
+#    copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#    SOFTWARE.
+#
+#    Contributor(s):
+#    Adrian Fretwell <adrian@djangopbx.com>
+#
+
+import socket
+import asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from pbx.fseventsocket import EventSocketPool
+from pbx.fscmdabslayer import FsCmdAbsLayer
+from pbx.amqpcmdevent import AmqpCmdEvent, AmqpRpcClient
+
+
+class AsyncFsCmdAbsLayer:
+
+    # asyncio version of FsCmdAbsLayer for async views, management commands and
+    #  views that use async_to_sync(), so that independent commands run concurrently,
+    #  eg. await asyncio.gather(es.send(a), es.send(b)).  send() waits for the replies
+    #  itself and returns them, they are also collected in responses.
+    #
+    # With the local event socket each command in progress, up to PBX_EVENT_SOCKET_POOL
+    #  at once, checks a connection out of the worker's EventSocketPool and runs in a
+    #  thread, as pooled connections are blocking sockets not tied to an event loop.
+    #  Through the message broker the commands are sent by the process's AmqpRpcClient,
+    #  each reply awaited until its switch's deadline, see AmqpRpcClient.gather().
+
+    loc_ev_skt = False
+
+    def __init__(self, debug=False):
+        self.debug = debug
+        self.err_count = 0
+        self.responses = []
+        try:
+            self.hostname = socket.gethostname()
+        except OSError:
+            self.hostname = 'localhost'
+        self.loc_ev_skt = settings.PBX_USE_LOCAL_EVENT_SOCKET
+        self.broker = None
+        self.client = None
+
+        if self.loc_ev_skt:
+            self.pool_size = getattr(settings, 'PBX_EVENT_SOCKET_POOL', 4)
+            self.slots = asyncio.Semaphore(max(self.pool_size, 1))
+            if self.debug:
+                print('Async Event Socket')
+            self.freeswitches = [self.hostname]
+        else:
+            if self.debug:
+                print('Async Event Broker')
+            self.freeswitches = settings.PBX_FREESWITCHES
+            if len(self.freeswitches) < 1:
+                self.freeswitches = [self.hostname]
+
+    async def connect(self):
+        if self.loc_ev_skt:
+            if not await asyncio.to_thread(self.check_socket):
+                self.err_count += 1
+                return False
+            return True
+        if self.client is None:
+            # AmqpCmdEvent reads the broker settings from the database.
+            self.broker = await sync_to_async(AmqpCmdEvent)(self.debug)
+            self.client = AmqpRpcClient.get(self.broker.mb, self.hostname)
+            self.broker.client = self.client
+        if not self.client.ready.is_set() and not await asyncio.to_thread(self.client.wait_ready):
+            self.client = None
+            return False
+        return True
+
+    def check_socket(self):
+        es = EventSocketPool.checkout(*settings.EVSKT)
+        if es is None:
+            return False
+        EventSocketPool.checkin(es, self.pool_size)
+        return True
+
+    async def send(self, payload, host=None, timeout=None):
+        # Returns the responses to payload, from host or all of the switches.  timeout
+        #  is the deadline for each reply, the event socket's own timeout if None.
+        if self.loc_ev_skt:
+            resps = [await self.send_socket(payload, timeout)]
+        else:
+            if self.client is None and not await self.connect():
+                self.err_count += 1
+                return []
+            if payload.startswith('sendevent'):
+                payload = self.build_event(payload)
+            else:
+                payload = payload.removeprefix('api ')
+            hosts = [host] if host else self.freeswitches
+            resps = [self.output(r) for r in await self.gather(payload, hosts, timeout)]
+        self.err_count += len([r for r in resps if r is None or r is False or '-ERR' in r])
+        resps = [r for r in resps if r is not None and r is not False]
+        self.responses.extend(resps)
+        return resps
+
+    async def send_socket(self, payload, timeout=None):
+        async with self.slots:
+            return await asyncio.to_thread(self.send_pooled, payload, timeout)
+
+    def send_pooled(self, payload, timeout=None):
+        # A reply not received by timeout closes the connection rather than
+        #  returning it to the pool, see EventSocket.
+        es = EventSocketPool.checkout(*settings.EVSKT)
+        if es is None:
+            return False
+        resp = es.send(payload, timeout)
+        if resp is False and es.reused and es.lost:
+            # Closed by the switch while in the pool, before the command was run.
+            es = EventSocketPool.checkout(*settings.EVSKT)
+            if es is None:
+                return False
+            resp = es.send(payload, timeout)
+        EventSocketPool.checkin(es, self.pool_size)
+        return resp
+
+    async def gather(self, payload, hosts, timeout=None):
+        client = self.client
+        if self.debug:
+            print('Publishing to %s' % ', '.join(['%s_command' % fs for fs in hosts]))
+        requests = [client.request(payload, fs) for fs in hosts]
+
+        async def reply(f):
+            try:
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(f)), client.deadline(f.host, timeout))
+            except asyncio.TimeoutError:
+                client.expire(f)
+            except Exception:
+                pass
+            return None
+
+        return await asyncio.gather(*[reply(f) for f in requests])
+
+    async def scatter(self, payload, hosts=None, timeout=None):
+        # Sends payload to each of hosts, all of the switches by default, and returns
+        #  {host: response}, None for a switch that failed or did not reply in time.
+        if hosts is None:
+            hosts = self.freeswitches
+        if self.loc_ev_skt:
+            resps = await self.send(payload, timeout=timeout)
+            return dict.fromkeys(hosts, next(iter(resps), None))
+        resps = await asyncio.gather(*[self.send(payload, fs, timeout) for fs in hosts])
+        return {fs: next(iter(r), None) for fs, r in zip(hosts, resps)}
+
+    async def process_events(self, timeout=None):
+        # The replies are awaited by send().
+        return
+
+    def get_responses(self):
+        # Return True if at least one freeswitch did not return an error
+        return len(self.responses) > self.err_count
+
+    def clear_responses(self):
+        self.responses = []
+        self.err_count = 0
+
+    async def disconnect(self):
+        # Event socket connections are returned to the pool after each command and
+        #  the broker connection is kept for the next use.
+        self.client = None
+
+    output = FsCmdAbsLayer.output
+    build_event = FsCmdAbsLayer.build_event
+    parse_event = FsCmdAbsLayer.parse_event
+
+    def adhoc_publish(self, payload, routing, exchange):
+        if not self.loc_ev_skt and self.broker:
+            self.broker.adhoc_publish(payload, routing, exchange)
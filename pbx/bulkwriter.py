@@ -0,0 +1,365 @@
+#
+#    DjangoPBX
+#
+#    MIT License
+#
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
+#
+#    Permission is hereby granted, free of charge, to any person obtaining a copy
+#    of this software and associated documentation files (the "Software"), to deal
+#    in the Software without restriction, including without limitation the rights
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#    copies of the Software, and to permit persons to whom the Software is
+#    furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in all
+#    copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#    SOFTWARE.
+#
+#    Contributor(s):
+#    Adrian Fretwell <adrian@djangopbx.com>
+#
+
+import io
+import os
+import time
+import queue
+import pickle
+import struct
+import logging
+import threading
+from django.core.exceptions import ValidationError
+from django.db import connection, connections, close_old_connections, transaction
+from django.db import DatabaseError, InterfaceError, OperationalError
+
+logger = logging.getLogger(__name__)
+
+
+class BulkWriter():
+
+    # Writes model instances to the database from a thread of its own, in batches
+    #  of up to batch_size or every flush_ms milliseconds, whichever comes first.
+    #  put() blocks while max_queue instances are waiting so that a slow database
+    #  holds back the producer instead of growing the queue without bound.
+    #  Models are written in the order they were registered, all in one transaction,
+    #  and batches of copy_threshold or more instances of a model registered with
+    #  copy=True are loaded with the PostgreSQL COPY command.
+    #
+    # An instance may be put with an ack callable, called from the writer thread once
+    #  the instance is safely stored, None may be put to have an ack called in turn with
+    #  nothing to write.  Acks are cumulative, only the last one of each batch is called.
+    #  If the database cannot be reached a batch is retried every retry seconds, or, when
+    #  spool_path is given, appended to that spool file and acknowledged.  The spool is
+    #  written to the database once it is reachable again.  Any other error, such as a
+    #  failing after_flush or a spool that cannot be written, leaves the batch neither
+    #  stored nor spooled, so from then on nothing is acknowledged, as a later cumulative
+    #  ack would cover the lost batch, and on_error() is called.
+    #  Each flush is passed to metrics.flushed(size, elapsed_ms) when metrics is given.
+
+    stop = object()
+    stats_interval = 60
+
+    def __init__(self, name='BulkWriter', batch_size=500, flush_ms=200, max_queue=10000, copy_threshold=1000,
+                 spool_path=None, retry=5, metrics=None, on_error=None):
+        self.name = name
+        self.metrics = metrics
+        self.on_error = on_error
+        self.failed = False
+        self.batch_size = max(batch_size, 1)
+        self.flush_ms = flush_ms
+        self.copy_threshold = copy_threshold
+        self.spool_path = spool_path
+        self.retry = retry
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.models = {}
+        self.thread = None
+        self.stopping = False
+        self.spool_until = 0.0
+        self.spooled = bool(spool_path) and (
+            os.path.exists(spool_path) or os.path.exists(spool_path + '.replay')
+            )
+        self.stats = self.new_stats()
+        self.stats_logged = time.monotonic()
+
+    def spool_bytes(self):
+        # Size of the spool waiting to be written to the database.
+        size = 0
+        if self.spool_path:
+            for path in (self.spool_path, self.spool_path + '.replay'):
+                try:
+                    size += os.path.getsize(path)
+                except OSError:
+                    pass
+        return size
+
+    def new_stats(self):
+        return {
+            'flushes': 0, 'rows': 0, 'flush_ms': 0.0, 'max_flush_ms': 0.0, 'max_batch': 0,
+            'max_queue': 0, 'blocked_ms': 0.0, 'failed': 0, 'spooled': 0
+            }
+
+    def register(self, model, after_flush=None, copy=False):
+        # after_flush(instances) is called within the transaction once they are inserted.
+        #  COPY is only suitable for models whose fields are all plain values, no JSON.
+        self.models[model] = (after_flush, copy)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def put(self, instance, ack=None):
+        try:
+            self.queue.put_nowait((instance, ack))
+        except queue.Full:
+            start = time.perf_counter()
+            self.queue.put((instance, ack))
+            self.stats['blocked_ms'] += (time.perf_counter() - start) * 1000
+
+    def close(self, timeout=None):
+        # Writes everything queued and stops the thread.
+        if self.thread and self.thread.is_alive():
+            self.queue.put(self.stop)
+            self.thread.join(timeout)
+
+    def run(self):
+        while not self.stopping:
+            batch = []
+            item = self.queue.get()
+            deadline = time.monotonic() + self.flush_ms / 1000
+            while True:
+                if item is self.stop:
+                    self.stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            if batch:
+                self.stats['max_queue'] = max(self.stats['max_queue'], self.queue.qsize() + len(batch))
+                try:
+                    self.flush(batch)
+                except Exception:
+                    logger.exception('%s: flush of %d failed', self.name, len(batch))
+        connections.close_all()
+
+    def flush(self, batch):
+        groups = {model: [] for model in self.models}
+        ack = None
+        for instance, a in batch:
+            if instance is not None:
+                groups.setdefault(type(instance), []).append(instance)
+            if a:
+                ack = a
+        size = sum(len(instances) for instances in groups.values())
+        start = time.perf_counter()
+        try:
+            while size and not self.write(groups, size):
+                if self.spool_path:
+                    self.spool(groups, size)
+                    break
+                if self.stopping:
+                    # Not acknowledged so the broker will deliver these again.
+                    logger.warning('%s: stopping with %d unsaved', self.name, size)
+                    return
+                time.sleep(self.retry)
+        except Exception:
+            logger.exception('%s: unable to store or spool %d, acknowledgements stopped', self.name, size)
+            self.failed = True
+            if self.on_error:
+                self.on_error()
+            return
+        if ack and not self.failed:
+            ack()
+        if size:
+            self.report(size, (time.perf_counter() - start) * 1000)
+
+    def write(self, groups, size):
+        # Returns False if the database could not be reached.
+        if time.monotonic() < self.spool_until:
+            return False
+        close_old_connections()
+        try:
+            if self.spooled:
+                self.replay()
+            with transaction.atomic():
+                for model, instances in groups.items():
+                    if instances:
+                        self.insert(model, instances)
+        except (OperationalError, InterfaceError) as e:
+            logger.warning('%s: database unavailable: %s', self.name, e)
+            self.spool_until = time.monotonic() + self.retry
+            return False
+        except (DatabaseError, ValidationError, ValueError) as e:
+            logger.warning('%s: flush of %d failed, saving individually: %s', self.name, size, e)
+            try:
+                self.save_each(groups)
+            except (OperationalError, InterfaceError) as e:
+                logger.warning('%s: database unavailable: %s', self.name, e)
+                self.spool_until = time.monotonic() + self.retry
+                return False
+        return True
+
+    def insert(self, model, instances, replay=False):
+        after_flush, copy = self.models.get(model, (None, False))
+        if replay:
+            # Some may have been written before a replay was interrupted.
+            model.objects.bulk_create(instances, ignore_conflicts=True)
+        elif copy and len(instances) >= self.copy_threshold and connection.vendor == 'postgresql':
+            self.copy(model, instances)
+        else:
+            model.objects.bulk_create(instances)
+        if after_flush:
+            after_flush(instances)
+
+    def save_each(self, groups):
+        for model, instances in groups.items():
+            after_flush = self.models.get(model, (None, False))[0]
+            for instance in instances:
+                try:
+                    with transaction.atomic():
+                        instance.save(force_insert=True)
+                        if after_flush:
+                            after_flush([instance])
+                except (OperationalError, InterfaceError):
+                    raise
+                except (DatabaseError, ValidationError, ValueError) as e:
+                    self.stats['failed'] += 1
+                    logger.warning('%s: unable to save %s %s: %s', self.name, model.__name__, instance.pk, e)
+
+    def spool(self, groups, size):
+        # Length prefixed pickles, appended and synced to disk before the batch is acknowledged.
+        data = pickle.dumps({model: instances for model, instances in groups.items() if instances})
+        with open(self.spool_path, 'ab') as f:
+            f.write(struct.pack('>I', len(data)))
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.spooled = True
+        self.stats['spooled'] += size
+
+    def replay(self):
+        # The spool is renamed while it is replayed so that new batches may still be spooled,
+        #  a replay interrupted by the database going away again is repeated from the start.
+        replay_path = self.spool_path + '.replay'
+        while True:
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spool_path):
+                    break
+                os.rename(self.spool_path, replay_path)
+            logger.info('%s: replaying spool %s', self.name, replay_path)
+            count = 0
+            for data in self.read_spool(replay_path, self.name):
+                groups = pickle.loads(data)
+                try:
+                    with transaction.atomic():
+                        for model, instances in groups.items():
+                            self.insert(model, instances, True)
+                except (OperationalError, InterfaceError):
+                    raise
+                except (DatabaseError, ValidationError, ValueError):
+                    self.save_each(groups)
+                count += sum(len(instances) for instances in groups.values())
+            os.remove(replay_path)
+            logger.info('%s: replayed %d from spool', self.name, count)
+        self.spooled = False
+
+    @staticmethod
+    def read_spool(path, name='BulkWriter'):
+        # Yields the pickled batches of a spool file, up to a truncated one.
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(4)
+                if len(header) < 4:
+                    break
+                length = struct.unpack('>I', header)[0]
+                data = f.read(length)
+                if len(data) < length:
+                    logger.warning('%s: spool %s is truncated', name, path)
+                    break
+                yield data
+
+    @classmethod
+    def merge_spools(cls, paths, spool_path, name='BulkWriter'):
+        # Moves the batches of the spool files paths, such as those of writers that
+        #  will not run again, to the end of spool_path, which is cut back to its last
+        #  whole batch first.  Called before the writer of spool_path is created.
+        paths = [path for path in paths if os.path.exists(path)]
+        if not paths:
+            return
+        end = 0
+        if os.path.exists(spool_path):
+            for data in cls.read_spool(spool_path, name):
+                end += 4 + len(data)
+        with open(spool_path, 'ab') as f:
+            f.truncate(end)
+            for path in paths:
+                count = 0
+                for data in cls.read_spool(path, name):
+                    f.write(struct.pack('>I', len(data)))
+                    f.write(data)
+                    count += 1
+                f.flush()
+                os.fsync(f.fileno())
+                os.remove(path)
+                logger.info('%s: moved %d batches from spool %s to %s', name, count, path, spool_path)
+
+    def copy(self, model, instances):
+        fields = [f for f in model._meta.concrete_fields]
+        columns = ', '.join(connection.ops.quote_name(f.column) for f in fields)
+        buf = io.StringIO()
+        for instance in instances:
+            buf.write('\t'.join(
+                self.copy_value(f.get_db_prep_save(getattr(instance, f.attname), connection)) for f in fields
+                ))
+            buf.write('\n')
+        buf.seek(0)
+        with connection.cursor() as cursor:
+            cursor.cursor.copy_expert(
+                'COPY %s (%s) FROM STDIN' % (connection.ops.quote_name(model._meta.db_table), columns), buf
+                )
+
+    def copy_value(self, value):
+        # COPY text format.
+        if value is None:
+            return '\\N'
+        if value is True:
+            return 't'
+        if value is False:
+            return 'f'
+        return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    def report(self, size, elapsed):
+        st = self.stats
+        st['flushes'] += 1
+        st['rows'] += size
+        st['flush_ms'] += elapsed
+        st['max_flush_ms'] = max(st['max_flush_ms'], elapsed)
+        st['max_batch'] = max(st['max_batch'], size)
+        if self.metrics:
+            self.metrics.flushed(size, elapsed)
+        logger.debug('%s: flush of %d in %.1f ms', self.name, size, elapsed)
+        now = time.monotonic()
+        if now - self.stats_logged < self.stats_interval:
+            return
+        self.stats_logged = now
+        self.stats = self.new_stats()
+        logger.info(
+            '%s: %d rows in %d flushes, mean batch %.1f, max batch %d, mean flush %.1f ms, max flush %.1f ms, '
+            'max queue %d, blocked %.0f ms, %d failed, %d spooled',
+            self.name, st['rows'], st['flushes'], st['rows'] / st['flushes'], st['max_batch'],
+            st['flush_ms'] / st['flushes'], st['max_flush_ms'], st['max_queue'], st['blocked_ms'], st['failed'],
+            st['spooled']
+            )
@@ -0,0 +1,97 @@
+#
+#    DjangoPBX
+#
+#    MIT License
+#
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
+#
+#    Permission is hereby granted, free of charge, to any person obtaining a copy
+#    of this software and associated documentation files (the "Software"), to deal
+#    in the Software without restriction, including without limitation the rights
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#    copies of the Software, and to permit persons to whom the Software is
+#    furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in all
+#    copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#    SOFTWARE.
+#
+#    Contributor(s):
+#    Adrian Fretwell <adrian@djangopbx.com>
+#
+
+import time
+from django.core.cache import cache
+
+
+class CacheNamespace:
+
+    # Versioned cache namespaces.
+    #
+    # Every key in a section is prefixed with the current generation of that
+    # section, and optionally of a domain within the section, e.g.
+    #    directory:1700000000.1700000003:100@example.com
+    #
+    # Invalidating a section or domain is a single atomic increment of its
+    # generation counter, entries built under the old generation are simply no
+    # longer asked for and age out of the cache.
+    #
+    # Counters that are missing, e.g. after a memcached restart, are started from
+    # the current time so that they can not fall back to a value seen before.
+
+    sections = ['directory', 'dialplan', 'configuration', 'languages']
+    section_key = 'ns:%s'
+    domain_key = 'ns:%s:%s'
+
+    def __init__(self, section):
+        self.section = section
+        self.generations = {}
+
+    def counter_keys(self, domain=None):
+        keys = [self.section_key % self.section]
+        if domain:
+            keys.append(self.domain_key % (self.section, domain))
+        return keys
+
+    def generation(self, domain=None):
+        # Generations are fetched once per instance, so one instance is good for
+        #  all the keys required by a single request.
+        if domain in self.generations:
+            return self.generations[domain]
+        keys = self.counter_keys(domain)
+        counters = cache.get_many(keys)
+        for k in keys:
+            if k not in counters:
+                counters[k] = int(time.time())
+                cache.add(k, counters[k], None)
+        self.generations[domain] = tuple(counters[k] for k in keys)
+        return self.generations[domain]
+
+    def key(self, key, domain=None):
+        # The domain only selects the generation, key must still be unique
+        #  within the section.
+        return '%s:%s:%s' % (self.section, '.'.join(str(g) for g in self.generation(domain)), key)
+
+    def invalidate(self, domain=None):
+        # Returns the new generation counter value, or None if the cache could
+        #  not be updated.
+        k = self.counter_keys(domain)[-1]
+        self.generations.clear()
+        try:
+            return cache.incr(k)
+        except ValueError:
+            if cache.add(k, int(time.time()), None):
+                return cache.get(k)
+        return None
+
+    @classmethod
+    def invalidate_all(cls):
+        for section in cls.sections:
+            cls(section).invalidate()
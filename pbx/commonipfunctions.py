@@ -32,6 +32,7 @@ from django.core.cache import cache
 from tenants.pbxsettings import PbxSettings
 from portal.models import Failed_logins
 from .commonfunctions import shcommand
+from .cachenamespace import CacheNamespace
 
 
 class IpFunctions():
@@ -50,7 +51,7 @@ class IpFunctions():
         self.pbxsettings = PbxSettings()
 
     def get_portal_ignore_fail_address(self):
-        cache_key = 'portal:ignore_fail_address'
+        cache_key = CacheNamespace('configuration').key('portal:ignore_fail_address')
         ia = cache.get(cache_key)
         if ia:
             ignore_addresses = ia.split(',')
@@ -62,7 +63,7 @@ class IpFunctions():
 
     def get_portal_fail_attempts(self):
         max_fail_attempts = 5
-        cache_key = 'portal:fail_attempts'
+        cache_key = CacheNamespace('configuration').key('portal:fail_attempts')
         max_fail_attempts = cache.get(cache_key)
         if not max_fail_attempts:
             max_fail_attempts = self.pbxsettings.default_settings('portal', 'max_fail_attempts', 'numeric', 5, True)
@@ -0,0 +1,120 @@
+#
+#    DjangoPBX
+#
+#    MIT License
+#
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
+#
+#    Permission is hereby granted, free of charge, to any person obtaining a copy
+#    of this software and associated documentation files (the "Software"), to deal
+#    in the Software without restriction, including without limitation the rights
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#    copies of the Software, and to permit persons to whom the Software is
+#    furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in all
+#    copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#    SOFTWARE.
+#
+#    Contributor(s):
+#    Adrian Fretwell <adrian@djangopbx.com>
+#
+
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+
+# Persistent database connections (CONN_MAX_AGE) are only safe when a connection
+#  is never shared between processes.  A connection opened by the uwsgi master
+#  while loading the application is inherited by every worker it forks and the
+#  workers then talk over one socket, giving "SSL SYSCALL error: EOF detected".
+#  fork_safe_connections() is called by the wsgi and asgi entry points to close
+#  connections before workers are forked and drop any that are inherited anyway.
+
+xmlhandler_reads = ContextVar('xmlhandler_reads', default=False)
+
+# Inherited connections are kept referenced so that they are never closed, or
+#  garbage collected, by the child as that would end the parent's session.
+inherited = []
+
+
+def discard_inherited_connections():
+    for conn in connections.all(initialized_only=True):
+        if conn.connection is not None:
+            inherited.append(conn.connection)
+            conn.connection = None
+
+
+def fork_safe_connections():
+    connections.close_all()
+    os.register_at_fork(after_in_child=discard_inherited_connections)
+    try:
+        # uwsgi forks from C so the Python fork handlers are not called.
+        from uwsgidecorators import postfork
+    except ImportError:
+        pass
+    else:
+        postfork(discard_inherited_connections)
+
+
+@contextmanager
+def xmlhandler_database():
+    token = xmlhandler_reads.set(True)
+    try:
+        yield
+    finally:
+        xmlhandler_reads.reset(token)
+
+
+def xmlhandler_stream(generator):
+    # Streamed responses are generated after the view has returned, each chunk
+    #  is produced within the context instead.
+    while True:
+        with xmlhandler_database():
+            chunk = next(generator, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+class XmlHandlerRouter():
+
+    # Sends reads made while answering xml_curl requests to the dedicated, long lived,
+    #  'xmlhandler' connection when PBX_XMLHANDLER_DATABASE is True.  Writes and all
+    #  other reads use the default database.
+
+    alias = 'xmlhandler'
+
+    def db_for_read(self, model, **hints):
+        if xmlhandler_reads.get() and getattr(settings, 'PBX_XMLHANDLER_DATABASE', False):
+            return self.alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Without this an instance read through the alias would be saved through it,
+        #  and the alias may be pointed at a replica.
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db == self.alias:
+            return 'default'
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases are the same database.
+        dbs = {'default', self.alias}
+        if obj1._state.db in dbs and obj2._state.db in dbs:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == self.alias:
+            return False
+        return None
@@ -31,18 +31,28 @@ import time
 import json
 import socket
 from django.conf import settings
-from pbx.fseventsocket import EventSocket
+from pbx.fseventsocket import EventSocketPool
 from pbx.amqpcmdevent import AmqpCmdEvent
 
 
 class FsCmdAbsLayer:
 
+    # Sends commands to the FreeSWITCHes through the message broker, or to the local
+    #  switch through its event socket.  Event socket connections come from the
+    #  worker's EventSocketPool, connect() checks one out and disconnect() returns it,
+    #  send() checks out another if needed so an instance may be used again after
+    #  disconnect().
+    #
+    # scatter() sends a command to all of the switches in parallel and returns their
+    #  responses by switch, None for one that did not reply by its deadline.
+
     loc_ev_skt = False
     responses = []
 
     def __init__(self, debug=False):
         self.debug = debug
         self.err_count = 0
+        self.responses = []
         try:
             self.hostname = socket.gethostname()
         except:
@@ -50,7 +60,8 @@ class FsCmdAbsLayer:
         self.loc_ev_skt = settings.PBX_USE_LOCAL_EVENT_SOCKET
 
         if self.loc_ev_skt:
-            self.broker = EventSocket()
+            self.broker = None
+            self.pool_size = getattr(settings, 'PBX_EVENT_SOCKET_POOL', 4)
             if self.debug:
                 print('Event Socket')
             self.freeswitches = [self.hostname]
@@ -62,10 +73,12 @@ class FsCmdAbsLayer:
 
     def connect(self):
         if self.loc_ev_skt:
-            resp = self.broker.connect(*settings.EVSKT)
-            if not resp:
+            if self.broker is None:
+                self.broker = EventSocketPool.checkout(*settings.EVSKT)
+            if self.broker is None:
                 self.err_count += 1
-            return resp
+                return False
+            return True
         else:
             result = self.broker.connect()
         if result:
@@ -75,14 +88,28 @@ class FsCmdAbsLayer:
 
     def send(self, payload, host=None):
         if self.loc_ev_skt:
-            self.responses.append(self.broker.send(payload))
+            if self.broker is not None and not self.broker.connected:
+                # Failed on an earlier command.
+                self.broker = None
+            if self.broker is None and not self.connect():
+                return
+            resp = self.broker.send(payload)
+            if resp is False and self.broker.reused and self.broker.lost:
+                # Closed by the switch while in the pool, before the command was run.
+                self.broker = None
+                if self.connect():
+                    resp = self.broker.send(payload)
+            if resp is False:
+                self.err_count += 1
+                return
+            self.responses.append(resp)
         else:
             if payload.startswith('sendevent'):
                 self.broker.publish(self.build_event(payload), host)
                 return
             self.broker.publish(payload.removeprefix('api '), host)
 
-    def process_events(self, timeout=3):
+    def process_events(self, timeout=None):
         if self.loc_ev_skt:
             return
         self.broker.process_events(timeout)
@@ -93,15 +120,36 @@ class FsCmdAbsLayer:
                 return False
             return True
         for resp_raw in self.broker.responses:
-            output_json = json.loads(resp_raw)
-            resp = output_json['output']
-            if '-ERR' in resp:
+            resp = self.output(resp_raw)
+            if resp is None or '-ERR' in resp:
                 self.err_count += 1
-            self.responses.append(resp)
-            # Return True if at least one freeswitch did not return an error
-            if self.err_count < len(self.freeswitches):
-                return True
-        return False
+            if resp is not None:
+                self.responses.append(resp)
+        # Return True if at least one freeswitch did not return an error
+        return len(self.responses) > self.err_count
+
+    def scatter(self, payload, hosts=None, timeout=None):
+        # Sends the API command payload to each of hosts, all of the switches by
+        #  default, and returns {host: response}.  The responses are also left in
+        #  responses, and err_count counts the switches that failed or did not reply.
+        self.clear_responses()
+        if self.loc_ev_skt:
+            self.send(payload)
+            results = dict.fromkeys(self.freeswitches if hosts is None else hosts, next(iter(self.responses), None))
+        else:
+            replies = self.broker.scatter(payload.removeprefix('api '), hosts, timeout)
+            results = {host: self.output(resp_raw) for host, resp_raw in replies.items()}
+            self.responses = [resp for resp in results.values() if resp is not None]
+        self.err_count = len([resp for resp in results.values() if resp is None or '-ERR' in resp])
+        return results
+
+    def output(self, resp_raw):
+        if resp_raw is None:
+            return None
+        try:
+            return json.loads(resp_raw)['output']
+        except (ValueError, KeyError, TypeError):
+            return None
 
     def clear_responses(self):
         if not self.loc_ev_skt:
@@ -110,6 +158,11 @@ class FsCmdAbsLayer:
         self.err_count = 0
 
     def disconnect(self):
+        if self.loc_ev_skt:
+            if self.broker is not None:
+                EventSocketPool.checkin(self.broker, self.pool_size)
+                self.broker = None
+            return
         self.broker.disconnect()
 
     def build_event(self, payload):
@@ -27,42 +27,71 @@
 #    Adrian Fretwell <adrian@djangopbx.com>
 #
 
+import os
 import socket
 import logging
+import threading
 import time
 
 logger = logging.getLogger(__name__)
 
 
 class EventSocket:
-    data_timeout = 0.01
-    nodata_timeout = 0.1
-    sleep_time = 0.005
 
-    def __init__(self, sock=None):
+    # A FreeSWITCH event socket (ESL) client.  Messages are a block of headers ended
+    #  by a blank line, followed by a body of Content-Length bytes if that header is
+    #  present.  Each command has exactly one reply, api/response for api commands and
+    #  command/reply for the others, which is read on a blocking socket within timeout
+    #  seconds, so commands may also be pipelined with send_many().  Events and log
+    #  lines, which are only sent if subscribed to, are skipped.
+    #
+    # After a timeout or a broken message the replies cannot be matched to their
+    #  commands any more, so the socket is closed and connected becomes False.
+
+    timeout = 10
+    recv_size = 65536
+
+    def __init__(self, sock=None, timeout=None):
         if sock is None:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         else:
             self.sock = sock
+        if timeout is not None:
+            self.timeout = timeout
+        self.buffer = bytearray()
+        self.connected = sock is not None
+        self.address = None
+        self.pid = os.getpid()
+        # Set by EventSocketPool for a connection used before, and when the switch closed the connection.
+        self.reused = False
+        self.lost = False
         self.headers = {}
+        self.body = ''
         self.auth_fail_str = ' '
 
     def disconnect(self):
         if (self.sock):
-            self.sock.shutdown(1)
+            try:
+                self.sock.shutdown(1)
+            except OSError:
+                pass
             self.sock.close()
+        self.connected = False
 
     def connect(self, host, port, password):
         self.password = 'auth %s' % password
+        self.address = (host, port, password)
+        self.sock.settimeout(self.timeout)
         try:
             self.sock.connect((host, port))
         except socket.error as err:
             logger.warn('[Event Socket] Connect Error: {}'.format(err))
             return False
-        self.sock.setblocking(0)
+        self.connected = True
 
         if not self.auth():
             logger.warn('[Event Socket] Auth failed: {}'.format(self.auth_fail_str))
+            self.disconnect()
             return False
         return True
 
@@ -86,60 +115,165 @@ class EventSocket:
             self.auth_fail_str = 'No Content-Type header stage 1.'
         return False
 
-    def send(self, cmd):
-        cmd = '%s\n\n' % cmd
+    def send(self, cmd, timeout=None):
+        # Returns the body of the reply, empty for a command/reply, or False on failure.
+        #  timeout, if given, replaces the connection's for this reply.
+        if not self.write(['%s\n\n' % cmd]):
+            return False
+        return self.reply(time.monotonic() + (self.timeout if timeout is None else timeout))
+
+    def send_many(self, cmds):
+        # Sends all of the commands before reading their replies, saving a round trip
+        #  per command.  Returns the list of reply bodies, False for any not received.
+        if not self.write(['%s\n\n' % cmd for cmd in cmds]):
+            return [False] * len(cmds)
+        deadline = time.monotonic() + self.timeout
+        return [self.reply(deadline) for cmd in cmds]
+
+    def write(self, cmds):
+        if not self.connected:
+            return False
         try:
-            self.sock.sendall(cmd.encode())
+            self.sock.sendall(''.join(cmds).encode())
         except socket.error as err:
             logger.warn('[Event Socket] Send Error: {}'.format(err))
+            self.lost = isinstance(err, ConnectionError)
+            self.disconnect()
             return False
-        self.read()
-        return self.body
-
-    def read(self):
-        total_data = []
-        data = None
-        begin = time.time()
-        while 1:
-            # if we have some data, then break after timeout
-            if total_data and time.time()-begin > self.data_timeout:
-                break
-            # if we got no data at all, wait a little longer, twice the timeout
-            elif time.time()-begin > self.nodata_timeout:
-                break
+        return True
 
+    def alive(self):
+        # An idle connection is usable if nothing has been received on it since its
+        #  last reply, anything would be the switch closing it or an unread reply.
+        if not self.connected or self.buffer:
+            return False
+        try:
+            self.sock.setblocking(False)
             try:
-                data = self.sock.recv(4096)
-                if data:
-                    total_data.append(data.decode())
-                    # reset begin time for next chunk of data
-                    begin = time.time()
-                else:
-                    # sleep for sometime to stop loop consuming CPU
-                    time.sleep(self.sleep_time)
+                self.sock.recv(1, socket.MSG_PEEK)
+            finally:
+                self.sock.settimeout(self.timeout)
+        except BlockingIOError:
+            return True
+        except OSError:
+            pass
+        return False
 
-            except socket.error:
-                time.sleep(self.sleep_time)
+    def reply(self, deadline):
+        while self.read(deadline):
+            content_type = self.headers.get('Content-Type')
+            if content_type == 'api/response' or content_type == 'command/reply':
+                return self.body
+            if content_type == 'text/disconnect-notice':
+                logger.warn('[Event Socket] Disconnected by the switch.')
+                self.disconnect()
+                break
+        return False
 
-        if not total_data:
+    def read(self, deadline=None):
+        # Reads one message into self.headers and self.body, returns False on failure.
+        if not self.connected:
             return False
-        self.msg = ''.join(total_data)
-        self.parse_msg()
-        return
+        if deadline is None:
+            deadline = time.monotonic() + self.timeout
+        try:
+            end = self.buffer.find(b'\n\n')
+            while end < 0:
+                start = max(len(self.buffer) - 1, 0)
+                self.recv(deadline)
+                end = self.buffer.find(b'\n\n', start)
+            hdr = self.buffer[:end].decode(errors='replace')
+            del self.buffer[:end + 2]
+            self.parse_headers(hdr)
+            length = int(self.headers.get('Content-Length', 0))
+            while len(self.buffer) < length:
+                self.recv(deadline)
+        except (OSError, ValueError) as err:
+            logger.warn('[Event Socket] Read Error: {}'.format(err or 'timed out'))
+            self.lost = isinstance(err, ConnectionError)
+            self.disconnect()
+            return False
+        self.body = self.buffer[:length].decode(errors='replace')
+        del self.buffer[:length]
+        self.msg = '%s\n\n%s' % (hdr, self.body)
+        return True
+
+    def recv(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout()
+        self.sock.settimeout(remaining)
+        data = self.sock.recv(self.recv_size)
+        if not data:
+            raise ConnectionResetError('Connection closed by the switch')
+        self.buffer += data
 
-    def parse_msg(self):
+    def parse_headers(self, hdr):
         self.headers.clear()
-        hdr_end = self.msg.find('\n\n')
-        if hdr_end == -1:
-            logger.warn('[Event Socket] Double linefeed not found.')
-            hdr = self.msg
-            self.body = self.msg
-        else:
-            hdr = self.msg[: hdr_end]
-            self.body = self.msg[hdr_end+2:]
-        hdrs = hdr.split('\n')
-        for h in hdrs:
-            if ':' in h:
-                kv = h.split(': ')
-                self.headers[kv[0]] = kv[1]
+        for h in hdr.split('\n'):
+            if ': ' in h:
+                k, v = h.split(': ', 1)
+                self.headers[k] = v
         return
+
+
+class EventSocketPool():
+
+    # Authenticated event socket connections kept open for reuse, per worker process
+    #  and switch, so that a command costs no connection set up or auth round trips.
+    #  checkout() returns an idle connection that is still alive, or a new one, and
+    #  checkin() keeps it for the next checkout, closing it instead if it has failed
+    #  or max_idle connections to that switch are already idle.  Connections inherited
+    #  over a fork are dropped without being shut down, the parent still uses them.
+
+    pools = {}
+    lock = threading.Lock()
+    pid = None
+
+    @classmethod
+    def checkout(cls, host, port, password, timeout=None):
+        # Returns None if the switch cannot be reached.
+        key = (host, port, password)
+        while True:
+            with cls.lock:
+                if cls.pid != os.getpid():
+                    cls.pools = {}
+                    cls.pid = os.getpid()
+                idle = cls.pools.get(key)
+                es = idle.pop() if idle else None
+            if es is None:
+                break
+            if es.alive():
+                es.reused = True
+                es.lost = False
+                return es
+            es.disconnect()
+        es = EventSocket(timeout=timeout)
+        if not es.connect(host, port, password):
+            return None
+        return es
+
+    @classmethod
+    def checkin(cls, es, max_idle=4):
+        if es.pid != os.getpid():
+            return
+        if es.connected and not es.buffer:
+            with cls.lock:
+                if cls.pid != es.pid:
+                    cls.pools = {}
+                    cls.pid = es.pid
+                idle = cls.pools.setdefault(es.address, [])
+                if len(idle) < max_idle:
+                    idle.append(es)
+                    return
+        es.disconnect()
+
+    @classmethod
+    def clear(cls):
+        # Closes the idle connections of this process.
+        with cls.lock:
+            pools = cls.pools if cls.pid == os.getpid() else {}
+            cls.pools = {}
+        for idle in pools.values():
+            for es in idle:
+                es.disconnect()
@@ -27,20 +27,88 @@
 #    Adrian Fretwell <adrian@djangopbx.com>
 #
 
+import time
+import logging
 import ipaddress
+import threading
 from python_ipware import IpWare
+from tenants.pbxsettings import PbxSettings
+from .cachenamespace import CacheNamespace
+
+logger = logging.getLogger(__name__)
 
 loopback_default = ['127.0.0.1/32', '::1/128']
 
+ipw = IpWare()
+
+
+class AllowedAddressMatcher():
+
+    # A compiled set of allowed networks.
+    #
+    # For each address family the networks are held as the set of integer network
+    #  prefixes for each prefix length in use, so checking an address is one shift
+    #  and one set lookup per distinct prefix length.
+
+    bits = {4: 32, 6: 128}
+
+    def __init__(self, allowed_addresses):
+        prefixes = {4: {}, 6: {}}
+        for ip_net in allowed_addresses:
+            try:
+                ipn = ipaddress.ip_network(ip_net.strip())
+            except (ValueError, AttributeError) as e:
+                # Includes networks with host bits set, eg. 192.168.1.5/24.
+                logger.warning('Allowed address {} ignored: {}'.format(ip_net, e))
+                continue
+            shift = self.bits[ipn.version] - ipn.prefixlen
+            prefixes[ipn.version].setdefault(shift, set()).add(int(ipn.network_address) >> shift)
+        self.prefixes = {v: tuple(sorted(p.items())) for v, p in prefixes.items()}
+
+    def match(self, ip):
+        if ip is None:
+            return False
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        ip_int = int(ip)
+        for shift, networks in self.prefixes[ip.version]:
+            if (ip_int >> shift) in networks:
+                return True
+        return False
+
+
+class AllowedAddresses():
+
+    # The allowed_address default settings of a category compiled into an
+    #  AllowedAddressMatcher, held per worker (process).  A matcher is rebuilt when
+    #  the configuration cache namespace generation changes, e.g. from ClearCache,
+    #  or after ttl seconds so that edited settings are picked up as they were when
+    #  the address list was held in the cache.
+
+    matchers = {}
+    lock = threading.Lock()
+    ttl = 300
+
+    def __init__(self, category):
+        self.category = category
+
+    def matcher(self):
+        generation = CacheNamespace('configuration').generation()
+        entry = self.matchers.get(self.category)
+        if entry and entry[0] == generation and (time.monotonic() - entry[1]) < self.ttl:
+            return entry[2]
+        aa = PbxSettings().default_settings(self.category, 'allowed_address', 'array')
+        if not aa:
+            aa = loopback_default
+        matcher = AllowedAddressMatcher(aa)
+        with self.lock:
+            self.matchers[self.category] = (generation, time.monotonic(), matcher)
+        return matcher
+
+
 def pbx_ip_address_check(request, allowed_addresses):
-    ipw = IpWare()
+    # allowed_addresses may be an AllowedAddressMatcher or a list of networks.
+    if not isinstance(allowed_addresses, AllowedAddressMatcher):
+        allowed_addresses = AllowedAddressMatcher(allowed_addresses)
     ip, trusted_route = ipw.get_client_ip(request.META)
-    for ip_net in allowed_addresses:
-        try:
-            ipa = ipaddress.ip_network(ip_net)
-        except:
-            ipa = ()
-            continue
-        if ip in ipa:
-            return True
-    return False
+    return allowed_addresses.match(ip)
@@ -0,0 +1,105 @@
+#!/home/django-pbx/envdpbx/bin/python
+#
+#    DjangoPBX
+#
+#    MIT License
+#
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
+#
+#    Permission is hereby granted, free of charge, to any person obtaining a copy
+#    of this software and associated documentation files (the "Software"), to deal
+#    in the Software without restriction, including without limitation the rights
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#    copies of the Software, and to permit persons to whom the Software is
+#    furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in all
+#    copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#    SOFTWARE.
+#
+#    Contributor(s):
+#    Adrian Fretwell <adrian@djangopbx.com>
+#
+
+import sys
+import time
+import argparse
+from resources.pbx.amqpconnection import AmqpConnection
+from resources.pbx.fseventgen import FsEventGenerator
+
+
+def parse_domains(spec):
+    # example.com:100-149,other.com:200-209
+    domains = {}
+    for part in spec.split(','):
+        name, sep, numbers = part.partition(':')
+        first, sep, last = (numbers or '100-109').partition('-')
+        domains[name] = [str(n) for n in range(int(first), int(last or first) + 1)]
+    return domains
+
+
+def main():
+    broker = '127.0.0.1'
+    broker_port = 5672
+    broker_user = 'djangopbx'
+    broker_password = 'djangopbx-insecure'
+    if args.host:
+        broker = args.host
+    if args.port:
+        broker_port = args.port
+    if args.user:
+        broker_user = args.user
+    if args.password:
+        broker_password = args.password
+    gen = FsEventGenerator(parse_domains(args.domains), args.hostname, args.variables, args.seed)
+    out = None
+    if args.output:
+        out = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+    else:
+        mq = AmqpConnection(broker, broker_port, broker_user, broker_password)
+        mq.connect()
+    start = time.monotonic()
+    for routing_key, body in gen.stream(args.calls, args.concurrency):
+        if out:
+            out.write(body)
+            out.write(b'\n')
+        else:
+            mq.channel.basic_publish('TAP.Events', routing_key, body)
+        if args.rate:
+            delay = start + gen.events / args.rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    elapsed = time.monotonic() - start
+    if out:
+        out.flush()
+    else:
+        mq.connection.close()
+    print('%d events of %d calls in %.1f seconds, %.0f events/s' % (
+        gen.events, gen.calls, elapsed, gen.events / elapsed if elapsed else 0), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CLI AMQP FreeSWITCH Synthetic Event Generator')
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--user')
+    parser.add_argument('--password')
+    parser.add_argument(
+        '--domains', default='example.com:100-109', help='Comma separated domain:first-last extension ranges'
+        )
+    parser.add_argument('--calls', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=50, help='Calls in progress at once')
+    parser.add_argument('--variables', type=int, default=150, help='Padding channel variables per event')
+    parser.add_argument('--rate', type=float, default=0, help='Events per second, 0 for as fast as possible')
+    parser.add_argument('--hostname', default='fsgen', help='FreeSWITCH-Hostname of the events')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output', help='Write the events to this file, - for stdout, instead of publishing')
+    args = parser.parse_args()
+    main()
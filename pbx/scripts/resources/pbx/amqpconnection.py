@@ -46,7 +46,8 @@ class AmqpConnection:
 
     def __init__(self, hostname='localhost', port=5672, username='guest',
                     password='djangopbx-insecure', routing=None,
-                    auto_delete=False, event_queue_name=None):
+                    auto_delete=False, event_queue_name=None,
+                    auto_ack=True, prefetch=0):
         self.rabbithostname = hostname
         self.port = port
         self.username = username
@@ -54,6 +55,10 @@ class AmqpConnection:
         self.connection = None
         self.channel = None
         self.auto_delete = auto_delete
+        # With auto_ack False the on_message callback must acknowledge each message and
+        #  prefetch limits how many may be unacknowledged, 0 is no limit.
+        self.auto_ack = auto_ack
+        self.prefetch = prefetch
         try:
             self.hostname = socket.gethostname()
         except:
@@ -119,18 +124,24 @@ class AmqpConnection:
         #   self.channel.queue_bind(self.queue, exchange='TAP.Events', routing_key='*.*.*.*.*')
         #   self.channel.queue_bind(self.queue, exchange='TAP.Events', routing_key='FreeSWITCH.#')
 
-    def _consume(self, on_message):
+    def _consume(self, on_message, on_stop=None):
         if self.connection.is_closed or self.channel.is_closed:
             self.connect()
             self.setup_queues()
         try:
-            self.channel.basic_consume(queue=self.queue, auto_ack=True, on_message_callback=on_message)
+            if self.prefetch:
+                self.channel.basic_qos(prefetch_count=self.prefetch)
+            self.channel.basic_consume(queue=self.queue, auto_ack=self.auto_ack, on_message_callback=on_message)
             self.channel.start_consuming()
         except KeyboardInterrupt:
             if logger is not None:
                 logger.info('Event Receiver: Received interrupt, shtting down... %s' % self.rabbithostname)
             print('Keyboard interrupt received')
             self.channel.stop_consuming()
+            if on_stop:
+                on_stop()
+                # Run any acknowledgements added by on_stop before closing.
+                self.connection.process_data_events(time_limit=0)
             self.connection.close()
             os._exit(1)
         except pika.exceptions.ChannelClosedByBroker:
@@ -138,7 +149,7 @@ class AmqpConnection:
             if logger is not None:
                 logger.info('Event Receiver: Channel closed by broker exception. %s' % self.rabbithostname)
 
-    def consume(self, on_message):
+    def consume(self, on_message, on_stop=None):
         tries = -1
         backoff = 2
         jitter = 0 # Can be a (min, max) tuple
@@ -147,7 +158,7 @@ class AmqpConnection:
 
         while tries:
             try:
-                return self._consume(on_message)
+                return self._consume(on_message, on_stop)
             except Exception as e:
                 tries -= 1
                 if not tries:
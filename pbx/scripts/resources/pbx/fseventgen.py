@@ -0,0 +1,324 @@
+#
+#    DjangoPBX
+#
+#    MIT License
+#
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
+#
+#    Permission is hereby granted, free of charge, to any person obtaining a copy
+#    of this software and associated documentation files (the "Software"), to deal
+#    in the Software without restriction, including without limitation the rights
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#    copies of the Software, and to permit persons to whom the Software is
+#    furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in all
+#    copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#    SOFTWARE.
+#
+#    Contributor(s):
+#    Adrian Fretwell <adrian@djangopbx.com>
+#
+
+import json
+import time
+import uuid
+import random
+import string
+
+
+class FsEventGenerator:
+
+    # Generates FreeSWITCH JSON events, as published by mod_amqp, for synthetic
+    #  calls between the extensions of the given domains.  Each call is one of the
+    #  scenarios below and produces the CHANNEL_CALLSTATE, DTMF, CHANNEL_HOLD,
+    #  CHANNEL_UNHOLD, PLAYBACK_START, PLAYBACK_STOP, callcenter::info and
+    #  conference::maintenance events of its legs, each leg ending with a
+    #  CHANNEL_HANGUP_COMPLETE.  Calls are dated as if they had just ended, events
+    #  are stamped as they are taken from stream().
+    #
+    # domains is a dict of domain name to a list of extension numbers.  variables
+    #  is the number of padding channel variables added to each event, a real call
+    #  has 150 to 300 channel variables.  Generators given the same core_uuid stand
+    #  for the same switch.
+
+    scenarios = {'local': 5, 'ivr': 2, 'queue': 2, 'conference': 1}
+    routing_key_prefix = 'FreeSWITCH'
+
+    def __init__(self, domains, hostname='fsgen', variables=150, seed=None, core_uuid=None):
+        self.domains = [(d, e) for d, e in domains.items() if e]
+        if not self.domains:
+            raise ValueError('No domains with extensions')
+        self.hostname = hostname
+        self.variables = variables
+        self.random = random.Random(seed)
+        self.core_uuid = core_uuid or str(uuid.uuid4())
+        self.sequence = 0
+        self.calls = 0
+        self.events = 0
+        # The padding is the same for every event so it is encoded once.
+        self.padding = json.dumps({
+            'variable_sip_h_X-Gen-%d' % i: ''.join(self.random.choices(string.ascii_letters, k=24))
+            for i in range(variables)
+            })[1:-1]
+
+    def stream(self, calls, concurrency=50):
+        # Yields (routing key, body) for the events of calls calls, with the events of up to
+        #  concurrency calls interleaved as they would be from a busy switch.
+        active = []
+        started = 0
+        while active or started < calls:
+            while started < calls and len(active) < concurrency:
+                active.append(iter(self.call()))
+                started += 1
+            i = self.random.randrange(len(active))
+            event = next(active[i], None)
+            if event is None:
+                active[i] = active[-1]
+                active.pop()
+                continue
+            yield self.routing_key(event), self.encode(event)
+
+    def encode(self, event):
+        now = time.time()
+        self.sequence += 1
+        self.events += 1
+        event['Event-Date-Timestamp'] = str(int(now * 1000000))
+        event['Event-Date-Local'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
+        event['Event-Date-GMT'] = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(now))
+        event['Event-Sequence'] = str(self.sequence)
+        body = json.dumps(event)
+        if self.padding:
+            body = '%s, %s}' % (body[:-1], self.padding)
+        return body.encode()
+
+    def routing_key(self, event):
+        # The mod_amqp default, FreeSWITCH-Hostname,Event-Name,Event-Subclass,Unique-ID.
+        return '%s.%s.%s.%s.%s' % (
+            self.routing_key_prefix, self.hostname.replace('.', '_'), event['Event-Name'],
+            event.get('Event-Subclass', ''), event.get('Unique-ID', '')
+            )
+
+    def call(self):
+        # The events of one call, in order.
+        self.calls += 1
+        r = self.random
+        domain_name, extensions = r.choice(self.domains)
+        scenario = r.choices(list(self.scenarios), list(self.scenarios.values()))[0]
+        caller = r.choice(extensions)
+        callee = r.choice(extensions)
+        duration = r.randint(5, 300)
+        answered = scenario != 'local' or r.random() < 0.8
+        end = time.time()
+        start = end - duration - r.randint(2, 20)
+        call = {
+            'domain_name': domain_name, 'call_uuid': str(uuid.uuid4()), 'start': start, 'end': end,
+            'answer': start + r.randint(1, 15) if answered else 0, 'caller': caller, 'callee': callee,
+            }
+        a = self.leg(call, caller, callee, 'inbound', True)
+        events = [self.callstate(a, 'RINGING'), ]
+        if scenario == 'local':
+            b = self.leg(call, callee, callee, 'outbound', False)
+            b['bridge'] = a
+            a['bridge'] = b
+            events.append(self.callstate(b, 'RINGING'))
+            if answered:
+                events += [self.callstate(b, 'ACTIVE'), self.callstate(a, 'ACTIVE')]
+                if r.random() < 0.2:
+                    events += [self.hold(b, 'CHANNEL_HOLD', 'HELD'), self.callstate(b, 'HELD'),
+                               self.hold(b, 'CHANNEL_UNHOLD', 'ACTIVE'), self.callstate(b, 'ACTIVE')]
+            events += [self.callstate(b, 'HANGUP'), self.callstate(a, 'HANGUP'),
+                       self.hangup(b, answered), self.hangup(a, answered)]
+            return events
+        events.append(self.callstate(a, 'ACTIVE'))
+        if scenario == 'ivr':
+            for f in ('ivr/ivr-welcome.wav', 'ivr/ivr-please_enter_extension_followed_by_pound.wav'):
+                events += [self.playback(a, 'PLAYBACK_START', f), self.playback(a, 'PLAYBACK_STOP', f)]
+            for digit in callee + '#':
+                events.append(self.dtmf(a, digit))
+        elif scenario == 'queue':
+            # DjangoPBX names call centre queues by their UUID.
+            queue = str(uuid.uuid5(uuid.NAMESPACE_DNS, 'sales.%s' % domain_name))
+            member_uuid = str(uuid.uuid4())
+            a['variables'].update({
+                'variable_cc_queue': queue, 'variable_cc_member_uuid': member_uuid, 'variable_cc_side': 'member',
+                'variable_cc_queue_joined_epoch': str(int(call['answer'])),
+                'variable_cc_member_session_uuid': a['uuid'],
+                })
+            for action in ('member-queue-start', 'agent-offering', 'bridge-agent-start', 'bridge-agent-end',
+                           'member-queue-end'):
+                events.append(self.callcentre(a, action, queue, member_uuid))
+        else:
+            conference = {'name': '3001@%s' % domain_name, 'uuid': str(uuid.uuid4())}
+            a['variables'].update({
+                'variable_conference_name': '3001', 'variable_conference_uuid': conference['uuid'],
+                'variable_conference_member_id': str(r.randint(1, 99)),
+                })
+            events += [self.conference(a, 'add-member', conference), self.dtmf(a, '0'),
+                       self.conference(a, 'del-member', conference)]
+        events += [self.callstate(a, 'HANGUP'), self.hangup(a, answered)]
+        return events
+
+    def leg(self, call, number, destination, direction, a_leg):
+        leg_uuid = call['call_uuid'] if a_leg else str(uuid.uuid4())
+        domain_name = call['domain_name']
+        return {
+            'call': call, 'uuid': leg_uuid, 'number': number, 'destination': destination, 'direction': direction,
+            'a_leg': a_leg, 'channel_name': 'sofia/internal/%s@%s' % (number, domain_name), 'bridge': None,
+            'address': '192.0.2.%d' % self.random.randint(10, 250), 'variables': {
+                'variable_uuid': leg_uuid, 'variable_domain_name': domain_name, 'variable_domain_uuid': '',
+                'variable_user_name': number, 'variable_sip_from_user': call['caller'],
+                'variable_sip_from_host': domain_name, 'variable_sip_to_user': destination,
+                'variable_sip_req_host': domain_name, 'variable_call_direction': 'local',
+                'variable_caller_id_name': call['caller'], 'variable_caller_id_number': call['caller'],
+                'variable_effective_caller_id_name': call['caller'],
+                'variable_effective_caller_id_number': call['caller'],
+                'variable_dialed_user': call['callee'], 'variable_dialed_domain': domain_name,
+                'variable_read_codec': 'PCMU', 'variable_read_rate': '8000', 'variable_write_codec': 'PCMU',
+                'variable_write_rate': '8000', 'variable_remote_media_ip': '192.0.2.20',
+                'variable_rtp_use_codec_name': 'PCMU', 'variable_rtp_use_codec_rate': '8000',
+                },
+            }
+
+    def event(self, leg, event_name, call_state, channel_state='CS_EXECUTE', subclass=None):
+        call = leg['call']
+        answered = call['answer'] and call_state in ('ACTIVE', 'HELD', 'HANGUP')
+        event = {
+            'Event-Name': event_name, 'Core-UUID': self.core_uuid, 'FreeSWITCH-Hostname': self.hostname,
+            'FreeSWITCH-Switchname': self.hostname, 'FreeSWITCH-IPv4': '192.0.2.1', 'FreeSWITCH-IPv6': '::1',
+            'Event-Calling-File': 'switch_channel.c', 'Event-Calling-Function': 'switch_channel_perform_set_callstate',
+            'Event-Calling-Line-Number': '371', 'Channel-State': channel_state, 'Channel-Call-State': call_state,
+            'Channel-State-Number': '4', 'Channel-Name': leg['channel_name'], 'Unique-ID': leg['uuid'],
+            'Call-Direction': leg['direction'], 'Presence-Call-Direction': leg['direction'],
+            'Channel-HIT-Dialplan': 'true' if leg['a_leg'] else 'false', 'Channel-Call-UUID': call['call_uuid'],
+            'Answer-State': 'answered' if answered else 'ringing', 'Caller-Direction': leg['direction'],
+            'Caller-Logical-Direction': leg['direction'], 'Caller-Username': leg['number'],
+            'Caller-Dialplan': 'XML', 'Caller-Caller-ID-Name': call['caller'],
+            'Caller-Caller-ID-Number': call['caller'], 'Caller-Orig-Caller-ID-Name': call['caller'],
+            'Caller-Orig-Caller-ID-Number': call['caller'], 'Caller-Network-Addr': leg['address'],
+            'Caller-ANI': call['caller'], 'Caller-Destination-Number': leg['destination'],
+            'Caller-Unique-ID': leg['uuid'], 'Caller-Source': 'mod_sofia', 'Caller-Context': call['domain_name'],
+            'Caller-Channel-Name': leg['channel_name'], 'Caller-Profile-Index': '1',
+            'Caller-Profile-Created-Time': self.usec(call['start']),
+            'Caller-Channel-Created-Time': self.usec(call['start']),
+            'Caller-Channel-Answered-Time': self.usec(call['answer']) if answered else '0',
+            'Caller-Channel-Progress-Time': '0', 'Caller-Channel-Progress-Media-Time': '0',
+            'Caller-Channel-Hangup-Time': self.usec(call['end']) if call_state == 'HANGUP' else '0',
+            'Caller-Channel-Transfer-Time': '0', 'Caller-Channel-Resurrect-Time': '0',
+            'Caller-Channel-Bridged-Time': '0', 'Caller-Channel-Last-Hold': '0', 'Caller-Channel-Hold-Accum': '0',
+            'Caller-Screen-Bit': 'true', 'Caller-Privacy-Hide-Name': 'false', 'Caller-Privacy-Hide-Number': 'false',
+            }
+        if subclass:
+            event['Event-Subclass'] = subclass
+        other = leg['bridge']
+        if other:
+            event.update({
+                'Other-Type': 'originatee' if leg['a_leg'] else 'originator',
+                'Other-Leg-Direction': other['direction'],
+                'Other-Leg-Username': other['number'], 'Other-Leg-Caller-ID-Name': call['caller'],
+                'Other-Leg-Caller-ID-Number': call['caller'], 'Other-Leg-Network-Addr': other['address'],
+                'Other-Leg-Destination-Number': other['destination'], 'Other-Leg-Unique-ID': other['uuid'],
+                'Other-Leg-Caller-Unique-ID': other['uuid'], 'Other-Leg-Context': call['domain_name'],
+                'Other-Leg-Channel-Name': other['channel_name'],
+                'Other-Leg-Channel-Created-Time': self.usec(call['start']),
+                })
+        event.update(leg['variables'])
+        event['variable_start_stamp'] = self.stamp(call['start'])
+        event['variable_start_epoch'] = str(int(call['start']))
+        return event
+
+    def callstate(self, leg, call_state):
+        channel_state = {'RINGING': 'CS_ROUTING', 'HANGUP': 'CS_HANGUP'}.get(call_state, 'CS_EXECUTE')
+        return self.event(leg, 'CHANNEL_CALLSTATE', call_state, channel_state)
+
+    def hold(self, leg, event_name, call_state):
+        event = self.event(leg, event_name, call_state)
+        event['variable_bridge_channel'] = leg['bridge']['channel_name'] if leg['bridge'] else ''
+        return event
+
+    def dtmf(self, leg, digit):
+        event = self.event(leg, 'DTMF', 'ACTIVE')
+        event.update({'DTMF-Digit': digit, 'DTMF-Duration': '2000', 'DTMF-Source': 'RTP'})
+        return event
+
+    def playback(self, leg, event_name, path):
+        event = self.event(leg, event_name, 'ACTIVE')
+        event.update({
+            'Playback-File-Path': '/usr/share/freeswitch/sounds/en/us/callie/%s' % path,
+            'variable_current_application': 'playback', 'variable_current_application_data': path,
+            })
+        if event_name == 'PLAYBACK_STOP':
+            event.update({'Playback-Status': 'done', 'variable_playback_seconds': str(self.random.randint(2, 6))})
+        return event
+
+    def callcentre(self, leg, action, queue, member_uuid):
+        call = leg['call']
+        event = self.event(leg, 'CUSTOM', 'ACTIVE', subclass='callcenter::info')
+        event.update({
+            'CC-Queue': queue, 'CC-Action': action, 'CC-Count': '1', 'CC-Member-UUID': member_uuid,
+            'CC-Member-Session-UUID': leg['uuid'], 'CC-Member-CID-Name': call['caller'],
+            'CC-Member-CID-Number': call['caller'], 'CC-Member-Joined-Time': str(int(call['answer'])),
+            'variable_current_application': 'callcenter', 'variable_current_application_data': queue,
+            })
+        if action != 'member-queue-start':
+            event.update({
+                'CC-Agent': '%s@%s' % (call['callee'], call['domain_name']), 'CC-Agent-Type': 'callback',
+                'CC-Agent-System': 'single_box', 'CC-Agent-UUID': str(uuid.uuid4()),
+                'CC-Agent-Called-Time': str(int(call['answer']) + 2),
+                })
+        if action in ('bridge-agent-end', 'member-queue-end'):
+            event.update({
+                'CC-Cause': 'Terminated', 'CC-Hangup-Cause': 'NORMAL_CLEARING',
+                'CC-Member-Leaving-Time': str(int(call['end'])),
+                'CC-Agent-Answered-Time': str(int(call['answer']) + 5),
+                })
+        return event
+
+    def conference(self, leg, action, conference):
+        event = self.event(leg, 'CUSTOM', 'ACTIVE', subclass='conference::maintenance')
+        event.update({
+            'Conference-Name': conference['name'], 'Conference-Domain': leg['call']['domain_name'],
+            'Conference-Size': '1' if action == 'add-member' else '0', 'Conference-Ghosts': '0',
+            'Conference-Profile-Name': 'default', 'Conference-Unique-ID': conference['uuid'],
+            'Member-ID': leg['variables']['variable_conference_member_id'], 'Member-Type': 'member',
+            'Action': action,
+            })
+        return event
+
+    def hangup(self, leg, answered):
+        call = leg['call']
+        event = self.event(leg, 'CHANNEL_HANGUP_COMPLETE', 'HANGUP', 'CS_REPORTING')
+        duration = int(call['end'] - call['start'])
+        billsec = int(call['end'] - call['answer']) if answered else 0
+        event.update({
+            'Hangup-Cause': 'NORMAL_CLEARING' if answered else 'NO_ANSWER',
+            'variable_hangup_cause': 'NORMAL_CLEARING' if answered else 'NO_ANSWER',
+            'variable_hangup_cause_q850': '16' if answered else '19',
+            'variable_sip_hangup_disposition': 'recv_bye' if leg['a_leg'] else 'send_bye',
+            'variable_end_stamp': self.stamp(call['end']), 'variable_end_epoch': str(int(call['end'])),
+            'variable_duration': str(duration), 'variable_mduration': str(duration * 1000),
+            'variable_billsec': str(billsec), 'variable_billmsec': str(billsec * 1000),
+            'variable_waitsec': str(int(call['answer'] - call['start'])) if answered else '0',
+            'variable_progressmsec': '120', 'variable_progress_mediamsec': '0',
+            'variable_rtp_audio_in_mos': '4.5' if answered else '0',
+            'variable_last_app': 'bridge' if leg['bridge'] else 'hangup', 'variable_last_arg': '',
+            })
+        if answered:
+            event['variable_answer_stamp'] = self.stamp(call['answer'])
+            event['variable_answer_epoch'] = str(int(call['answer']))
+        if leg['bridge']:
+            event['variable_bridge_uuid'] = leg['bridge']['uuid']
+        return event
+
+    def stamp(self, t):
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))
+
+    def usec(self, t):
+        return str(int(t * 1000000))
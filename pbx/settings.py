@@ -198,12 +198,21 @@ DATABASES = {
         'USER': 'djangopbx',
         'PASSWORD': 'postgres-insecure-abcdef9876543210',
         'HOST': '127.0.0.1',
-        'PORT': '5432'
-# removed CONN_MAX_AGE as it was causing a Server 500 error after a uwsgi restart/reload
-# exceptions were:
-#      psycopg2.OperationalError: SSL SYSCALL error: EOF detected
-#      AttributeError: 'SessionStore' object has no attribute '_session_cache'
-#        'CONN_MAX_AGE': 300
+        'PORT': '5432',
+        # CONN_MAX_AGE was causing a Server 500 error after a uwsgi restart/reload
+        # exceptions were:
+        #      psycopg2.OperationalError: SSL SYSCALL error: EOF detected
+        #      AttributeError: 'SessionStore' object has no attribute '_session_cache'
+        # because workers shared connections opened before the fork, see pbx/dbconnections.py.
+        # Persistent connections are now safe and are health checked before they are reused,
+        # set CONN_MAX_AGE, eg. 300, here and for 'freeswitch' to keep them.  PostgreSQL then
+        # holds a connection per database for every uwsgi process and thread, every ASGI
+        # xmlhandler build thread (PBX_XMLHANDLER_ASYNC_DB_CONNECTIONS) and every eventreceiver
+        # worker, which must fit within max_connections.
+        'CONN_MAX_AGE': 0,
+        'CONN_HEALTH_CHECKS': True,
+        # Identifies the connections that flushdbconnections may end.
+        'OPTIONS': {'application_name': 'djangopbx'}
     },
     'freeswitch': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -211,10 +220,18 @@ DATABASES = {
         'USER': 'freeswitch',
         'PASSWORD': 'postgres-insecure-abcdef9876543210',
         'HOST': '127.0.0.1',
-        'PORT': '5432'
+        'PORT': '5432',
+        'CONN_MAX_AGE': 0,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'application_name': 'djangopbx'}
     }
 }
 
+# Dedicated, never closed, connection for the read only xmlhandler queries, used when
+# PBX_XMLHANDLER_DATABASE is True.  HOST may be changed to point at a read replica.
+DATABASES['xmlhandler'] = dict(DATABASES['default'], CONN_MAX_AGE=None, TEST={'MIRROR': 'default'})
+DATABASE_ROUTERS = ['pbx.dbconnections.XmlHandlerRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -322,13 +339,13 @@ MESSAGE_TAGS = {
 
 # event socket connection info
 EVSKT = ('127.0.0.1', 8021, 'ClueCon')
+# Idle event socket connections kept open for reuse per worker process and switch, 0 to close after each use.
+PBX_EVENT_SOCKET_POOL = 4
 
 # show all tables in Admin - useful for imports and exports
 PBX_ADMIN_SHOW_ALL = False
 
-# New in Django 4.1.   If set to True, existing persistent database connections will be
-# health checked before they are reused in each request performing database access.
-CONN_HEALTH_CHECKS = True
+# CONN_HEALTH_CHECKS, new in Django 4.1, is set for each connection in DATABASES.
 
 STORAGES = {
     'default': {
@@ -351,5 +368,55 @@ PBX_FILESTORES = ['localhost']
 PBX_DEFAULT_FILESTORE = 0
 # Use message broker or local event socket for commands.
 PBX_USE_LOCAL_EVENT_SOCKET = True
+# Seconds to wait for each FreeSWITCH to reply to a command sent through the message broker.
+PBX_FREESWITCH_TIMEOUT = 3
+# Seconds to wait for a FreeSWITCH that did not reply to its last command, until it replies again.
+PBX_FREESWITCH_MISSED_TIMEOUT = 0.5
 # Use remote file storage server or local file storage.
 PBX_USE_LOCAL_FILE_STORAGE = True
+# Answer xml_curl directory requests from a per worker index of prebuilt user XML.
+PBX_XMLHANDLER_DIRECTORY_INDEX = True
+# Maximum age in seconds of a domain in the directory index before it is reloaded.
+PBX_XMLHANDLER_DIRECTORY_INDEX_TTL = 3600
+# Answer single context type public dialplan requests from a per worker index of inbound routes.
+PBX_XMLHANDLER_INBOUND_ROUTE_INDEX = True
+# Maximum age in seconds of a hostname in the inbound route index before it is reloaded.
+PBX_XMLHANDLER_INBOUND_ROUTE_INDEX_TTL = 3600
+# Seconds a stale xmlhandler document may be served while one worker rebuilds it.
+PBX_XMLHANDLER_CACHE_STALE = 60
+# Maximum seconds to wait for another worker to build a missing xmlhandler document.
+PBX_XMLHANDLER_BUILD_WAIT = 1.0
+# Route xml_curl requests to the async xmlhandler views, only of benefit when served by pbx/asgi.py.
+PBX_XMLHANDLER_ASYNC_VIEWS = False
+# Database connections the ASGI workers may hold for async xmlhandler views, shared by PBX_ASGI_WORKERS.
+#  Each worker builds one response per connection at a time, on a thread of its own, so a worker
+#  builds at most PBX_XMLHANDLER_ASYNC_DB_CONNECTIONS // PBX_ASGI_WORKERS responses at once and
+#  further requests wait for a thread.  Keep it within PostgreSQL max_connections less the
+#  connections used by uwsgi, the eventreceiver and FreeSWITCH.
+PBX_XMLHANDLER_ASYNC_DB_CONNECTIONS = 32
+# Number of ASGI worker processes serving the async xmlhandler views, eg. uvicorn --workers.
+PBX_ASGI_WORKERS = 2
+# Answer xml_curl requests using the dedicated 'xmlhandler' database connection.
+PBX_XMLHANDLER_DATABASE = False
+# Seconds between database connection checks in long running commands such as eventreceiver.
+PBX_DB_CHECK_INTERVAL = 10
+# Number of CDR and call timeline records the eventreceiver writes in one transaction.
+PBX_EVENTRECEIVER_BATCH = 500
+# Maximum milliseconds a record waits in the eventreceiver before it is written.
+PBX_EVENTRECEIVER_FLUSH_MS = 200
+# Records the eventreceiver may hold waiting to be written before it stops reading events.
+PBX_EVENTRECEIVER_QUEUE = 10000
+# Batches of this many call timeline records or more are written with COPY.
+PBX_EVENTRECEIVER_COPY_THRESHOLD = 1000
+# Events the broker sends the eventreceiver before they are acknowledged, larger than PBX_EVENTRECEIVER_BATCH.
+PBX_EVENTRECEIVER_PREFETCH = 2000
+# File to hold eventreceiver records while the database is unavailable, None to hold the events on the broker.
+PBX_EVENTRECEIVER_SPOOL = '/home/django-pbx/spool/eventreceiver.spool'
+# Worker processes handling events for the eventreceiver, each call is handled by one worker.
+PBX_EVENTRECEIVER_WORKERS = 1
+# Maximum age in seconds of a domain in the eventreceiver extension index before it is reloaded.
+PBX_EVENTRECEIVER_EXTENSION_INDEX_TTL = 3600
+# Seconds between eventreceiver metrics updates shown at /status/eventreceiver/, 0 to turn off.
+PBX_EVENTRECEIVER_METRICS_INTERVAL = 10
+# Seconds a recording directory listing may lag its mtime, at least the NFS acdirmax (60) for recordings on NFS.
+PBX_RECORDING_INDEX_MTIME_MARGIN = 2
@@ -14,3 +14,6 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pbx.settings')
 
 application = get_wsgi_application()
+
+from pbx.dbconnections import fork_safe_connections  # noqa: E402
+fork_safe_connections()
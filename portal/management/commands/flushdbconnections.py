@@ -26,18 +26,45 @@
 #    Adrian Fretwell <adrian@djangopbx.com>
 #
 
-import os
-from pathlib import Path
 from django.core.management.base import BaseCommand
-from django.core.management import call_command
-from django.apps import apps
-from django.db import connections, connection
+from django.db import connections, DatabaseError
+from django.utils.translation import gettext_lazy as _
 
 
 class Command(BaseCommand):
     help = 'Re-establish database connections'
 
+    # The persistent connections of running workers belong to those processes, so
+    #  they are ended on the server instead.  Each worker's CONN_HEALTH_CHECKS then
+    #  finds its connection unusable and opens a new one before the next query.
+    #  Only connections with the application_name set in the database OPTIONS are
+    #  ended, not those of FreeSWITCH or anything else using the same database user.
+    terminate_sql = (
+        'SELECT pg_terminate_backend(pid) FROM pg_stat_activity '
+        'WHERE datname = current_database() AND usename = current_user '
+        'AND application_name = %s AND pid <> pg_backend_pid() AND state = ANY(%s)'
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help=_('Also end connections that are idle in a transaction'))
+
     def handle(self, *args, **kwargs):
+        states = ['idle']
+        if kwargs['all']:
+            states += ['idle in transaction', 'idle in transaction (aborted)']
+        flushed = set()
         for conn in connections.all():
-            conn.close_if_unusable_or_obsolete()
-    print('Ok')
+            key = (conn.settings_dict['HOST'], conn.settings_dict['PORT'], conn.settings_dict['NAME'])
+            application_name = conn.settings_dict.get('OPTIONS', {}).get('application_name')
+            if not conn.vendor == 'postgresql' or not application_name or key in flushed:
+                continue
+            flushed.add(key)
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(self.terminate_sql, [application_name, states])
+                    self.stdout.write('%s: %d connections ended' % (conn.alias, cursor.rowcount))
+            except DatabaseError as e:
+                self.stderr.write('%s: %s' % (conn.alias, e))
+        connections.close_all()
+        self.stdout.write('Ok')
@@ -32,10 +32,8 @@ from rest_framework import permissions
 from django_filters.rest_framework import DjangoFilterBackend
 from django.http import HttpResponse, HttpResponseNotFound
 from django.views.decorators.csrf import csrf_exempt
-from django.core.cache import cache
-from tenants.pbxsettings import PbxSettings
 from pbx.commonfunctions import DomainUtils
-from pbx.pbxipaddresscheck import pbx_ip_address_check, loopback_default
+from pbx.pbxipaddresscheck import pbx_ip_address_check, AllowedAddresses
 from pbx.putuploadhandler import putuploadhandler
 
 from pbx.restpermissions import (
@@ -99,14 +97,7 @@ class CallRecordingViewSet(viewsets.ModelViewSet):
 
 
 def rec_check_address(request):
-    aa_cache_key = 'recordings:allowed_addresses'
-    aa = cache.get(aa_cache_key)
-    if not aa:
-        aa = PbxSettings().default_settings('recordings', 'allowed_address', 'array')
-        if not aa:
-            aa = loopback_default
-        cache.set(aa_cache_key, aa)
-    if not pbx_ip_address_check(request, aa):
+    if not pbx_ip_address_check(request, AllowedAddresses('recordings').matcher()):
         return False
     return True
 
@@ -46,4 +46,6 @@ urlpatterns = [
     path('fsregdetail/<str:sip_profile>/<str:sip_user>/<str:host>/', views.fsregdetail, name='fsregdetail'),
     path('fsactivecalls/', views.fsactivecalls, name='fsactivecalls'),
     path('fsactivecalls/<str:realm>/', views.fsactivecalls, name='fsactivecalls'),
+    path('eventreceiver/', views.eventreceiver, name='eventreceiver'),
+    path('eventreceiver/metrics/', views.eventreceiver_metrics, name='eventreceiver_metrics'),
 ]
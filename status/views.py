@@ -30,7 +30,10 @@ import uuid
 import re
 import sys
 import json
+import time
 import datetime
+from django.http import HttpResponse, HttpResponseNotFound
+from django.utils.html import escape
 from django.utils.http import urlsafe_base64_decode
 from rest_framework import viewsets
 from rest_framework import views
@@ -45,10 +48,12 @@ from django.contrib import messages
 from pbx.commonfunctions import shcommand, get_version
 from pbx.devicecfgevent import DeviceCfgEvent
 from pbx.fscmdabslayer import FsCmdAbsLayer
+from pbx.pbxipaddresscheck import pbx_ip_address_check, AllowedAddresses
 from pbx.restpermissions import (
     AdminApiAccessPermission
 )
 from switch.models import Modules
+from switch.eventmetrics import EventMetrics, Histogram
 from .forms import LogViewerForm
 from .serializers import (
     FsRegistrationsSerializer, FsActiveCallsSerializer
@@ -256,10 +261,7 @@ def fsregistrations(request, realm=None):
                     'info': info, 'th': th, 'act': act, 'title': 'Registrations'})
 
     unixts = int(datetime.datetime.now().timestamp())
-    es.clear_responses()
-    es.send('api show registrations as json')
-    es.process_events()
-    es.get_responses()
+    es.scatter('api show registrations as json')
     es.disconnect()
     for resp in es.responses:
         try:
@@ -395,16 +397,91 @@ def fsactivecalls(request, realm=None):
         return render(request, 'actiontable.html', {'refresher': 'fsactivecalls', 'showall': 'fsactivecalls',
                     'info': [], 'th': th, 'act': act, 'title': 'Active Calls'})
 
-    es.clear_responses()
-    es.send('api show channels as json')
-    es.process_events()
-    es.get_responses()
+    es.scatter('api show channels as json')
     es.disconnect()
     info = process_active_calls_responses(False, realm, es.responses)
     return render(request, 'actiontable.html', {'refresher': 'fsactivecalls', 'showall': 'fsactivecalls',
                     'info': info, 'th': th, 'act': act, 'title': 'Active Calls'})
 
 
+def histogram_summary(h):
+    # Mean and 99th percentile bucket bound, > for above the last bound.
+    if not h or not h['count']:
+        return '-'
+    p99 = Histogram.quantile(h, 0.99)
+    return '%.1f / %s' % (h['sum'] / h['count'], ('%g' % p99) if p99 is not None else '&gt;%g' % h['le'][-2])
+
+
+@staff_member_required
+def eventreceiver(request):
+    th = [
+        _('Process'), _('Updated'), _('Events / s'), _('Events'), _('Errors'), _('Lag ms (last / max)'),
+        _('Handler ms (mean / p99)'), _('Flush ms (mean / p99)'), _('Batch (mean / p99)'), _('Queue'), _('Spool')
+        ]
+    info = {}
+    now = time.time()
+    for name, m in sorted(EventMetrics.collect().items()):
+        if m['worker'] is not None:
+            name = '%s (%s %s)' % (name, _('worker'), m['worker'])
+        handlers = '<br>'.join(
+            '%s: %s' % (escape(k), histogram_summary(h)) for k, h in sorted(m['latency_ms'].items())
+            )
+        w = m['writer'] or {}
+        queue = '%d / %d' % (w['queue'], w['max_queue']) if w else '-'
+        spool = '-'
+        if w:
+            spool = '%d KB%s' % (w['spool_bytes'] // 1024, ' (%s)' % _('spooling') if w['spooling'] else '')
+        info[escape(name)] = [
+            '%ds' % (now - m['updated']), '%.1f' % m['rate'], sum(m['events'].values()), m['errors'],
+            '%.0f / %.0f' % (m['lag_ms']['last'], m['lag_ms']['max']), handlers or '-',
+            histogram_summary(m['flush_ms']), histogram_summary(m['batch']), queue, spool
+            ]
+    return render(request, 'infotablemulti.html', {
+        'refresher': '/status/eventreceiver/', 'info': info, 'th': th, 'title': 'Event Receiver'
+        })
+
+
+def prometheus_histogram(lines, metric, labels, h):
+    n = 0
+    for le, count in zip(h['le'], h['counts']):
+        n += count
+        lines.append('%s_bucket{%s,le="%s"} %d' % (metric, labels, '+Inf' if le is None else le, n))
+    lines.append('%s_sum{%s} %s' % (metric, labels, h['sum']))
+    lines.append('%s_count{%s} %d' % (metric, labels, h['count']))
+
+
+def eventreceiver_metrics(request):
+    # Eventreceiver metrics as JSON, or in the Prometheus text format with ?format=prometheus,
+    #  for monitoring systems at the addresses allowed by the metrics allowed_address default settings.
+    if not pbx_ip_address_check(request, AllowedAddresses('metrics').matcher()):
+        return HttpResponseNotFound()
+    metrics = EventMetrics.collect()
+    if request.GET.get('format') != 'prometheus':
+        return HttpResponse(json.dumps(metrics), content_type='application/json')
+    lines = []
+    for name, m in sorted(metrics.items()):
+        labels = 'process="%s"' % name
+        for k, v in sorted(m['events'].items()):
+            lines.append('eventreceiver_events_total{%s,type="%s"} %d' % (labels, k.replace('"', ''), v))
+        lines.append('eventreceiver_errors_total{%s} %d' % (labels, m['errors']))
+        lines.append('eventreceiver_events_per_second{%s} %s' % (labels, m['rate']))
+        lines.append('eventreceiver_lag_ms{%s} %s' % (labels, m['lag_ms']['last']))
+        lines.append('eventreceiver_lag_max_ms{%s} %s' % (labels, m['lag_ms']['max']))
+        lines.append('eventreceiver_updated_seconds{%s} %s' % (labels, m['updated']))
+        prometheus_histogram(lines, 'eventreceiver_lag_ms_histogram', labels, m['lag_ms']['histogram'])
+        for k, h in sorted(m['latency_ms'].items()):
+            prometheus_histogram(
+                lines, 'eventreceiver_handler_ms', '%s,type="%s"' % (labels, k.replace('"', '')), h
+                )
+        prometheus_histogram(lines, 'eventreceiver_flush_ms', labels, m['flush_ms'])
+        prometheus_histogram(lines, 'eventreceiver_batch_size', labels, m['batch'])
+        if m['writer']:
+            lines.append('eventreceiver_queue{%s} %d' % (labels, m['writer']['queue']))
+            lines.append('eventreceiver_spool_bytes{%s} %d' % (labels, m['writer']['spool_bytes']))
+    lines.append('')
+    return HttpResponse('\n'.join(lines), content_type='text/plain; version=0.0.4')
+
+
 class FsRegistrationsViewSet(viewsets.ReadOnlyModelViewSet):
     """
     API endpoint that allows Switch Registrations to be viewed.
@@ -425,10 +502,7 @@ class FsRegistrationsViewSet(viewsets.ReadOnlyModelViewSet):
         es = FsCmdAbsLayer()
         if not es.connect():
             return Response({'status': 'err', 'message': 'Broker/Socket Error'})
-        es.clear_responses()
-        es.send('api show registrations as json')
-        es.process_events()
-        es.get_responses()
+        es.scatter('api show registrations as json')
         es.disconnect()
         for resp in es.responses:
             try:
@@ -504,10 +578,7 @@ class FsActiveCallsViewSet(viewsets.ReadOnlyModelViewSet):
         es = FsCmdAbsLayer()
         if not es.connect():
             return Response({'status': 'err', 'message': 'Broker/Socket Error'})
-        es.clear_responses()
-        es.send('api show channels as json')
-        es.process_events()
-        es.get_responses()
+        es.scatter('api show channels as json')
         channel_data = process_active_calls_responses(True, 'all', es.responses)
         es.disconnect()
 
@@ -28,6 +28,7 @@
 #
 
 from django.apps import AppConfig
+from django.db.models.signals import post_save, post_delete
 from django.utils.translation import gettext_lazy as _
 
 
@@ -40,3 +41,17 @@ class SwitchConfig(AppConfig):
     pbx_subcategory = ''
     pbx_version = '1.0'
     pbx_license = 'MIT License'
+
+    def ready(self):
+        from accounts.models import Extension
+        from tenants.models import Domain
+        from . import signals
+        for signal in (post_save, post_delete):
+            signal.connect(
+                signals.extension_index_changed,
+                sender=Extension, weak=False, dispatch_uid="switch:accounts_Extension"
+                )
+            signal.connect(
+                signals.extension_index_domain_changed,
+                sender=Domain, weak=False, dispatch_uid="switch:tenants_Domain"
+                )
@@ -0,0 +1,316 @@
+#
+#    DjangoPBX
+#
+#    MIT License
+#
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
+#
+#    Permission is hereby granted, free of charge, to any person obtaining a copy
+#    of this software and associated documentation files (the "Software"), to deal
+#    in the Software without restriction, including without limitation the rights
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#    copies of the Software, and to permit persons to whom the Software is
+#    furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in all
+#    copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#    SOFTWARE.
+#
+#    Contributor(s):
+#    Adrian Fretwell <adrian@djangopbx.com>
+#
+
+import json
+import datetime
+from functools import lru_cache
+from django.db.models.base import ModelState
+from django.utils import timezone
+from xmlcdr.models import XmlCdr, CallTimeline
+
+# orjson, if installed, decodes FreeSWITCH events in about half the time of json.
+try:
+    import orjson
+    decode_event = orjson.loads
+except ImportError:
+    decode_event = json.loads
+
+
+def to_int(value):
+    if not value:
+        return 0
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        number = 0
+    return number
+
+
+def to_float(value):
+    if not value:
+        return 0.0
+    try:
+        number = round(float(value), 2)
+    except (TypeError, ValueError):
+        number = 0.0
+    return number
+
+
+@lru_cache(maxsize=4096)
+def local_stamp(value, tz):
+    try:
+        return timezone.make_aware(datetime.datetime.fromisoformat(value), tz)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_stamp(value):
+    # FreeSWITCH local time stamps, 'YYYY-MM-DD HH:MM:SS', in the current time zone.
+    #  The events of a call share a handful of stamps so they are parsed once.
+    if not value:
+        return None
+    return local_stamp(value, timezone.get_current_timezone())
+
+
+class FieldMap():
+
+    # Creates model instances from event fields.  The map is a list of
+    #  (attribute, event key, conversion, default) where conversion is None for the
+    #  value as is, or 'int', 'float' or 'stamp', and conversion and default may be
+    #  left out.  An event key of None sets the converted default.
+    #
+    # The list is compiled once into a function of straight line assignments, the
+    #  same as writing them out by hand.  Instances start as a copy of the model's
+    #  field defaults which takes a fraction of the time of Model.__init__() for
+    #  models with as many fields as CallTimeline.
+
+    conversions = {'int': to_int, 'float': to_float, 'stamp': to_stamp}
+
+    def __init__(self, model, *fields):
+        self.model = model
+        self.defaults = {}
+        self.callable_defaults = []
+        for f in model._meta.concrete_fields:
+            if f.has_default() and callable(f.default):
+                self.callable_defaults.append((f.attname, f.default))
+            else:
+                self.defaults[f.attname] = f.get_default()
+        self.fields = [f for fl in fields for f in fl]
+        lines = ['def extract(obj, event):', '    get = event.get']
+        for field in self.fields:
+            attribute, key, conversion, default = (tuple(field) + (None, None))[:4]
+            if not attribute.isidentifier():
+                raise ValueError('Invalid attribute name %r' % attribute)
+            if key is None:
+                value = repr(self.conversions[conversion](default) if conversion else default)
+            elif default is None:
+                value = 'get(%r)' % key
+            else:
+                value = 'get(%r, %r)' % (key, default)
+            if key is not None and conversion:
+                value = '%s(%s)' % (self.conversions[conversion].__name__, value)
+            lines.append('    obj.%s = %s' % (attribute, value))
+        namespace = {f.__name__: f for f in self.conversions.values()}
+        exec(compile('\n'.join(lines), '<FieldMap>', 'exec'), namespace)
+        self.extract = namespace['extract']
+
+    def new(self, event, **kwargs):
+        obj = self.model.__new__(self.model)
+        obj.__dict__.update(self.defaults)
+        obj._state = ModelState()
+        for attname, default in self.callable_defaults:
+            obj.__dict__[attname] = default()
+        self.extract(obj, event)
+        for attribute, value in kwargs.items():
+            setattr(obj, attribute, value)
+        return obj
+
+
+cdr_fields = [
+    ('accountcode',               'variable_accountcode'),
+    ('direction',                 'variable_call_direction', None, 'none'),
+    ('start_epoch',               'variable_start_epoch', 'int'),
+    ('answer_epoch',              'variable_answer_epoch', 'int'),
+    ('answer_stamp',              'variable_answer_stamp', 'stamp'),
+    ('end_epoch',                 'variable_end_epoch', 'int'),
+    ('end_stamp',                 'variable_end_stamp', 'stamp'),
+    ('duration',                  'variable_duration', 'int'),
+    ('mduration',                 'variable_mduration', 'int'),
+    ('billsec',                   'variable_billsec', 'int'),
+    ('billmsec',                  'variable_billmsec', 'int'),
+    ('bridge_uuid',               'variable_bridge_uuid'),
+    ('read_codec',                'variable_read_codec'),
+    ('read_rate',                 'variable_read_rate'),
+    ('write_codec',               'variable_write_codec'),
+    ('write_rate',                'variable_write_rate'),
+    ('remote_media_ip',           'variable_remote_media_ip'),
+    ('rtp_audio_in_mos',          'variable_rtp_audio_in_mos', 'float'),
+    ('last_app',                  'variable_last_app'),
+    ('last_arg',                  'variable_last_arg'),
+    ('cc_side',                   'variable_cc_side'),
+    ('cc_member_uuid',            'variable_cc_member_uuid'),
+    ('cc_queue_joined_epoch',     'variable_cc_queue_joined_epoch', 'int'),
+    ('cc_queue',                  'variable_cc_queue'),
+    ('cc_member_session_uuid',    'variable_cc_member_session_id'),
+    ('cc_agent_uuid',             'variable_cc_agent_uuid'),
+    ('cc_agent',                  'variable_cc_agent'),
+    ('cc_agent_type',             'variable_cc_agent_type'),
+    ('cc_agent_bridged',          'variable_cc_agent_bridged'),
+    ('cc_queue_answered_epoch',   'variable_cc_queue_answered_epoch', 'int'),
+    ('cc_queue_terminated_epoch', 'variable_cc_queue_terminated_epoch', 'int'),
+    ('cc_queue_canceled_epoch',   'variable_cc_queue_canceled_epoch', 'int'),
+    ('cc_cancel_reason',          'variable_cc_cancel_reason'),
+    ('cc_cause',                  'variable_cc_cause'),
+    ('waitsec',                   'variable_waitsec', 'int'),
+    ('conference_name',           'variable_conference_name'),
+    ('conference_uuid',           'variable_conference_uuid'),
+    ('conference_member_id',      'variable_conference_member_id'),
+    ('hangup_cause',              'variable_hangup_cause'),
+    ('hangup_cause_q850',         'variable_hangup_cause_q850', 'int'),
+    ('sip_hangup_disposition',    'variable_sip_hangup_disposition'),
+    ]
+
+ctl_event_fields = [
+    ('core_uuid',              'Core-UUID'),
+    ('hostname',               'FreeSWITCH-Hostname'),
+    ('switchame',              'FreeSWITCH-Switchname'),
+    ('switch_ipv4',            'FreeSWITCH-IPv4'),
+    ('switch_ipv6',            'FreeSWITCH-IPv6'),
+    ('call_uuid',              'Channel-Call-UUID'),
+    ('event_name',             'Event-Name'),
+    ('event_subclass',         'Event-Subclass'),
+    ('event_date_local',       'Event-Date-Local'),
+    ('event_epoch',            'Event-Date-Timestamp', 'int'),
+    ('event_sequence',         'Event-Sequence', 'int'),
+    ('event_calling_file',     'Event-Calling-File'),
+    ('event_calling_function', 'Event-Calling-Function'),
+    ]
+
+ctl_channel_fields = [
+    ('direction',                     'Call-Direction'),
+    ('other_leg_direction',           'Other-Leg-Direction'),
+    ('context',                       'Caller-Context'),
+    ('other_leg_context',             'Other-Leg-Context'),
+    ('hit_dialplan',                  'Channel-HIT-Dialplan', None, 'false'),
+    ('caller_user_name',              'Caller-Username'),
+    ('caller_ani',                    'Caller-ANI'),
+    ('other_leg_user_name',           'Other-Leg-Username'),
+    ('caller_uuid',                   'Caller-Unique-ID'),
+    ('other_leg_caller_uuid',         'Other-Leg-Caller-Unique-ID'),
+    ('channel_name',                  'Caller-Channel-Name'),
+    ('channel_state',                 'Channel-State'),
+    ('channel_call_state',            'Channel-Call-State'),
+    ('answer_state',                  'Answer-State'),
+    ('caller_id_name',                'Caller-Caller-ID-Name'),
+    ('other_leg_caller_id_name',      'Other-Leg-Caller-ID-Name'),
+    ('caller_id_number',              'Caller-Caller-ID-Number'),
+    ('other_leg_caller_id_number',    'Other-Leg-Callee-ID-Number'),
+    ('caller_destination',            'Caller-Destination-Number'),
+    ('other_leg_caller_destination',  'Other-Leg-Destination-Number'),
+    ('network_addr',                  'Caller-Network-Addr'),
+    ('other_leg_network_addr',        'Other-Leg-Network-Addr'),
+    ('created_time',                  'Caller-Channel-Created-Time', 'int'),
+    ('other_leg_created_time',        'Other-Leg-Channel-Created-Time', 'int'),
+    ('answered_time',                 'Caller-Channel-Answered-Time', 'int'),
+    ('other_leg_answered_time',       'Other-Leg-Channel-Answered-Time', 'int'),
+    ('progress_time',                 'Caller-Channel-Progress-Time', 'int'),
+    ('other_leg_progress_time',       'Other-Leg-Channel-Progress-Time', 'int'),
+    ('progress_media_time',           'Caller-Channel-Progress-Media-Time', 'int'),
+    ('other_leg_progress_media_time', 'Other-Leg-Channel-Progress-Media-Time', 'int'),
+    ('hangup_time',                   'Caller-Channel-Hangup-Time', 'int'),
+    ('other_leg_hangup_time',         'Other-Leg-Channel-Hangup-Time', 'int'),
+    ('transfer_time',                 'Caller-Channel-Transfer-Time', 'int'),
+    ('other_leg_transfer_time',       'Other-Leg-Channel-Transfer-Time', 'int'),
+    ('resurrect_time',                'Caller-Channel-Resurrect-Time', 'int'),
+    ('other_leg_resurrect_time',      'Other-Leg-Channel-Resurrect-Time', 'int'),
+    ('bridged_time',                  'Caller-Channel-Bridged-Time', 'int'),
+    ('other_leg_bridged_time',        'Other-Leg-Channel-Bridged-Time', 'int'),
+    ('last_hold_time',                'Caller-Channel-Last-Hold', 'int'),
+    ('other_leg_last_hold_time',      'Other-Leg-Channel-Last-Hold', 'int'),
+    ('hold_accu_time',                'Caller-Channel-Hold-Accum', 'int'),
+    ('other_leg_hold_accu_time',      'Other-Leg-Channel-Hold-Accum', 'int'),
+    ('transfer_source',               'Caller-Transfer-Source'),
+    ]
+
+ctl_dtmf_fields = [
+    ('dtmf_digit',    'DTMF-Digit'),
+    ('dtmf_duration', 'DTMF-Duration', 'int'),
+    ('dtmf_source',   'DTMF-Source'),
+    ]
+
+ctl_hold_fields = [
+    ('bridge_channel', 'variable_bridge_channel'),
+    ]
+
+ctl_playback_start_fields = [
+    ('application',           'variable_current_application'),
+    ('application_uuid',      None),
+    ('application_data',      'variable_current_application_data'),
+    ('application_status',    None),
+    ('application_file_path', 'Playback-File-Path'),
+    ('application_seconds',   None, 'int'),
+    ]
+
+ctl_playback_stop_fields = [
+    ('application',           'variable_current_application'),
+    ('application_uuid',      None),
+    ('application_data',      'variable_current_application_data'),
+    ('application_status',    'Playback-Status'),
+    ('application_file_path', 'Playback-File-Path'),
+    ('application_seconds',   'variable_playback_seconds', 'int'),
+    ]
+
+ctl_callcentre_fields = [
+    ('application',                'variable_current_application'),
+    ('application_uuid',           None),
+    ('application_data',           'variable_current_application_data'),
+    ('application_status',         None),
+    ('application_file_path',      None),
+    ('application_seconds',        None, 'int'),
+    ('cc_side',                    'variable_cc_side'),
+    ('cc_queue',                   'CC-Queue'),
+    ('cc_action',                  'CC-Action'),
+    ('cc_count',                   'CC-Count', 'int'),
+    ('cc_member_leaving_time',     'CC-Member-Leaving-Time', 'int'),
+    ('cc_cause',                   'CC-Cause'),
+    ('cc_hangup_cause',            'CC-Hangup-Cause'),
+    ('cc_cancel_reason',           'CC-Cancel-Reason'),
+    ('cc_member_uuid',             'CC-Member-UUID'),
+    ('cc_member_session_uuid',     'CC-Member-Session-UUID'),
+    ('cc_member_caller_id_name',   'CC-Member-CID-Name'),
+    ('cc_member_caller_id_number', 'CC-Member-CID-Number'),
+    ('cc_agent',                   'CC-Agent'),
+    ('cc_agent_uuid',              'CC-Agent-UUID'),
+    ('cc_agent_system',            'CC-Agent-System'),
+    ('cc_agent_type',              'CC-Agent-Type'),
+    ('cc_agent_state',             'CC-Agent-State'),
+    ('cc_agent_called_time',       'CC-Agent-Called-Time', 'int'),
+    ('cc_agent_answered_time',     'CC-Agent-Answered-Time', 'int'),
+    ]
+
+ctl_conference_fields = [
+    ('cf_name',         'Conference-Name'),
+    ('cf_action',       'Action'),
+    ('cf_uuid',         'Conference-Unique-ID'),
+    ('cf_domain',       'Conference-Domain'),
+    ('cf_size',         'Conference-Size'),
+    ('cf_ghosts',       'Conference-Ghosts'),
+    ('cf_profile_name', 'Conference-Profile-Name'),
+    ('cf_member_type',  'Member-Type'),
+    ('cf_member_id',    'Member-ID'),
+    ]
+
+cdr = FieldMap(XmlCdr, cdr_fields)
+call_state = FieldMap(CallTimeline, ctl_event_fields, ctl_channel_fields)
+dtmf = FieldMap(CallTimeline, ctl_event_fields, ctl_channel_fields, ctl_dtmf_fields)
+channel_hold = FieldMap(CallTimeline, ctl_event_fields, ctl_channel_fields, ctl_hold_fields)
+playback_start = FieldMap(CallTimeline, ctl_event_fields, ctl_channel_fields, ctl_playback_start_fields)
+playback_stop = FieldMap(CallTimeline, ctl_event_fields, ctl_channel_fields, ctl_playback_stop_fields)
+callcentre = FieldMap(CallTimeline, ctl_event_fields, ctl_channel_fields, ctl_callcentre_fields)
+conference = FieldMap(CallTimeline, ctl_event_fields, ctl_channel_fields, ctl_conference_fields)
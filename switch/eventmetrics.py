@@ -0,0 +1,196 @@
+#
+#    DjangoPBX
+#
+#    MIT License
+#
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
+#
+#    Permission is hereby granted, free of charge, to any person obtaining a copy
+#    of this software and associated documentation files (the "Software"), to deal
+#    in the Software without restriction, including without limitation the rights
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#    copies of the Software, and to permit persons to whom the Software is
+#    furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in all
+#    copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#    SOFTWARE.
+#
+#    Contributor(s):
+#    Adrian Fretwell <adrian@djangopbx.com>
+#
+
+import os
+import time
+import bisect
+import socket
+import logging
+import threading
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram():
+
+    # Counts of observations in buckets with the given upper bounds, the last bucket
+    #  being everything above the last bound.
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        return {'le': list(self.bounds) + [None], 'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+    @staticmethod
+    def quantile(snapshot, q):
+        # The upper bound of the bucket holding the q quantile, None if above the last bound.
+        if not snapshot or not snapshot['count']:
+            return 0
+        rank = q * snapshot['count']
+        n = 0
+        for le, count in zip(snapshot['le'], snapshot['counts']):
+            n += count
+            if n >= rank:
+                return le
+        return None
+
+
+class EventMetrics():
+
+    # Throughput and lag metrics of one eventreceiver process.
+    #
+    # Counters and histograms are kept in memory and published to the cache every
+    #  interval seconds by a thread of their own, from where the web workers report
+    #  them on the status page and at /status/eventreceiver/metrics/.  Processes
+    #  are listed under index_key so that those of every host and worker are found.
+    #
+    # Broker lag is the time from FreeSWITCH raising an event (Event-Date-Timestamp)
+    #  to it being handled, so it includes clock differences between the hosts.  The
+    #  maximum lag and the event rate are those since the previous publish.
+
+    index_key = 'eventreceiver:metrics'
+    cache_key = 'eventreceiver:metrics:%s'
+    latency_bounds = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000)
+    lag_bounds = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 300000)
+    flush_bounds = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 10000)
+    batch_bounds = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+    def __init__(self, worker=None, interval=10):
+        try:
+            self.hostname = socket.gethostname()
+        except OSError:
+            self.hostname = 'localhost'
+        self.worker = worker
+        self.name = '%s:%d' % (self.hostname, os.getpid())
+        self.interval = interval
+        self.started = time.time()
+        self.events = {}
+        self.errors = 0
+        self.latency = {}
+        self.lag = Histogram(self.lag_bounds)
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.flushes = Histogram(self.flush_bounds)
+        self.batches = Histogram(self.batch_bounds)
+        self.writer = None
+        self.thread = None
+        self.last_total = 0
+        self.last_published = time.monotonic()
+
+    def event(self, event, elapsed_ms):
+        if event is None:
+            self.errors += 1
+            event_type = 'unknown'
+        else:
+            event_type = event.get('Event-Name', 'unknown')
+            if event_type == 'CUSTOM':
+                event_type = event.get('Event-Subclass', event_type)
+            try:
+                lag_ms = time.time() * 1000 - int(event.get('Event-Date-Timestamp')) / 1000
+            except (TypeError, ValueError):
+                pass
+            else:
+                self.lag.observe(lag_ms)
+                self.last_lag_ms = lag_ms
+                self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+        self.events[event_type] = self.events.get(event_type, 0) + 1
+        h = self.latency.get(event_type)
+        if h is None:
+            h = self.latency[event_type] = Histogram(self.latency_bounds)
+        h.observe(elapsed_ms)
+
+    def flushed(self, size, elapsed_ms):
+        # Called from the BulkWriter thread.
+        self.flushes.observe(elapsed_ms)
+        self.batches.observe(size)
+
+    def start(self, writer=None):
+        self.writer = writer
+        self.thread = threading.Thread(target=self.run, name='EventMetrics', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.publish()
+            except Exception as e:
+                logger.warning('Event Receiver: unable to publish metrics: %s', e)
+
+    def snapshot(self):
+        now = time.monotonic()
+        total = sum(self.events.values())
+        elapsed = now - self.last_published
+        rate = (total - self.last_total) / elapsed if elapsed > 0 else 0.0
+        self.last_total = total
+        self.last_published = now
+        max_lag_ms, self.max_lag_ms = self.max_lag_ms, 0.0
+        snapshot = {
+            'name': self.name, 'hostname': self.hostname, 'pid': os.getpid(), 'worker': self.worker,
+            'started': self.started, 'updated': time.time(), 'interval': self.interval,
+            'events': dict(self.events), 'errors': self.errors, 'rate': rate,
+            'latency_ms': {k: h.snapshot() for k, h in list(self.latency.items())},
+            'lag_ms': {'last': self.last_lag_ms, 'max': max_lag_ms, 'histogram': self.lag.snapshot()},
+            'flush_ms': self.flushes.snapshot(), 'batch': self.batches.snapshot(), 'writer': None,
+            }
+        w = self.writer
+        if w:
+            snapshot['writer'] = {
+                'queue': w.queue.qsize(), 'max_queue': w.queue.maxsize,
+                'spooling': time.monotonic() < w.spool_until, 'spool_bytes': w.spool_bytes(),
+                }
+        return snapshot
+
+    def publish(self):
+        timeout = self.interval * 6
+        cache.set(self.cache_key % self.name, self.snapshot(), timeout)
+        # Processes may update the index at the same time and lose each other's
+        #  entry, it is put back by the next publish.
+        index = cache.get(self.index_key) or {}
+        now = time.time()
+        index = {k: v for k, v in index.items() if now - v < timeout}
+        index[self.name] = now
+        cache.set(self.index_key, index, None)
+
+    @classmethod
+    def collect(cls):
+        # The latest snapshot of every eventreceiver process, by name.
+        index = cache.get(cls.index_key) or {}
+        snapshots = cache.get_many([cls.cache_key % k for k in index])
+        return {s['name']: s for s in snapshots.values()}
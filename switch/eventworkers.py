@@ -0,0 +1,208 @@
+#
+#    DjangoPBX
+#
+#    MIT License
+#
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
+#
+#    Permission is hereby granted, free of charge, to any person obtaining a copy
+#    of this software and associated documentation files (the "Software"), to deal
+#    in the Software without restriction, including without limitation the rights
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#    copies of the Software, and to permit persons to whom the Software is
+#    furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in all
+#    copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#    SOFTWARE.
+#
+#    Contributor(s):
+#    Adrian Fretwell <adrian@djangopbx.com>
+#
+
+import os
+import re
+import time
+import zlib
+import queue
+import logging
+import threading
+import functools
+import multiprocessing
+from collections import deque
+from pika import BasicProperties as PikaBasicProperties
+from pika.exceptions import AMQPError
+
+logger = logging.getLogger(__name__)
+
+
+class ForwardChannel():
+
+    # Stands in for the AMQP channel in a worker process, messages are published
+    #  by the reader process that owns the connection.
+
+    def __init__(self, outq):
+        self.outq = outq
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self.outq.put(('publish', exchange, routing_key, body))
+
+
+class EventWorkerPool():
+
+    # Runs target(worker_id, inq, outq) in count forked worker processes and hands
+    #  each event received by the reader to one of them.  Events are partitioned on
+    #  Channel-Call-UUID, or Core-UUID if there is none, so the events of a call are
+    #  handled in order by the same worker.
+    #
+    # Workers report back on outq: ('ack', generation, worker_id, delivery_tag) once
+    #  all of their events up to delivery_tag are stored, and ('publish', exchange,
+    #  routing_key, body) to have a message published.  Delivery tags are handed out
+    #  in order so the broker is acknowledged, with multiple=True, up to the oldest
+    #  event any worker still has outstanding.
+    #
+    # DjangoPBX's own notifications, such as extension index changes, concern every
+    #  worker and are handed to all of them.
+    #
+    # A worker that dies leaves its events unacknowledged for good, so the reader
+    #  exits non-zero as soon as one is found dead, the broker then delivers the
+    #  unacknowledged events again once systemd has restarted the event receiver.
+
+    call_uuid_re = re.compile(rb'"Channel-Call-UUID"\s*:\s*"([^"]*)"')
+    core_uuid_re = re.compile(rb'"Core-UUID"\s*:\s*"([^"]*)"')
+    broadcast_re = re.compile(rb'"Event-Subclass"\s*:\s*"djangopbx::')
+
+    def __init__(self, count, target, queue_size=0):
+        self.count = count
+        ctx = multiprocessing.get_context('fork')
+        self.inqs = [ctx.Queue(queue_size) for i in range(count)]
+        self.outq = ctx.Queue()
+        self.processes = [
+            ctx.Process(target=target, args=(i, self.inqs[i], self.outq), name='EventWorker-%d' % i, daemon=True)
+            for i in range(count)
+            ]
+        self.forwarder = threading.Thread(target=self.forward, name='EventWorkerForwarder', daemon=True)
+        self.channel = None
+        self.generation = 0
+        self.stopping = False
+        self.checked = 0
+
+    def start(self):
+        for p in self.processes:
+            p.start()
+        self.forwarder.start()
+
+    def stop(self, timeout=None):
+        # Workers write everything they have been given before they exit, their last
+        #  acks are then forwarded to be run before the connection is closed.
+        self.stopping = True
+        for q in self.inqs:
+            q.put(None)
+        for p in self.processes:
+            p.join(timeout)
+            if p.is_alive():
+                logger.warning('Event Receiver: %s did not finish in time', p.name)
+                p.terminate()
+        self.outq.put(None)
+        self.forwarder.join(timeout)
+
+    def reset(self, channel):
+        # Delivery tags start again on a new channel, anything outstanding on the
+        #  old one will be redelivered.
+        self.channel = channel
+        self.generation += 1
+        self.outstanding = [deque() for i in range(self.count)]
+        self.last_tag = 0
+        self.acked = 0
+
+    def check_workers(self):
+        if self.stopping:
+            return
+        for p in self.processes:
+            if not p.is_alive():
+                logger.critical('Event Receiver: %s exited with code %s, exiting', p.name, p.exitcode)
+                os._exit(1)
+
+    def put(self, channel, worker_id, item):
+        # A full queue must not block the connection thread, which sends the heartbeats.
+        while True:
+            try:
+                self.inqs[worker_id].put_nowait(item)
+                return
+            except queue.Full:
+                self.check_workers()
+                channel.connection.sleep(0.1)
+
+    def partition(self, body):
+        m = self.call_uuid_re.search(body)
+        if not m:
+            m = self.core_uuid_re.search(body)
+        if not m:
+            return 0
+        return zlib.crc32(m.group(1)) % self.count
+
+    def dispatch(self, channel, method, properties, body):
+        if channel is not self.channel:
+            self.reset(channel)
+        tag = method.delivery_tag
+        if self.broadcast_re.search(body):
+            for worker_id in range(self.count):
+                self.outstanding[worker_id].append(tag)
+                self.put(channel, worker_id, (self.generation, tag, body))
+            self.last_tag = tag
+            return
+        worker_id = self.partition(body)
+        self.outstanding[worker_id].append(tag)
+        self.last_tag = tag
+        self.put(channel, worker_id, (self.generation, tag, body))
+
+    def forward(self):
+        while True:
+            if time.monotonic() - self.checked >= 1:
+                self.checked = time.monotonic()
+                self.check_workers()
+            try:
+                msg = self.outq.get(timeout=1)
+            except queue.Empty:
+                continue
+            if msg is None:
+                break
+            try:
+                self.channel.connection.add_callback_threadsafe(functools.partial(self.worker_message, msg))
+            except (AMQPError, AttributeError):
+                pass
+
+    def worker_message(self, msg):
+        if msg[0] == 'ack':
+            self.worker_ack(*msg[1:])
+        elif msg[0] == 'publish':
+            if not self.channel.is_open:
+                return
+            try:
+                self.channel.basic_publish(msg[1], msg[2], msg[3],
+                                           properties=PikaBasicProperties(delivery_mode=2),  # Persistent
+                                           )
+            except AMQPError:
+                logger.warning('Event Receiver: Unable send %s message %s.' % (msg[1], msg[2]))
+
+    def worker_ack(self, generation, worker_id, tag):
+        if not generation == self.generation or not self.channel.is_open:
+            return
+        d = self.outstanding[worker_id]
+        while d and d[0] <= tag:
+            d.popleft()
+        heads = [d[0] for d in self.outstanding if d]
+        if heads:
+            upto = min(heads) - 1
+        else:
+            upto = self.last_tag
+        if upto > self.acked:
+            self.channel.basic_ack(upto, multiple=True)
+            self.acked = upto
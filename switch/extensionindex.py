@@ -0,0 +1,162 @@
+#
+#    DjangoPBX
+#
+#    MIT License
+#
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
+#
+#    Permission is hereby granted, free of charge, to any person obtaining a copy
+#    of this software and associated documentation files (the "Software"), to deal
+#    in the Software without restriction, including without limitation the rights
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#    copies of the Software, and to permit persons to whom the Software is
+#    furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in all
+#    copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#    SOFTWARE.
+#
+#    Contributor(s):
+#    Adrian Fretwell <adrian@djangopbx.com>
+#
+
+import time
+import logging
+import threading
+from django.conf import settings
+from django.db import connections
+from tenants.models import Domain
+from accounts.models import Extension
+from pbx.cachenamespace import CacheNamespace
+
+logger = logging.getLogger(__name__)
+
+
+class ExtensionIndex():
+
+    # A per process index of domains and their extensions used to attribute CDRs
+    #  without a database query for each event.
+    #
+    # A domain's extension number, number alias and extension UUID are mapped to
+    # the extension id with one query on first use.  An entry is dropped when a
+    # djangopbx::extension_index event for its domain arrives over the TAP.Events
+    # exchange, see publish_change(), and reloaded after ttl seconds regardless in
+    # case an event was missed.  Unknown domains are remembered for missing_ttl.
+    #
+    # Processes that do not receive the events, such as the web workers importing
+    # mod_xml_cdr CDRs, use shared=True to follow the directory generation of the
+    # domain instead, see DirectoryIndex.  The events are only published when
+    # commands go through the broker, with PBX_USE_LOCAL_EVENT_SOCKET the
+    # eventreceivers are shared as well.
+
+    ambiguous = object()
+    subclass = 'djangopbx::extension_index'
+    lock = threading.Lock()
+    changes = set()
+    publisher = None
+
+    def __init__(self, ttl=3600, missing_ttl=60, shared=False):
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self.shared = shared
+        self.domains = {}
+
+    def entry(self, domain_name):
+        entry = self.domains.get(domain_name)
+        now = time.monotonic()
+        generation = None
+        if self.shared:
+            generation = CacheNamespace('directory').generation(domain_name)
+        if entry and now < entry['expires'] and generation == entry['generation']:
+            return entry
+        try:
+            d = Domain.objects.get(name=domain_name)
+        except Domain.DoesNotExist:
+            entry = {'domain': None, 'numbers': {}, 'uuids': set(), 'expires': now + self.missing_ttl,
+                     'generation': generation}
+            self.domains[domain_name] = entry
+            return entry
+        entry = {'domain': d, 'numbers': {}, 'uuids': set(), 'expires': now + self.ttl, 'generation': generation}
+        numbers = entry['numbers']
+        for extension_id, extension, number_alias in Extension.objects.filter(domain_id=d).values_list(
+                'id', 'extension', 'number_alias'):
+            entry['uuids'].add(str(extension_id))
+            for number in (extension, number_alias):
+                if not number:
+                    continue
+                # A number matching more than one extension cannot be attributed.
+                if numbers.get(number, extension_id) != extension_id:
+                    numbers[number] = self.ambiguous
+                else:
+                    numbers[number] = extension_id
+        self.domains[domain_name] = entry
+        return entry
+
+    def domain(self, domain_name):
+        return self.entry(domain_name)['domain']
+
+    def by_uuid(self, domain_name, extension_uuid):
+        if extension_uuid in self.entry(domain_name)['uuids']:
+            return extension_uuid
+        return None
+
+    def by_number(self, domain_name, number):
+        # Returns the extension id, None, or ambiguous.
+        return self.entry(domain_name)['numbers'].get(number)
+
+    def changed(self, domain_name=None):
+        if domain_name:
+            self.domains.pop(domain_name, None)
+        else:
+            self.domains.clear()
+
+    @classmethod
+    def publish_change(cls, domain_name):
+        # Tells every eventreceiver that extensions of the domain have changed.  Sent by
+        #  a thread of its own so that a save never waits for the broker, changes made
+        #  meanwhile are sent together.
+        if settings.PBX_USE_LOCAL_EVENT_SOCKET:
+            return
+        with cls.lock:
+            cls.changes.add(domain_name)
+            if cls.publisher is None:
+                cls.publisher = threading.Thread(target=cls.publish_changes, name='ExtensionIndexPublisher')
+                cls.publisher.daemon = True
+                cls.publisher.start()
+
+    @classmethod
+    def publish_changes(cls):
+        from pbx.amqpcmdevent import AmqpCmdEvent
+        try:
+            while True:
+                with cls.lock:
+                    if not cls.changes:
+                        cls.publisher = None
+                        return
+                    domain_names = cls.changes
+                    cls.changes = set()
+                try:
+                    broker = AmqpCmdEvent()
+                    if not broker.connect():
+                        logger.warning('Extension index change for {}: Unable to publish'.format(
+                            ', '.join(domain_names)))
+                        continue
+                    for domain_name in domain_names:
+                        payload = '{"Event-Name":"CUSTOM", "Event-Subclass":"%s", "Domain-Name":"%s"}' % (
+                            cls.subclass, domain_name)
+                        broker.event_publish(payload, 'DjangoPBX.%s.CUSTOM.%s.change' % (
+                            broker.hostname.replace('.', '_'), cls.subclass
+                            ))
+                    broker.disconnect()
+                except Exception as e:
+                    logger.warning('Extension index change for {}: Unable to publish: {}'.format(
+                        ', '.join(domain_names), e))
+        finally:
+            connections.close_all()
@@ -28,19 +28,34 @@
 #
 
 import os
-import datetime
+import re
+import glob
+import time
 import logging
-import json
+import queue
+import signal
+import functools
+from urllib.parse import unquote
 from pika import BasicProperties as PikaBasicProperties
+from pika.exceptions import AMQPError
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, When, Value, UUIDField
 from switch.models import IpRegister
-from tenants.models import DefaultSetting, Domain
+from tenants.models import DefaultSetting
 from xmlcdr.models import XmlCdr, CallTimeline
 from recordings.models import CallRecording
-from accounts.models import Extension
 from pbx.commonfunctions import shcommand
+from pbx.bulkwriter import BulkWriter
+from pbx.dbconnections import fork_safe_connections
+from switch.eventworkers import EventWorkerPool, ForwardChannel
+from switch.extensionindex import ExtensionIndex
+from switch.recordingindex import RecordingIndex
+from switch.eventmetrics import EventMetrics
+from switch import eventfields
 from pbx.scripts.resources.pbx.amqpconnection import AmqpConnection
 
 
@@ -58,8 +73,13 @@ class Command(BaseCommand):
     mb_key_adhoc = 'message_broker_adhoc_publish'
     switch_recordings_path = '/var/lib/freeswitch/recordings'
     pop_call_recordings = False
+    cdrformat = 'json'
     call_recordings_path = '/fs/recordings'
-    domains = {}
+    extensions = None
+    recordings = None
+    metrics = None
+    db_checked = 0.0
+    message_ack = None
 
     def str2int(self, tmpstr):
         if not tmpstr:
@@ -88,28 +108,81 @@ class Command(BaseCommand):
             return False
         return domain_name
 
-    def get_domain(self, u_uuid, domain_name):
-        d = self.domains.get(domain_name)
-        if d:
-            return d
-        try:
-            d = Domain.objects.get(name=domain_name)
-        except Domain.ObjectDoesNotExist:
+    def get_domain(self, t_uuid, domain_name):
+        d = self.extensions.domain(domain_name)
+        if not d:
             logger.warn('EVENT CDR request {}: Unable to find domain {}.'.format(t_uuid, domain_name))
             return False
-        except Domain.MultipleObjectsReturned:
-            logger.warn('EVENT CDR request {}: Multiple domain record found for {}.'.format(t_uuid, domain_name))
-            return False
-        self.domains[domain_name] = d
         return d
 
+    def check_db_connections(self):
+        # There is no request cycle here so close_old_connections() is called at
+        #  intervals to recycle the persistent connection and health check it.
+        now = time.monotonic()
+        if now - self.db_checked < self.db_check_interval:
+            return
+        self.db_checked = now
+        close_old_connections()
+
+    def update_timeline_domains(self, cdrs):
+        # The last CDR from each switch sets the domain of its call timeline records.
+        core_domains = {}
+        for xcdr in cdrs:
+            core_domains[xcdr.core_uuid] = xcdr.domain_id_id
+        CallTimeline.objects.filter(core_uuid__in=list(core_domains.keys())).update(
+            domain_id=Case(
+                *[When(core_uuid=k, then=Value(v)) for k, v in core_domains.items()],
+                output_field=UUIDField()
+                )
+            )
+
+    def ack(self, channel, delivery_tag):
+        # Called by the writer thread once the records of this and all earlier
+        #  messages are committed or spooled.
+        try:
+            channel.connection.add_callback_threadsafe(
+                functools.partial(self.ack_delivery, channel, delivery_tag)
+                )
+        except AMQPError:
+            pass
+
+    def ack_delivery(self, channel, delivery_tag):
+        # Messages from a closed channel are redelivered on the new one.
+        if channel.is_open:
+            channel.basic_ack(delivery_tag, multiple=True)
+
+    def write(self, instance):
+        # Passes the current message's acknowledgement on to the writer.
+        self.writer.put(instance, self.message_ack)
+        self.message_ack = None
+
     def on_message(self, channel, method, properties, body):
-        msg = body.decode('utf8')
+        self.check_db_connections()
+        self.message_ack = functools.partial(self.ack, channel, method.delivery_tag)
+        self.timed_handle_message(channel, body)
+        if self.message_ack:
+            # Nothing written, or a message that cannot be handled.
+            channel.basic_ack(method.delivery_tag)
+            self.message_ack = None
+
+    def timed_handle_message(self, channel, body):
+        event = None
+        start = time.perf_counter()
+        try:
+            event = self.handle_message(channel, body)
+        except Exception:
+            logger.exception('Event Receiver: unable to handle event')
+        if self.metrics:
+            self.metrics.event(event, (time.perf_counter() - start) * 1000)
+
+    def handle_message(self, channel, body):
+        # Returns the decoded event.
         if self.debug:
+            msg = body.decode('utf8')
             if logger is not None:
                 logger.debug('Event Receiver: %s', msg)
             print(msg)
-        event = json.loads(msg)
+        event = eventfields.decode_event(body)
         event_name = event.get('Event-Name', self.nonstr)
         event_subclass = event.get('Event-Subclass', self.nonstr)
         if event_name == 'CHANNEL_HANGUP_COMPLETE':
@@ -133,6 +206,12 @@ class Command(BaseCommand):
                 self.handle_callcentreinfo(event)
             if event.get('Event-Subclass', self.nonstr) == 'conference::maintenance':
                 self.handle_conferencemaintenance(event)
+            if event.get('Event-Subclass', self.nonstr) == ExtensionIndex.subclass:
+                self.extensions.changed(event.get('Domain-Name'))
+        return event
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help=_('Number of worker processes handling events'))
 
     def handle(self, *args, **kwargs):
         mb = {self.mb_key_host: '127.0.0.1', self.mb_key_port: 5672,
@@ -155,6 +234,39 @@ class Command(BaseCommand):
                 mb[mbr.subcategory] = (True if mbr.value == 'true' else False)
         del mbl
         self.message_broker_adhoc_publish = mb[self.mb_key_adhoc]
+        self.load_settings()
+        prefetch = getattr(settings, 'PBX_EVENTRECEIVER_PREFETCH', 2000)
+        self.mq = AmqpConnection(mb[self.mb_key_host], mb[self.mb_key_port],
+                                 mb[self.mb_key_user], mb[self.mb_key_pass], auto_ack=False,
+                                 prefetch=prefetch)
+        # Stop cleanly, writing what has been received, on SIGTERM as well as SIGINT.
+        signal.signal(signal.SIGTERM, self.terminate)
+
+        workers = kwargs['workers']
+        if workers is None:
+            workers = getattr(settings, 'PBX_EVENTRECEIVER_WORKERS', 1)
+        if self.spool_path:
+            self.claim_spools(workers)
+        if workers > 1:
+            # Workers are forked before connecting to the broker and without database connections.
+            fork_safe_connections()
+            self.pool = EventWorkerPool(workers, self.run_worker, prefetch)
+            self.pool.start()
+            on_message = self.pool.dispatch
+            on_stop = self.pool.stop
+        else:
+            self.metrics = self.new_metrics()
+            self.writer = self.new_writer(self.spool_path)
+            self.writer.start()
+            self.start_metrics()
+            on_message = self.on_message
+            on_stop = self.writer.close
+        self.mq.connect()
+        self.mq.setup_queues()
+        self.mq.consume(on_message, on_stop)
+
+    def load_settings(self):
+        # CDR and recording default settings, also used by eventreceiverload.
         bleg = DefaultSetting.objects.filter(
                 category='cdr',
                 subcategory='b_leg',
@@ -202,12 +314,103 @@ class Command(BaseCommand):
             self.switch_recordings_path = srp[0].value
         del srp
 
+        self.db_check_interval = getattr(settings, 'PBX_DB_CHECK_INTERVAL', 10)
+        self.spool_path = getattr(settings, 'PBX_EVENTRECEIVER_SPOOL', None)
+        self.extensions = ExtensionIndex(
+            getattr(settings, 'PBX_EVENTRECEIVER_EXTENSION_INDEX_TTL', 3600),
+            shared=settings.PBX_USE_LOCAL_EVENT_SOCKET
+            )
+        self.recordings = RecordingIndex()
+        if self.spool_path:
+            os.makedirs(os.path.dirname(self.spool_path), exist_ok=True)
         self.firewall_event_template = '{\"Event-Name\":\"FIREWALL\", \"Action\":\"add\", \"IP-Type\":\"%s\",\"Fw-List\":\"sip-customer\", \"IP-Address\":\"%s\"}' # noqa: E501
-        self.mq = AmqpConnection(mb[self.mb_key_host], mb[self.mb_key_port],
-                                    mb[self.mb_key_user], mb[self.mb_key_pass])
-        self.mq.connect()
-        self.mq.setup_queues()
-        self.mq.consume(self.on_message)
+
+    def terminate(self, signum, frame):
+        raise KeyboardInterrupt
+
+    def new_writer(self, spool_path):
+        # CDRs and call timeline records are written in batches by a thread of their own,
+        #  timeline records first so that a CDR's domain update includes them.
+        writer = BulkWriter(
+            'Event Receiver',
+            getattr(settings, 'PBX_EVENTRECEIVER_BATCH', 500),
+            getattr(settings, 'PBX_EVENTRECEIVER_FLUSH_MS', 200),
+            getattr(settings, 'PBX_EVENTRECEIVER_QUEUE', 10000),
+            getattr(settings, 'PBX_EVENTRECEIVER_COPY_THRESHOLD', 1000),
+            spool_path, metrics=self.metrics, on_error=self.writer_failed
+            )
+        writer.register(CallTimeline, copy=True)
+        writer.register(XmlCdr, self.update_timeline_domains)
+        return writer
+
+    def worker_spool_path(self, worker_id):
+        return '%s.%d' % (self.spool_path, worker_id)
+
+    def claim_spools(self, workers):
+        # Spools left by workers that are not started this time, after fewer workers or
+        #  a change to or from the single process mode, are moved to the spool of one
+        #  that is so that their records are still written.
+        if workers > 1:
+            owned = [self.worker_spool_path(i) for i in range(workers)]
+        else:
+            owned = [self.spool_path]
+        spools = [self.spool_path] + sorted(
+            path for path in glob.glob(glob.escape(self.spool_path) + '.*')
+            if re.fullmatch(r'\.\d+', path[len(self.spool_path):])
+            )
+        orphans = []
+        for path in spools:
+            if path not in owned:
+                orphans.extend((path + '.replay', path))
+        BulkWriter.merge_spools(orphans, owned[0], 'Event Receiver')
+
+    def writer_failed(self):
+        # Records that could be neither stored nor spooled are never acknowledged, exiting
+        #  closes the connection so the broker delivers them again once systemd restarts us.
+        logger.critical('Event Receiver: writer failed, exiting')
+        os._exit(1)
+
+    def new_metrics(self, worker_id=None):
+        # Published to the cache for the status pages every interval seconds, 0 to turn off.
+        interval = getattr(settings, 'PBX_EVENTRECEIVER_METRICS_INTERVAL', 10)
+        if interval > 0:
+            return EventMetrics(worker_id, interval)
+        return None
+
+    def start_metrics(self):
+        if self.metrics:
+            self.metrics.start(self.writer)
+
+    def run_worker(self, worker_id, inq, outq):
+        # Worker process of the multi-process mode, the reader stops it by sending None.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        parent = os.getppid()
+        spool_path = None
+        if self.spool_path:
+            spool_path = self.worker_spool_path(worker_id)
+        self.metrics = self.new_metrics(worker_id)
+        self.writer = self.new_writer(spool_path)
+        self.writer.start()
+        self.start_metrics()
+        channel = ForwardChannel(outq)
+        while True:
+            try:
+                item = inq.get(timeout=1)
+            except queue.Empty:
+                if os.getppid() == parent:
+                    continue
+                item = None
+            if item is None:
+                break
+            generation, delivery_tag, body = item
+            self.check_db_connections()
+            self.message_ack = functools.partial(outq.put, ('ack', generation, worker_id, delivery_tag))
+            self.timed_handle_message(channel, body)
+            if self.message_ack:
+                # Acknowledged in turn after the records of earlier events.
+                self.write(None)
+        self.writer.close()
 
     def handle_register(self, channel, event):
         if event.get('status', 'N/A').startswith('Registered'):
@@ -227,7 +430,7 @@ class Command(BaseCommand):
                         channel.basic_publish('TAP.Firewall', firewall_routing, payload.encode(),
                             properties=PikaBasicProperties(delivery_mode=2), # Delivery Mode 2 for persistent
                             )
-                    except:
+                    except Exception:
                         logger.warn('EVENT Register {}: Unable send TAP.Firewall message {}.'.format(ip.address, firewall_routing))
 
     def handle_cdr(self, event):
@@ -258,68 +461,33 @@ class Command(BaseCommand):
         if not d:
             return False
 
-        extension_found = False
+        extension_id = None
         extension_uuid = event.get('variable_extension_uuid')
         if extension_uuid:
-            try:
-                e = Extension.objects.get(pk=extension_uuid)
-            except Extension.ObjectDoesNotExist:
+            extension_id = self.extensions.by_uuid(domain_name, extension_uuid)
+            if not extension_id:
                 logger.debug('EVENT CDR request {}: Unable to find extension by uuid {}.'.format(t_uuid, extension_uuid))
-            else:
-                extension_found = True
         else:
-            tmpstr = event.get('variable_dialed_user')
-            if tmpstr and not extension_found:
-                try:
-                    e = Extension.objects.get((Q(extension=tmpstr) | Q(number_alias=tmpstr)), domain_id=d.id)
-                except Extension.ObjectDoesNotExist:
-                    logger.debug(
-                        'EVENT CDR request {}: Unable to find extension by number dialled_user {}.'.
-                        format(t_uuid, tmpstr)
-                        )
-                except Extension.MultipleObjectsReturned:
+            for variable in ('dialed_user', 'referred_by_user', 'last_sent_callee_id_number'):
+                tmpstr = event.get('variable_%s' % variable)
+                if not tmpstr:
+                    continue
+                extension_id = self.extensions.by_number(domain_name, tmpstr)
+                if extension_id is self.extensions.ambiguous:
+                    extension_id = None
                     logger.warn(
-                        'EVENT CDR request {}: Multiple extension records found for dialed_user {}.'.
-                        format(t_uuid, tmpstr)
+                        'EVENT CDR request {}: Multiple extension records found for {} {}.'.
+                        format(t_uuid, variable, tmpstr)
                         )
+                elif extension_id:
+                    break
                 else:
-                    extension_found = True
-
-            tmpstr = event.get('variable_referred_by_user')
-            if tmpstr and not extension_found:
-                try:
-                    e = Extension.objects.get((Q(extension=tmpstr) | Q(number_alias=tmpstr)), domain_id=d.id)
-                except Extension.ObjectDoesNotExist:
                     logger.debug(
-                        'EVENT CDR request {}: Unable to find extension by number referred_by_user {}.'.
-                        format(t_uuid, tmpstr)
+                        'EVENT CDR request {}: Unable to find extension by number {} {}.'.
+                        format(t_uuid, variable, tmpstr)
                         )
-                except Extension.MultipleObjectsReturned:
-                    logger.warn(
-                        'EVENT CDR request {}: Multiple extension records found for referred_by_user {}.'.
-                        format(t_uuid, tmpstr)
-                        )
-                else:
-                    extension_found = True
-
-            tmpstr = event.get('variable_last_sent_callee_id_number')
-            if tmpstr and not extension_found:
-                try:
-                    e = Extension.objects.get((Q(extension=tmpstr) | Q(number_alias=tmpstr)), domain_id=d.id)
-                except Extension.ObjectDoesNotExist:
-                    logger.debug(
-                        'EVENT CDR request {}: Unable to find extension by number last_sent_callee_id_number {}.'.
-                        format(t_uuid, tmpstr)
-                        )
-                except Extension.MultipleObjectsReturned:
-                    logger.warn(
-                        'EVENT CDR request {}: Multiple extension records found for last_sent_callee_id_number {}.'.
-                        format(t_uuid, tmpstr)
-                        )
-                else:
-                    extension_found = True
 
-            if not extension_found:
+            if not extension_id:
                 logger.info('EVENT CDR request {}: Unable to find extension.'.format(t_uuid))
 
         caller_id_name = event.get('variable_effective_caller_id_name')
@@ -328,7 +496,7 @@ class Command(BaseCommand):
 
         caller_id_number = event.get('variable_effective_caller_id_number')
         if not caller_id_number:
-            caller_id_name = event.get('variable_caller_id_number')
+            caller_id_number = event.get('variable_caller_id_number')
 
         context = event.get('Caller-Context',self.nonstr)
         destination_number = event.get('Caller-Destination-Number', '-')
@@ -338,13 +506,10 @@ class Command(BaseCommand):
         if tmpstr and leg == 'a' and not call_direction in self.b_leg:
             destination_number = tmpstr
 
-        tz = timezone.get_current_timezone()
-
-        start_stamp = event.get('variable_start_stamp')
-        if start_stamp:
-            start_time = datetime.datetime.strptime(start_stamp, '%Y-%m-%d %H:%M:%S')
-        else:
-            start_stamp = datetime.datetime.now()
+        start_stamp = eventfields.to_stamp(event.get('variable_start_stamp'))
+        if not start_stamp:
+            start_stamp = timezone.now()
+        start_time = timezone.localtime(start_stamp)
 
         start_year = start_time.strftime('%Y')
         start_month = start_time.strftime('%b')
@@ -374,10 +539,9 @@ class Command(BaseCommand):
             record_name = os.path.basename(event.get('variable_cc_record_filename'))
             record_length = self.str2int(event.get('variable_record_seconds'))
         elif event.get('variable_api_on_answer'):
-            command = self.uq(event.get('variable_api_on_answer'))
-            command = command.replace('\n', ' ').split(' ')
-            for parts in command:
-                if parts[0] == 'uuid_record':
+            for command in unquote(event.get('variable_api_on_answer')).split('\n'):
+                parts = command.split(' ')
+                if parts[0] == 'uuid_record' and len(parts) > 3:
                     recording = parts[3]
                     record_path = os.path.dirname(recording)
                     record_name = os.path.basename(recording)
@@ -399,45 +563,23 @@ class Command(BaseCommand):
         uuid = event.get('variable_uuid', self.nonstr)
 
         if not record_name:
+            # An mp3 is preferred to a wav, and the bridge UUID to the UUID.
             bridge_uuid = event.get('variable_bridge_uuid', self.nonstr)
-            path = '%s/%s/archive/%s/%s/%s/%s.wav' % (
-                    self.switch_recordings_path, domain_name, start_year, start_month, start_day, bridge_uuid
-                    )
-            if os.path.exists(path):
-                record_path = os.path.dirname(path)
-                record_name = os.path.basename(path)
-                record_length = self.str2int(event.get('variable_duration'))
-            path = '%s/%s/archive/%s/%s/%s/%s.mp3' % (
-                    self.switch_recordings_path, domain_name, start_year, start_month, start_day, bridge_uuid
-                    )
-            if os.path.exists(path):
-                record_path = os.path.dirname(path)
-                record_name = os.path.basename(path)
-                record_length = self.str2int(event.get('variable_duration'))
-
-        if not record_name:
-            bridge_uuid = event.get('variable_bridge_uuid', self.nonstr)
-            path = '%s/%s/archive/%s/%s/%s/%s.wav' % (
-                    self.switch_recordings_path, domain_name, start_year, start_month, start_day, uuid
-                    )
-            if os.path.exists(path):
-                record_path = os.path.dirname(path)
-                record_name = os.path.basename(path)
-                record_length = self.str2int(event.get('variable_duration'))
-            path = '%s/%s/archive/%s/%s/%s/%s.mp3' % (
-                    self.switch_recordings_path, domain_name, start_year, start_month, start_day, uuid
+            path = '%s/%s/archive/%s/%s/%s' % (
+                    self.switch_recordings_path, domain_name, start_year, start_month, start_day
                     )
-            if os.path.exists(path):
-                record_path = os.path.dirname(path)
-                record_name = os.path.basename(path)
+            name = self.recordings.find(path, (
+                    '%s.mp3' % bridge_uuid, '%s.wav' % bridge_uuid, '%s.mp3' % uuid, '%s.wav' % uuid
+                    ), self.str2int(event.get('variable_end_epoch')))
+            if name:
+                record_path = path
+                record_name = name
                 record_length = self.str2int(event.get('variable_duration'))
 
-        xcdr = XmlCdr(domain_id=d, core_uuid=core_uuid)
-        if extension_found:
-            xcdr.extension_id=e
+        xcdr = eventfields.cdr.new(event, domain_id=d, core_uuid=core_uuid)
+        if extension_id:
+            xcdr.extension_id_id = extension_id
         xcdr.domain_name = domain_name
-        xcdr.accountcode = event.get('variable_accountcode')
-        xcdr.direction = event.get('variable_call_direction', self.nonstr)
         xcdr.context = context
         if caller_id_name:
             xcdr.caller_id_name = caller_id_name
@@ -450,32 +592,7 @@ class Command(BaseCommand):
         # xcdr.source_number = event.get('variable_')
         xcdr.destination_number = destination_number
 
-        xcdr.start_epoch = self.str2int(event.get('variable_start_epoch'))
-        xcdr.start_stamp = timezone.make_aware(start_time, tz)
-        xcdr.answer_epoch = self.str2int(event.get('variable_answer'))
-
-        answer_stamp = event.get('variable_answer_stamp')
-        if answer_stamp:
-            answer_time = datetime.datetime.strptime(answer_stamp, '%Y-%m-%d %H:%M:%S')
-            xcdr.answer_stamp = timezone.make_aware(answer_time, tz)
-
-        xcdr.end_epoch = self.str2int(event.get('variable_end_epoch'))
-
-        end_stamp = event.get('variable_end_stamp')
-        if end_stamp:
-            end_time = datetime.datetime.strptime(end_stamp, '%Y-%m-%d %H:%M:%S')
-            xcdr.end_stamp = timezone.make_aware(end_time, tz)
-
-        xcdr.duration = self.str2int(event.get('variable_duration'))
-        xcdr.mduration = self.str2int(event.get('variable_mduration'))
-        xcdr.billsec = self.str2int(event.get('variable_billsec'))
-        xcdr.billmsec = self.str2int(event.get('variable_billmsec'))
-        xcdr.bridge_uuid = event.get('variable_bridge_uuid')
-        xcdr.read_codec = event.get('variable_read_codec')
-        xcdr.read_rate = event.get('variable_read_rate')
-        xcdr.write_codec = event.get('variable_write_codec')
-        xcdr.write_rate = event.get('variable_write_rate')
-        xcdr.remote_media_ip = event.get('variable_remote_media_ip')
+        xcdr.start_stamp = start_stamp
         xcdr.network_addr = network_addr
         if record_path and record_name:
             if record_length > 0:
@@ -486,7 +603,7 @@ class Command(BaseCommand):
                     path_parts = record_path.split('/')[-5:]
                     if len(path_parts) == 5:
                         local_path = '%s/%s' % (self.switch_recordings_path, '/'.join(path_parts))
-                        if os.path.exists('%s/%s' % (local_path, record_name)):
+                        if self.recordings.find(local_path, (record_name,)):
                             call_rec_path = '%s/%s' % (self.call_recordings_path[1:], '/'.join(path_parts))
                             try:
                                 CallRecording.objects.create(name=record_name,
@@ -494,16 +611,13 @@ class Command(BaseCommand):
                                         month=path_parts[3], day=path_parts[4],
                                         filename='%s/%s' % (call_rec_path, record_name),
                                         updated_by='CDR Event Import')
-                            except:
+                            except Exception:
                                 pass
 
         xcdr.leg = leg
         xcdr.pdd_ms = self.str2int(event.get(
-            'progress_mediamsec'
+            'variable_progress_mediamsec'
             )) + self.str2int(event.get('variable_progressmsec'))
-        xcdr.rtp_audio_in_mos = self.str2float(event.get('variable_rtp_audio_in_mos'))
-        xcdr.last_app = event.get('variable_last_app')
-        xcdr.last_arg = event.get('variable_last_arg')
 
         xcdr.missed_call = False
         if (event.get('variable_call_direction', self.nonstr) == 'local' or
@@ -513,230 +627,51 @@ class Command(BaseCommand):
         if event.get('variable_missed_call', 'false') == 'true':
             xcdr.missed_call = True
 
-        xcdr.cc_side = event.get('variable_cc_side')
-        xcdr.cc_member_uuid = event.get('variable_cc_member_uuid')
-        xcdr.cc_queue_joined_epoch = self.str2int(event.get('variable_cc_queue_joinded_epoch'))
-        xcdr.cc_queue = event.get('variable_cc_queue')
-        xcdr.cc_member_session_uuid = event.get('variable_cc_member_session_id')
-        xcdr.cc_agent_uuid = event.get('variable_cc_agent_uuid')
-        xcdr.cc_agent = event.get('variable_cc_agent')
-        xcdr.cc_agent_type = event.get('variable_cc_agent_type')
-        xcdr.cc_agent_bridged = event.get('variable_cc_agent_bridged')
-        xcdr.cc_queue_answered_epoch = self.str2int(event.get('variable_cc_queue_answered_epoch'))
-        xcdr.cc_queue_terminated_epoch = self.str2int(event.get('variable_cc_queue_terminated_epoch'))
-        xcdr.cc_queue_canceled_epoch = self.str2int(event.get('variable_cc_queue_canceled_epoch'))
-        xcdr.cc_cancel_reason = event.get('variable_cc_cancel_reason')
-        xcdr.cc_cause = event.get('variable_cc_cause')
-        xcdr.waitsec = self.str2int(event.get('variable_waitsec'))
-        xcdr.conference_name = event.get('variable_conference_name')
-        xcdr.conference_uuid = event.get('variable_conference_uuid')
-        xcdr.conference_member_id = event.get('variable_conference_member_id')
         # xcdr.digits_dialed = event.get('variable_digits_dialed')
         pin_number = event.get('variable_pin_number')
         if pin_number:
             xcdr.pin_number = pin_number
 
-        xcdr.hangup_cause = event.get('variable_hangup_cause')
-        xcdr.hangup_cause_q850 = self.str2int(q850)
-        xcdr.sip_hangup_disposition = event.get('variable_sip_hangup_disposition')
-
         if self.cdrformat == 'json':
             xcdr.json = event
 
         xcdr.updated_by = 'system'
-        xcdr.save()
-        CallTimeline.objects.filter(core_uuid=core_uuid).update(domain_id=d)
+        self.write(xcdr)
         return
 
-    def create_call_timeline(self, event):
-        try:
-            ctl = CallTimeline(
-                core_uuid = event.get('Core-UUID'),
-                hostname = event.get('FreeSWITCH-Hostname'),
-                switchame = event.get('FreeSWITCH-Switchname'),
-                switch_ipv4 = event.get('FreeSWITCH-IPv4'),
-                switch_ipv6 = event.get('FreeSWITCH-IPv6'),
-                call_uuid = event.get('Channel-Call-UUID'),
-                event_name = event.get('Event-Name'),
-                event_subclass = event.get('Event-Subclass'),
-                event_date_local = event.get('Event-Date-Local'),
-                event_epoch = self.str2int(event.get('Event-Date-Timestamp')),
-                event_sequence = self.str2int(event.get('Event-Sequence')),
-                event_calling_file = event.get('Event-Calling-File'),
-                event_calling_function = event.get('Event-Calling-Function')
-            )
-        except:
-            return False
-        return ctl
-
-    def add_ctl_application_data(self, fields, ctl, event):
-        ctl.application = event.get(fields[0])
-        ctl.application_uuid = event.get(fields[1])
-        ctl.application_data = event.get(fields[2])
-        ctl.application_status = event.get(fields[3])
-        ctl.application_file_path = event.get(fields[4])
-        ctl.application_seconds = self.str2int(event.get(fields[5]))
-        return
-
-    def add_ctl_caller_channel_data(self, ctl, event):
-        ctl.direction = event.get('Call-Direction')
-        ctl.other_leg_direction = event.get('Other-Leg-Direction')
-        ctl.context = event.get('Caller-Context')
-        ctl.other_leg_context = event.get('Other-Leg-Context')
-        ctl.hit_dialplan = event.get('Channel-HIT-Dialplan', 'false')
-        ctl.caller_user_name = event.get('Caller-Username')
-        ctl.caller_ani = event.get('Caller-ANI')
-        ctl.other_leg_user_name = event.get('Other-Leg-Username')
-        ctl.caller_uuid = event.get('Caller-Unique-ID')
-        ctl.other_leg_caller_uuid = event.get('Other-Leg-Caller-Unique-ID')
-        ctl.channel_name = event.get('Caller-Channel-Name')
-        ctl.channel_state = event.get('Channel-State')
-        ctl.channel_call_state = event.get('Channel-Call-State')
-        ctl.answer_state = event.get('Answer-State')
-        ctl.caller_id_name = event.get('Caller-Caller-ID-Name')
-        ctl.other_leg_caller_id_name = event.get('Other-Leg-Caller-ID-Name')
-        ctl.caller_id_number = event.get('Caller-Caller-ID-Number')
-        ctl.other_leg_caller_id_number = event.get('Other-Leg-Callee-ID-Number')
-        ctl.caller_destination = event.get('Caller-Destination-Number')
-        ctl.other_leg_caller_destination = event.get('Other-Leg-Destination-Number')
-        ctl.network_addr = event.get('Caller-Network-Addr')
-        ctl.other_leg_network_addr = event.get('Other-Leg-Network-Addr')
-        ctl.created_time = self.str2int(event.get('Caller-Channel-Created-Time'))
-        ctl.other_leg_created_time = self.str2int(event.get('Other-Leg-Channel-Created-Time'))
-        ctl.answered_time = self.str2int(event.get('Caller-Channel-Answered-Time'))
-        ctl.other_leg_answered_time = self.str2int(event.get('Other-Leg-Channel-Answered-Time'))
-        ctl.progress_time = self.str2int(event.get('Caller-Channel-Progress-Time'))
-        ctl.other_leg_progress_time = self.str2int(event.get('Other-Leg-Channel-Progress-Time'))
-        ctl.progress_media_time = self.str2int(event.get('Caller-Channel-Progress-Media-Time'))
-        ctl.other_leg_progress_media_time = self.str2int(event.get('Other-Leg-Channel-Progress-Media-Time'))
-        ctl.hangup_time = self.str2int(event.get('Caller-Channel-Hangup-Time'))
-        ctl.other_leg_hangup_time = self.str2int(event.get('Other-Leg-Channel-Hangup-Time'))
-        ctl.transfer_time = self.str2int(event.get('Caller-Channel-Transfer-Time'))
-        ctl.other_leg_transfer_time = self.str2int(event.get('Other-Leg-Channel-Transfer-Time'))
-        ctl.resurrect_time = self.str2int(event.get('Caller-Channel-Resurrect-Time'))
-        ctl.other_leg_resurrect_time = self.str2int(event.get('Other-Leg-Channel-Resurrect-Time'))
-        ctl.bridged_time = self.str2int(event.get('Caller-Channel-Bridged-Time'))
-        ctl.other_leg_bridged_time = self.str2int(event.get('Other-Leg-Channel-Bridged-Time'))
-        ctl.last_hold_time = self.str2int(event.get('Caller-Channel-Last-Hold'))
-        ctl.other_leg_last_hold_time = self.str2int(event.get('Other-Leg-Channel-Last-Hold'))
-        ctl.hold_accu_time = self.str2int(event.get('Caller-Channel-Hold-Accum'))
-        ctl.other_leg_hold_accu_time = self.str2int(event.get('Other-Leg-Channel-Hold-Accum'))
-        ctl.transfer_source = event.get('Caller-Transfer-Source')
-        return
+    def create_call_timeline(self, event, fields):
+        return fields.new(event)
 
     def handle_call_state(self, event):
-        ctl = self.create_call_timeline(event)
-        if not ctl:
-            return
-        self.add_ctl_caller_channel_data(ctl, event)
-        ctl.save()
+        self.write(self.create_call_timeline(event, eventfields.call_state))
         return
 
     def handle_dtmf(self, event):
-        ctl = self.create_call_timeline(event)
-        if not ctl:
-            return
-        self.add_ctl_caller_channel_data(ctl, event)
-        ctl.dtmf_digit = event.get('DTMF-Digit')
-        ctl.dtmf_duration = self.str2int(event.get('DTMF-Duration'))
-        ctl.dtmf_source = event.get('DTMF-Source')
-        ctl.save()
+        self.write(self.create_call_timeline(event, eventfields.dtmf))
         return
 
     def handle_channel_hold(self, event):
-        ctl = self.create_call_timeline(event)
-        if not ctl:
-            return
-        self.add_ctl_caller_channel_data(ctl, event)
-        ctl.bridge_channel = event.get('variable_bridge_channel')
-        ctl.save()
+        self.write(self.create_call_timeline(event, eventfields.channel_hold))
         return
 
     def handle_playback_start(self, event):
-        ctl = self.create_call_timeline(event)
-        if not ctl:
-            return
-        self.add_ctl_caller_channel_data(ctl, event)
-        self.add_ctl_application_data([
-            'variable_current_application',      # Application
-            None,                                # Application UUID
-            'variable_current_application_data', # Application Data
-            None,                                # Application Status
-            'Playback-File-Path',                # Application File Path
-            None                                 # Application Seconds
-            ], ctl, event)
-        ctl.save()
+        self.write(self.create_call_timeline(event, eventfields.playback_start))
         return
 
     def handle_playback_stop(self, event):
-        ctl = self.create_call_timeline(event)
-        if not ctl:
-            return
-        self.add_ctl_caller_channel_data(ctl, event)
-        self.add_ctl_application_data([
-            'variable_current_application',
-            None,
-            'variable_current_application_data',
-            'Playback-Status',
-            'Playback-File-Path',
-            'variable_playback_seconds'
-            ], ctl, event)
-        ctl.save()
+        self.write(self.create_call_timeline(event, eventfields.playback_stop))
         return
 
     def handle_callcentreinfo(self, event):
-        ctl = self.create_call_timeline(event)
-        if not ctl:
-            return
-        self.add_ctl_caller_channel_data(ctl, event)
-        self.add_ctl_application_data([
-            'variable_current_application',
-            None,
-            'variable_current_application_data',
-            None,
-            None,
-            None
-            ], ctl, event)
-        ctl.cc_side = event.get('variable_cc_side')
-        ctl.cc_queue = event.get('CC-Queue')
-        ctl.cc_action = event.get('CC-Action')
-        ctl.cc_count = self.str2int(event.get('CC-Count'))
+        ctl = self.create_call_timeline(event, eventfields.callcentre)
         jt = event.get('CC-Member-Joined-Time')
         if jt:
             ctl.cc_member_joining_time = self.str2int(jt)
         else:
             ctl.cc_member_joining_time = self.str2int(event.get('variable_cc_queue_joined_epoch'))
-        ctl.cc_member_leaving_time = self.str2int(event.get('CC-Member-Leaving-Time'))
-        ctl.cc_cause = event.get('CC-Cause')
-        ctl.cc_hangup_cause = event.get('CC-Hangup-Cause')
-        ctl.cc_cancel_reason = event.get('CC-Cancel-Reason')
-        ctl.cc_member_uuid = event.get('CC-Member-UUID')
-        ctl.cc_member_session_uuid = event.get('CC-Member-Session-UUID')
-        ctl.cc_member_caller_id_name = event.get('CC-Member-CID-Name')
-        ctl.cc_member_caller_id_number = event.get('CC-Member-CID-Number')
-        ctl.cc_agent = event.get('CC-Agent')
-        ctl.cc_agent_uuid = event.get('CC-Agent-UUID')
-        ctl.cc_agent_system = event.get('CC-Agent-System')
-        ctl.cc_agent_type = event.get('CC-Agent-Type')
-        ctl.cc_agent_state = event.get('CC-Agent-State')
-        ctl.cc_agent_called_time = self.str2int(event.get('CC-Agent-Called-Time'))
-        ctl.cc_agent_answered_time = self.str2int(event.get('CC-Agent-Answered-Time'))
-        ctl.save()
+        self.write(ctl)
         return
 
     def handle_conferencemaintenance(self, event):
-        ctl = self.create_call_timeline(event)
-        if not ctl:
-            return
-        self.add_ctl_caller_channel_data(ctl, event)
-        ctl.cf_name = event.get('Conference-Name')
-        ctl.cf_action = event.get('Action')
-        ctl.cf_uuid = event.get('Conference-Unique-ID')
-        ctl.cf_domain = event.get('Conference-Domain')
-        ctl.cf_size = event.get('Conference-Size')
-        ctl.cf_ghosts = event.get('Conference-Ghosts')
-        ctl.cf_profile_name = event.get('Conference-Profile-Name')
-        ctl.cf_member_type = event.get('Member-Type')
-        ctl.cf_member_id = event.get('Member-ID')
-        ctl.save()
+        self.write(self.create_call_timeline(event, eventfields.conference))
         return
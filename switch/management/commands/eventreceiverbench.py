@@ -0,0 +1,154 @@
+#
+#    DjangoPBX
+#
+#    MIT License
+#
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
+#
+#    Permission is hereby granted, free of charge, to any person obtaining a copy
+#    of this software and associated documentation files (the "Software"), to deal
+#    in the Software without restriction, including without limitation the rights
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#    copies of the Software, and to permit persons to whom the Software is
+#    furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in all
+#    copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#    SOFTWARE.
+#
+#    Contributor(s):
+#    Adrian Fretwell <adrian@djangopbx.com>
+#
+
+import json
+import time
+import uuid
+import random
+import string
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.translation import gettext_lazy as _
+from tenants.models import Domain
+from accounts.models import Extension
+from switch import eventfields
+from switch.extensionindex import ExtensionIndex
+from switch.recordingindex import RecordingIndex
+from switch.eventmetrics import EventMetrics
+from .eventreceiver import Command as EventReceiver
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark eventreceiver event decoding and handling, single core and without the database writes'
+
+    event_types = ['cdr', 'callstate', 'dtmf', 'playback', 'callcentre']
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=20000, help=_('Events per event type (default 20000)'))
+        parser.add_argument('--variables', type=int, default=250, help=_('Channel variables per event (default 250)'))
+        parser.add_argument('--domain', help=_('Domain of the CDRs (default the first domain)'))
+        parser.add_argument('--json', action='store_true', help=_('Decode events with json rather than orjson'))
+        parser.add_argument('--types', help=_('Comma separated event types to run (default all)'))
+
+    def handle(self, *args, **kwargs):
+        if kwargs['domain']:
+            d = Domain.objects.filter(name=kwargs['domain']).first()
+        else:
+            d = Domain.objects.order_by('name').first()
+        if not d:
+            raise CommandError(_('No domain found for the CDRs'))
+        e = Extension.objects.filter(domain_id=d).first()
+        if kwargs['json']:
+            eventfields.decode_event = json.loads
+        self.stdout.write('Decoder %s.%s' % (eventfields.decode_event.__module__, eventfields.decode_event.__name__))
+
+        receiver = EventReceiver()
+        receiver.b_leg = []
+        receiver.cdrformat = 'json'
+        receiver.extensions = ExtensionIndex()
+        receiver.recordings = RecordingIndex()
+        receiver.metrics = EventMetrics()
+        receiver.written = 0
+        receiver.write = self.counter(receiver)
+
+        types = self.event_types
+        if kwargs['types']:
+            types = kwargs['types'].split(',')
+        for event_type in types:
+            body = self.event(event_type, d.name, e.extension if e else '100', kwargs['variables'])
+            receiver.handle_message(None, body)  # warm the indexes
+            self.run(event_type, receiver, body, kwargs['events'])
+
+    def counter(self, receiver):
+        def write(instance):
+            receiver.written += 1
+        return write
+
+    def run(self, event_type, receiver, body, count):
+        start = time.perf_counter()
+        for i in range(count):
+            eventfields.decode_event(body)
+        decoded = time.perf_counter() - start
+        receiver.written = 0
+        start = time.perf_counter()
+        for i in range(count):
+            receiver.timed_handle_message(None, body)
+        elapsed = time.perf_counter() - start
+        self.stdout.write('%-12s %6d bytes %8.0f events/s %7.1f us/event  decode %6.1f us  %d written' % (
+            event_type, len(body), count / elapsed, elapsed / count * 1e6, decoded / count * 1e6, receiver.written
+            ))
+
+    def event(self, event_type, domain_name, extension, variables):
+        # A FreeSWITCH JSON event of the given type, with as many channel variables
+        #  as a typical call.
+        call_uuid = str(uuid.uuid4())
+        now = time.time()
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
+        event = {
+            'Event-Name': 'CHANNEL_CALLSTATE', 'Core-UUID': str(uuid.uuid4()),
+            'FreeSWITCH-Hostname': 'bench', 'FreeSWITCH-Switchname': 'bench', 'FreeSWITCH-IPv4': '192.0.2.1',
+            'FreeSWITCH-IPv6': '::1', 'Event-Date-Local': stamp, 'Event-Date-Timestamp': str(int(now * 1000000)),
+            'Event-Calling-File': 'switch_channel.c', 'Event-Calling-Function': 'switch_channel_perform_set_callstate',
+            'Event-Sequence': '1000', 'Channel-State': 'CS_EXECUTE', 'Channel-Call-State': 'ACTIVE',
+            'Answer-State': 'answered', 'Call-Direction': 'inbound', 'Channel-HIT-Dialplan': 'true',
+            'Channel-Call-UUID': call_uuid, 'Caller-Direction': 'inbound', 'Caller-Username': extension,
+            'Caller-Caller-ID-Name': extension, 'Caller-Caller-ID-Number': extension, 'Caller-ANI': extension,
+            'Caller-Destination-Number': '*9664', 'Caller-Unique-ID': call_uuid, 'Caller-Context': domain_name,
+            'Caller-Channel-Name': 'sofia/internal/%s@%s' % (extension, domain_name),
+            'Caller-Network-Addr': '192.0.2.10', 'Caller-Channel-Created-Time': str(int(now * 1000000)),
+            'Caller-Channel-Answered-Time': str(int(now * 1000000)),
+            }
+        for i in range(variables):
+            event['variable_bench_%d' % i] = ''.join(random.choices(string.ascii_letters, k=24))
+        event.update({
+            'variable_uuid': call_uuid, 'variable_domain_name': domain_name, 'variable_call_direction': 'local',
+            'variable_dialed_user': extension, 'variable_start_stamp': stamp, 'variable_answer_stamp': stamp,
+            'variable_end_stamp': stamp, 'variable_start_epoch': str(int(now)), 'variable_answer_epoch': str(int(now)),
+            'variable_end_epoch': str(int(now)), 'variable_duration': '30', 'variable_billsec': '30',
+            'variable_current_application': 'playback',
+            'variable_current_application_data': 'ivr/8000/ivr-welcome.wav',
+            })
+        if event_type == 'cdr':
+            event['Event-Name'] = 'CHANNEL_HANGUP_COMPLETE'
+            event['variable_hangup_cause'] = 'NORMAL_CLEARING'
+            event['variable_hangup_cause_q850'] = '16'
+        elif event_type == 'dtmf':
+            event.update({'Event-Name': 'DTMF', 'DTMF-Digit': '5', 'DTMF-Duration': '2000', 'DTMF-Source': 'RTP'})
+        elif event_type == 'playback':
+            event.update({
+                'Event-Name': 'PLAYBACK_STOP', 'Playback-File-Path': 'ivr/8000/ivr-welcome.wav',
+                'Playback-Status': 'done', 'variable_playback_seconds': '3'
+                })
+        elif event_type == 'callcentre':
+            event.update({
+                'Event-Name': 'CUSTOM', 'Event-Subclass': 'callcenter::info', 'CC-Queue': 'sales@%s' % domain_name,
+                'CC-Action': 'member-queue-start', 'CC-Count': '1', 'CC-Member-UUID': str(uuid.uuid4()),
+                'CC-Member-Session-UUID': call_uuid, 'CC-Member-CID-Name': extension,
+                'CC-Member-CID-Number': extension, 'CC-Member-Joined-Time': str(int(now)),
+                })
+        return json.dumps(event, indent=1).encode()
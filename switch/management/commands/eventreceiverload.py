@@ -0,0 +1,219 @@
+#
+#    DjangoPBX
+#
+#    MIT License
+#
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
+#
+#    Permission is hereby granted, free of charge, to any person obtaining a copy
+#    of this software and associated documentation files (the "Software"), to deal
+#    in the Software without restriction, including without limitation the rights
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#    copies of the Software, and to permit persons to whom the Software is
+#    furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in all
+#    copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#    SOFTWARE.
+#
+#    Contributor(s):
+#    Adrian Fretwell <adrian@djangopbx.com>
+#
+
+import time
+import uuid
+import queue
+import multiprocessing
+from pika.spec import Basic, BasicProperties
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connections
+from django.utils.translation import gettext_lazy as _
+from tenants.models import Domain
+from accounts.models import Extension
+from xmlcdr.models import XmlCdr, CallTimeline
+from pbx.dbconnections import fork_safe_connections
+from pbx.scripts.resources.pbx.fseventgen import FsEventGenerator
+from switch.eventworkers import EventWorkerPool
+from switch.extensionindex import ExtensionIndex
+from switch.recordingindex import RecordingIndex
+from switch.eventmetrics import Histogram
+from .eventreceiver import Command as EventReceiver
+
+
+class LocalConnection():
+
+    # Stands in for the pika connection, callbacks added from other threads are run
+    #  by the thread feeding the events, as pika runs them on the connection's thread.
+
+    def __init__(self):
+        self.callbacks = queue.SimpleQueue()
+
+    def add_callback_threadsafe(self, callback):
+        self.callbacks.put(callback)
+
+    def process_data_events(self, time_limit=0):
+        try:
+            callback = self.callbacks.get(timeout=time_limit) if time_limit else self.callbacks.get_nowait()
+            while True:
+                callback()
+                callback = self.callbacks.get_nowait()
+        except queue.Empty:
+            pass
+
+
+class LocalChannel():
+
+    # Stands in for the AMQP channel, recording acknowledgements and publishes.
+
+    is_open = True
+
+    def __init__(self):
+        self.connection = LocalConnection()
+        self.acked = 0
+        self.published = 0
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acked = max(self.acked, delivery_tag)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self.published += 1
+
+
+def generate(outq, domains, calls, concurrency, variables, core_uuid, seed):
+    # Generator process, None marks the end of its events.
+    gen = FsEventGenerator(domains, variables=variables, seed=seed, core_uuid=core_uuid)
+    for routing_key, body in gen.stream(calls, concurrency):
+        outq.put(body)
+    outq.put(None)
+
+
+class Command(BaseCommand):
+    help = 'Load test the eventreceiver with synthetic FreeSWITCH events, written to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=2000, help=_('Synthetic calls (default 2000)'))
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help=_('Calls in progress at once per generator (default 50)'))
+        parser.add_argument('--variables', type=int, default=150,
+                            help=_('Padding channel variables per event (default 150)'))
+        parser.add_argument('--domains', help=_('Comma separated domains of the calls (default all enabled)'))
+        parser.add_argument('--extensions', type=int, default=50,
+                            help=_('Extensions per domain taking part (default 50)'))
+        parser.add_argument('--workers', type=int, default=1, help=_('Event Receiver worker processes (default 1)'))
+        parser.add_argument('--generators', type=int, default=2, help=_('Event generator processes (default 2)'))
+        parser.add_argument('--prefetch', type=int, help=_('Unacknowledged events allowed (default as configured)'))
+        parser.add_argument('--spool', action='store_true', help=_('Use the configured spool'))
+        parser.add_argument('--keep', action='store_true', help=_('Keep the CDRs and call timeline records'))
+        parser.add_argument('--seed', type=int, help=_('Random seed for repeatable runs'))
+
+    def handle(self, *args, **kwargs):
+        domains = Domain.objects.filter(enabled='true')
+        if kwargs['domains']:
+            domains = domains.filter(name__in=kwargs['domains'].split(','))
+        calls_to = {}
+        for d in domains:
+            extensions = list(Extension.objects.filter(domain_id=d, enabled='true').order_by('extension').
+                              values_list('extension', flat=True)[:kwargs['extensions']])
+            if extensions:
+                calls_to[d.name] = extensions
+        if not calls_to:
+            raise CommandError(_('No domains with extensions found'))
+
+        receiver = EventReceiver()
+        receiver.load_settings()
+        receiver.message_broker_adhoc_publish = False
+        receiver.db_check_interval = getattr(settings, 'PBX_DB_CHECK_INTERVAL', 10)
+        receiver.spool_path = getattr(settings, 'PBX_EVENTRECEIVER_SPOOL', None) if kwargs['spool'] else None
+        receiver.extensions = ExtensionIndex(getattr(settings, 'PBX_EVENTRECEIVER_EXTENSION_INDEX_TTL', 3600))
+        receiver.recordings = RecordingIndex()
+        prefetch = kwargs['prefetch'] or getattr(settings, 'PBX_EVENTRECEIVER_PREFETCH', 2000)
+        core_uuid = str(uuid.uuid4())
+        self.stdout.write('Core-UUID %s, %d calls in %d domains' % (core_uuid, kwargs['calls'], len(calls_to)))
+
+        # Generators are forked before the database is used again, as are the workers.
+        fork_safe_connections()
+        ctx = multiprocessing.get_context('fork')
+        genq = ctx.Queue(1000)
+        generators = max(kwargs['generators'], 1)
+        for i in range(generators):
+            calls = kwargs['calls'] // generators + (1 if i < kwargs['calls'] % generators else 0)
+            seed = None if kwargs['seed'] is None else kwargs['seed'] + i
+            ctx.Process(target=generate, daemon=True, args=(
+                genq, calls_to, calls, kwargs['concurrency'], kwargs['variables'], core_uuid, seed
+                )).start()
+
+        if kwargs['workers'] > 1:
+            pool = EventWorkerPool(kwargs['workers'], receiver.run_worker, prefetch)
+            pool.start()
+            on_message = pool.dispatch
+            on_stop = pool.stop
+        else:
+            receiver.metrics = receiver.new_metrics()
+            receiver.writer = receiver.new_writer(receiver.spool_path)
+            receiver.writer.start()
+            receiver.start_metrics()
+            on_message = receiver.on_message
+            on_stop = receiver.writer.close
+
+        channel = LocalChannel()
+        properties = BasicProperties()
+        tag = 0
+        waiting = 0.0
+        running = generators
+        start = time.monotonic()
+        reported = start
+        while running:
+            channel.connection.process_data_events()
+            while tag - channel.acked >= prefetch:
+                # As the broker, nothing more is sent until some are acknowledged.
+                channel.connection.process_data_events(0.1)
+            t = time.monotonic()
+            body = genq.get()
+            waiting += time.monotonic() - t
+            if body is None:
+                running -= 1
+                continue
+            tag += 1
+            on_message(channel, Basic.Deliver(delivery_tag=tag), properties, body)
+            if t - reported >= 5:
+                reported = t
+                self.stdout.write('%8d events, %8d acknowledged, %6.0f events/s' % (
+                    tag, channel.acked, channel.acked / (t - start)
+                    ))
+        while channel.acked < tag:
+            channel.connection.process_data_events(0.1)
+        elapsed = time.monotonic() - start
+        on_stop()
+        channel.connection.process_data_events()
+        connections.close_all()
+
+        cdrs = XmlCdr.objects.filter(core_uuid=core_uuid).count()
+        timeline = CallTimeline.objects.filter(core_uuid=core_uuid).count()
+        self.stdout.write('%d events in %.1f seconds, %.0f events/s, waited %.1f seconds for the generators' % (
+            tag, elapsed, tag / elapsed, waiting
+            ))
+        self.stdout.write('%d rows, %.0f rows/s: %d CDRs, %d call timeline' % (
+            cdrs + timeline, (cdrs + timeline) / elapsed, cdrs, timeline
+            ))
+        if receiver.metrics:
+            m = receiver.metrics.snapshot()
+            for k, h in sorted(m['latency_ms'].items()):
+                self.stdout.write('  %-24s %7d events, handler p50 %s ms, p99 %s ms' % (
+                    k, h['count'], Histogram.quantile(h, 0.5), Histogram.quantile(h, 0.99)
+                    ))
+            h = m['flush_ms']
+            if h['count']:
+                self.stdout.write('  %d flushes, mean %.1f ms, mean batch %.1f' % (
+                    h['count'], h['sum'] / h['count'], m['batch']['sum'] / h['count']
+                    ))
+        if not kwargs['keep']:
+            XmlCdr.objects.filter(core_uuid=core_uuid).delete()
+            CallTimeline.objects.filter(core_uuid=core_uuid).delete()
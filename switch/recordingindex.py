@@ -0,0 +1,93 @@
+#
+#    DjangoPBX
+#
+#    MIT License
+#
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
+#
+#    Permission is hereby granted, free of charge, to any person obtaining a copy
+#    of this software and associated documentation files (the "Software"), to deal
+#    in the Software without restriction, including without limitation the rights
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#    copies of the Software, and to permit persons to whom the Software is
+#    furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in all
+#    copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#    SOFTWARE.
+#
+#    Contributor(s):
+#    Adrian Fretwell <adrian@djangopbx.com>
+#
+
+import os
+import time
+from django.conf import settings
+
+
+class RecordingIndex():
+
+    # A per process index of the file names in recording archive directories, such
+    #  as recordings/<domain>/archive/YYYY/Mon/DD, so that finding the recording of
+    #  a call is a dictionary lookup rather than a probe for each possible file name.
+    #
+    # A directory is listed on first use.  A name that is not in the index costs one
+    #  stat of its directory, and the directory is only listed again if its mtime has
+    #  changed.  If the directory was listed more than mtime_margin seconds after the
+    #  call ended, which is the case for a backlog of events, not even that.  inotify
+    #  is not used as it does not report files written by other NFS clients.
+    #
+    # A directory whose mtime is within mtime_margin of its listing may not show a
+    #  file written in the same tick, or on NFS one the attribute cache does not show
+    #  yet, so it is listed again on the next miss.  PBX_RECORDING_INDEX_MTIME_MARGIN
+    #  should be at least acdirmax for recordings on NFS.
+
+    def __init__(self, max_age=3600):
+        self.max_age = max_age
+        self.mtime_margin = getattr(settings, 'PBX_RECORDING_INDEX_MTIME_MARGIN', 2)
+        self.dirs = {}
+
+    def find(self, directory, names, since=None):
+        # Returns the first of names found in directory, or None.
+        entry = self.dirs.get(directory)
+        if entry:
+            entry['used'] = time.monotonic()
+            for name in names:
+                if name in entry['names']:
+                    return name
+            if since and entry['checked'] - self.mtime_margin > since:
+                return None
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            return None
+        if entry and entry['mtime'] == mtime:
+            return None
+        now = time.time()
+        try:
+            listing = set(os.listdir(directory))
+        except OSError:
+            return None
+        if now - mtime < self.mtime_margin:
+            mtime = None
+        if not entry:
+            self.prune()
+        entry = {'names': listing, 'mtime': mtime, 'checked': now, 'used': time.monotonic()}
+        self.dirs[directory] = entry
+        for name in names:
+            if name in listing:
+                return name
+        return None
+
+    def prune(self):
+        expired = time.monotonic() - self.max_age
+        for directory, entry in list(self.dirs.items()):
+            if entry['used'] < expired:
+                self.dirs.pop(directory, None)
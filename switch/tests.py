@@ -3,7 +3,7 @@
 #
 #    MIT License
 #
-#    Copyright (c) 2016 - 2022 Adrian Fretwell <adrian@djangopbx.com>
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
 #
 #    Permission is hereby granted, free of charge, to any person obtaining a copy
 #    of this software and associated documentation files (the "Software"), to deal
@@ -27,6 +27,315 @@
 #    Adrian Fretwell <adrian@djangopbx.com>
 #
 
-# from django.test import TestCase
+import os
+import pickle
+import socket
+import tempfile
+import datetime
+import time
+from django.test import SimpleTestCase
+from django.utils import timezone
+from xmlcdr.models import CallTimeline
+from switch import eventfields
+from pbx.bulkwriter import BulkWriter
+from pbx.fseventsocket import EventSocket
+from tenants.models import Domain
+from switch.management.commands.eventreceiver import Command as EventReceiver
 
-# Create your tests here.
+
+class FakeExtensions():
+    def __init__(self, domain):
+        self.d = domain
+
+    def domain(self, domain_name):
+        return self.d
+
+    def by_uuid(self, domain_name, extension_uuid):
+        return None
+
+
+class FakeWriter():
+    def __init__(self):
+        self.records = []
+
+    def put(self, instance, ack=None):
+        self.records.append(instance)
+
+
+class EventReceiverCdrTests(SimpleTestCase):
+
+    def setUp(self):
+        self.receiver = EventReceiver()
+        self.receiver.b_leg = ['outbound']
+        self.receiver.extensions = FakeExtensions(Domain(name='test.example.com'))
+        self.receiver.writer = FakeWriter()
+
+    def cdr_event(self, **variables):
+        event = {
+            'Event-Name': 'CHANNEL_HANGUP_COMPLETE',
+            'Core-UUID': 'c0a2c8d4-2d4f-4a38-bb1a-0e9b2b0c6d01',
+            'Channel-Call-UUID': '5b8f3c2e-1f0a-4e52-9f4c-6d7e8a9b0c1d',
+            'Channel-HIT-Dialplan': 'true',
+            'Caller-Context': 'test.example.com',
+            'Caller-Destination-Number': '201',
+            'variable_domain_name': 'test.example.com',
+            'variable_extension_uuid': '9d3e4f5a-6b7c-4d8e-9f0a-1b2c3d4e5f60',
+            'variable_call_direction': 'local',
+            'variable_start_stamp': '2024-05-01 10:00:00',
+            'variable_duration': '42',
+            'variable_billsec': '40',
+            }
+        event.update(('variable_%s' % k, v) for k, v in variables.items())
+        return event
+
+    def test_api_on_answer_recording(self):
+        self.receiver.handle_cdr(self.cdr_event(api_on_answer=(
+            'uuid_record%205b8f3c2e-1f0a-4e52-9f4c-6d7e8a9b0c1d%20start%20'
+            '/var/lib/freeswitch/recordings/test.example.com/archive/2024/May/01/call.wav'
+            )))
+        self.assertEqual(len(self.receiver.writer.records), 1)
+        xcdr = self.receiver.writer.records[0]
+        self.assertEqual(
+            xcdr.record_path, '/var/lib/freeswitch/recordings/test.example.com/archive/2024/May/01'
+            )
+        self.assertEqual(xcdr.record_name, 'call.wav')
+        self.assertEqual(xcdr.duration, 42)
+
+    def test_handler_fields(self):
+        self.receiver.recordings = type('FakeRecordings', (), {'find': lambda *args: None})()
+        event = self.cdr_event(caller_id_number='0123456789', progress_mediamsec='150', progressmsec='50')
+        del event['variable_start_stamp']
+        self.receiver.handle_cdr(event)
+        xcdr = self.receiver.writer.records[0]
+        self.assertEqual(xcdr.caller_id_number, '0123456789')
+        self.assertIsNone(xcdr.caller_id_name)
+        self.assertEqual(xcdr.pdd_ms, 200)
+        self.assertIsNotNone(xcdr.start_stamp)
+
+    def test_api_on_answer_without_recording(self):
+        self.receiver.recordings = type('FakeRecordings', (), {'find': lambda *args: None})()
+        self.receiver.handle_cdr(self.cdr_event(api_on_answer='uuid_setvar%20x'))
+        self.assertEqual(len(self.receiver.writer.records), 1)
+        self.assertIsNone(self.receiver.writer.records[0].record_name)
+
+
+class FieldMapTests(SimpleTestCase):
+
+    def test_conversions(self):
+        fields = eventfields.FieldMap(CallTimeline, [
+            ('event_name',       'Event-Name'),
+            ('event_sequence',   'Event-Sequence', 'int'),
+            ('channel_state',    'Channel-State', None, 'CS_NEW'),
+            ('created_time',     'Caller-Channel-Created-Time', 'int', 7),
+            ('application_uuid', None),
+            ('application_data', None, None, 'none'),
+            ('application_seconds', None, 'int'),
+            ])
+        ctl = fields.new({'Event-Name': 'DTMF', 'Event-Sequence': '12', 'Caller-Channel-Created-Time': 'x'},
+                         call_uuid='5b8f3c2e-1f0a-4e52-9f4c-6d7e8a9b0c1d')
+        self.assertIsInstance(ctl, CallTimeline)
+        self.assertEqual(ctl.event_name, 'DTMF')
+        self.assertEqual(ctl.event_sequence, 12)
+        self.assertEqual(ctl.channel_state, 'CS_NEW')
+        self.assertEqual(ctl.created_time, 0)
+        self.assertIsNone(ctl.application_uuid)
+        self.assertEqual(ctl.application_data, 'none')
+        self.assertEqual(ctl.application_seconds, 0)
+        self.assertEqual(ctl.call_uuid, '5b8f3c2e-1f0a-4e52-9f4c-6d7e8a9b0c1d')
+        # Fields not in the map keep the model's defaults.
+        self.assertIsNone(ctl.dtmf_digit)
+        self.assertTrue(ctl._state.adding)
+
+    def test_callable_defaults(self):
+        fields = eventfields.FieldMap(CallTimeline, [])
+        self.assertNotEqual(fields.new({}).id, fields.new({}).id)
+
+    def test_invalid_attribute(self):
+        with self.assertRaises(ValueError):
+            eventfields.FieldMap(CallTimeline, [('event_name = 1; x', 'Event-Name')])
+
+    def test_cdr_fields(self):
+        xcdr = eventfields.cdr.new({
+            'variable_answer': 'wrong', 'variable_answer_epoch': '1714557601',
+            'variable_answer_stamp': '2024-05-01 10:00:01', 'variable_cc_queue_joined_epoch': '1714557590',
+            'variable_rtp_audio_in_mos': '4.4567', 'variable_hangup_cause_q850': '16',
+            })
+        self.assertEqual(xcdr.answer_epoch, 1714557601)
+        self.assertEqual(xcdr.cc_queue_joined_epoch, 1714557590)
+        self.assertEqual(xcdr.rtp_audio_in_mos, 4.46)
+        self.assertEqual(xcdr.hangup_cause_q850, 16)
+        self.assertEqual(xcdr.direction, 'none')
+        self.assertEqual(
+            xcdr.answer_stamp, timezone.make_aware(datetime.datetime(2024, 5, 1, 10, 0, 1))
+            )
+        self.assertIsNone(xcdr.end_stamp)
+
+    def test_to_stamp(self):
+        self.assertIsNone(eventfields.to_stamp(''))
+        self.assertIsNone(eventfields.to_stamp('not a stamp'))
+
+
+class UnreachableWriter(BulkWriter):
+    def write(self, groups, size):
+        return False
+
+
+class BulkWriterSpoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.spool_path = os.path.join(self.tmpdir.name, 'writer.spool')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_spool_framing(self):
+        writer = BulkWriter(spool_path=self.spool_path)
+        self.assertFalse(writer.spooled)
+        writer.spool({'a': [1, 2], 'b': []}, 2)
+        writer.spool({'a': [3]}, 1)
+        self.assertTrue(writer.spooled)
+        self.assertEqual(writer.stats['spooled'], 3)
+        self.assertEqual(writer.spool_bytes(), os.path.getsize(self.spool_path))
+        batches = [pickle.loads(data) for data in BulkWriter.read_spool(self.spool_path)]
+        self.assertEqual(batches, [{'a': [1, 2]}, {'a': [3]}])
+        # A new writer finds the spool to be replayed.
+        self.assertTrue(BulkWriter(spool_path=self.spool_path).spooled)
+
+    def test_truncated_spool(self):
+        BulkWriter(spool_path=self.spool_path).spool({'a': [1]}, 1)
+        with open(self.spool_path, 'ab') as f:
+            f.write(b'\x00\x00\x00\x10short')
+        with self.assertLogs('pbx.bulkwriter', 'WARNING'):
+            batches = [pickle.loads(data) for data in BulkWriter.read_spool(self.spool_path)]
+        self.assertEqual(batches, [{'a': [1]}])
+
+    def test_spooled_batch_acknowledged(self):
+        acks = []
+        writer = UnreachableWriter(spool_path=self.spool_path)
+        writer.flush([(1, None), (2, lambda: acks.append(2)), (None, lambda: acks.append(3))])
+        self.assertEqual(acks, [3])
+        batches = [pickle.loads(data) for data in BulkWriter.read_spool(self.spool_path)]
+        self.assertEqual(batches, [{int: [1, 2]}])
+
+
+class EventReceiverSpoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.receiver = EventReceiver()
+        self.receiver.spool_path = os.path.join(self.tmpdir.name, 'eventreceiver.spool')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def spool(self, path, *batches):
+        writer = BulkWriter(spool_path=path)
+        for batch in batches:
+            writer.spool({'batch': [batch]}, 1)
+
+    def batches(self, path):
+        return sorted(pickle.loads(data)['batch'][0] for data in BulkWriter.read_spool(path))
+
+    def test_fewer_workers(self):
+        self.spool(self.receiver.worker_spool_path(0), 'a')
+        self.spool(self.receiver.worker_spool_path(2), 'b', 'c')
+        self.spool(self.receiver.worker_spool_path(2) + '.replay', 'd')
+        self.receiver.claim_spools(2)
+        self.assertEqual(self.batches(self.receiver.worker_spool_path(0)), ['a', 'b', 'c', 'd'])
+        self.assertEqual(os.listdir(self.tmpdir.name), ['eventreceiver.spool.0'])
+
+    def test_single_process(self):
+        self.spool(self.receiver.spool_path, 'a')
+        self.spool(self.receiver.worker_spool_path(0), 'b')
+        self.spool(self.receiver.worker_spool_path(1), 'c')
+        self.receiver.claim_spools(1)
+        self.assertEqual(self.batches(self.receiver.spool_path), ['a', 'b', 'c'])
+        self.assertEqual(os.listdir(self.tmpdir.name), ['eventreceiver.spool'])
+
+    def test_truncated_spools(self):
+        for path, batch in ((self.receiver.spool_path, 'a'), (self.receiver.worker_spool_path(0), 'b')):
+            self.spool(path, batch)
+            with open(path, 'ab') as f:
+                f.write(b'\x00\x00\x01\x00partial')
+        self.receiver.claim_spools(1)
+        self.assertEqual(self.batches(self.receiver.spool_path), ['a', 'b'])
+
+
+class EventSocketReaderTests(SimpleTestCase):
+
+    def setUp(self):
+        self.switch, sock = socket.socketpair()
+        self.es = EventSocket(sock, timeout=0.5)
+
+    def tearDown(self):
+        self.es.disconnect()
+        self.switch.close()
+
+    def message(self, content_type, body='', **headers):
+        headers['Content-Type'] = content_type
+        if body:
+            headers['Content-Length'] = len(body.encode())
+        return ''.join('%s: %s\n' % h for h in headers.items()).encode() + b'\n' + body.encode()
+
+    def test_content_length_body(self):
+        # A body may itself contain blank lines.
+        body = 'UP 0 years, 1 day\n\n+OK'
+        self.switch.sendall(self.message('api/response', body))
+        self.assertTrue(self.es.read())
+        self.assertEqual(self.es.headers['Content-Type'], 'api/response')
+        self.assertEqual(self.es.body, body)
+        self.assertEqual(self.es.buffer, b'')
+
+    def test_split_and_joined_messages(self):
+        data = self.message('api/response', 'first') + self.message('command/reply', **{'Reply-Text': '+OK'})
+        data += self.message('api/response', 'second')
+        self.switch.sendall(data)
+        # Headers and bodies arrive split across reads.
+        self.es.recv_size = 7
+        self.assertEqual(self.es.reply(self.deadline()), 'first')
+        self.assertEqual(self.es.reply(self.deadline()), '')
+        self.assertEqual(self.es.headers['Reply-Text'], '+OK')
+        self.assertEqual(self.es.reply(self.deadline()), 'second')
+
+    def test_events_skipped(self):
+        self.switch.sendall(
+            self.message('text/event-json', '{"Event-Name": "HEARTBEAT"}') + self.message('log/data', 'log line') +
+            self.message('api/response', '+OK')
+            )
+        self.assertEqual(self.es.reply(self.deadline()), '+OK')
+
+    def test_send_many(self):
+        self.switch.sendall(self.message('api/response', 'one') + self.message('api/response', 'two'))
+        self.assertEqual(self.es.send_many(['api status', 'api version']), ['one', 'two'])
+        self.assertEqual(self.switch.recv(1024), b'api status\n\napi version\n\n')
+
+    def test_disconnect_notice(self):
+        self.switch.sendall(self.message('text/disconnect-notice', 'Disconnected, goodbye.'))
+        with self.assertLogs('pbx.fseventsocket', 'WARNING'):
+            self.assertFalse(self.es.reply(self.deadline()))
+        self.assertFalse(self.es.connected)
+
+    def test_timeout(self):
+        self.switch.sendall(self.message('api/response', 'truncated')[:-3])
+        with self.assertLogs('pbx.fseventsocket', 'WARNING'):
+            self.assertFalse(self.es.read())
+        self.assertFalse(self.es.connected)
+        self.assertFalse(self.es.lost)
+
+    def test_send_timeout(self):
+        self.es.timeout = 10
+        start = time.monotonic()
+        with self.assertLogs('pbx.fseventsocket', 'WARNING'):
+            self.assertFalse(self.es.send('api vm_delete 201@test.example.com 1', timeout=0.1))
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertFalse(self.es.connected)
+
+    def test_closed(self):
+        self.switch.close()
+        with self.assertLogs('pbx.fseventsocket', 'WARNING'):
+            self.assertFalse(self.es.read())
+        self.assertTrue(self.es.lost)
+
+    def deadline(self):
+        return time.monotonic() + self.es.timeout
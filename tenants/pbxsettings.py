@@ -154,7 +154,7 @@ class PbxSettings():
         elif settingtype == 'array':
             value = []
             for q in qs:
-                value.append(qs[0].value)
+                value.append(q.value)
         return value
 
     def default_settings_wild(self, cat, subcat, settingtype='text', defaultsetting='', usedefault=False):
@@ -204,14 +204,23 @@ class FreeswitchesViewSet(GenericItemValueViewSet):
              return -1
         return settings.PBX_FREESWITCHES[pk]
 
+    def reload_response(self, rload, command, results):
+        failed = rload.failed(results)
+        if not failed:
+            status = 'ok'
+        elif len(failed) < len(results):
+            status = 'partial'
+        else:
+            status = 'failed'
+        return Response({'status': '%s %s' % (command, status), 'results': results})
+
     @action(detail=True)
     def reload_xml_single(self, request, pk=None):
         obj = self.get_fs_object(pk)
         rload = ReloadXml()
         if not rload.connect():
             return Response({'status': 'broker/socket error'})
-        rload.xml(obj)
-        return Response({'status': 'reloadxml ok'})
+        return self.reload_response(rload, 'reloadxml', rload.xml(obj))
 
     @action(detail=True)
     def reload_acl_single(self, request, pk=None):
@@ -219,24 +228,21 @@ class FreeswitchesViewSet(GenericItemValueViewSet):
         rload = ReloadXml()
         if not rload.connect():
             return Response({'status': 'broker/socket error'})
-        rload.acl(obj)
-        return Response({'status': 'reloadacl ok'})
+        return self.reload_response(rload, 'reloadacl', rload.acl(obj))
 
     @action(detail=False)
     def reload_xml_global(self, request):
         rload = ReloadXml()
         if not rload.connect():
             return Response({'status': 'broker/socket error'})
-        rload.xml()
-        return Response({'status': 'reloadxml ok'})
+        return self.reload_response(rload, 'reloadxml', rload.xml())
 
     @action(detail=False)
     def reload_acl_global(self, request):
         rload = ReloadXml()
         if not rload.connect():
             return Response({'status': 'broker/socket error'})
-        rload.acl()
-        return Response({'status': 'reloadacl ok'})
+        return self.reload_response(rload, 'reloadacl', rload.acl())
 
 
 class TimeConditionPresetsViewSet(viewsets.ModelViewSet):
@@ -28,79 +28,61 @@
 #
 
 from django.core.cache import cache
-from dialplans.models import Dialplan
-
-phrases_available = True
-try:
-    from phrases.models import Phrases
-except ImportError:
-    phrases_available = False
-
-ivrmenus_available = True
-try:
-    from ivrmenus.models import IvrMenus
-except ImportError:
-    ivrmenus_available = False
+from pbx.cachenamespace import CacheNamespace
+from switch.models import SipProfile
+from xmlhandler.directoryindex import DirectoryIndex
 
 
 class ClearCache():
 
+    # Cache entries are not deleted one by one, the generation counter of the
+    #  section or domain is incremented and the old entries age out of the cache.
+    #  See pbx.cachenamespace.
+
     def directory(self, domain_name):
-        cache.delete('directory:groups:%s' % domain_name)
+        DirectoryIndex().changed(domain_name)
+
+    def directory_user(self, domain_name, user):
+        cache.delete(CacheNamespace('directory').key('%s@%s' % (user, domain_name), domain_name))
 
     def dialplan(self, domain_name=None):
-        cache.delete('xmlhandler:context_type')
+        ns = CacheNamespace('dialplan')
+        # The context_type setting is cached for the whole section, not per domain.
+        cache.delete(ns.key('context_type'))
         if domain_name:
-            cache.delete('dialplan:%s' % domain_name)
-            dps = Dialplan.objects.filter(enabled='true', domain_id__name=domain_name, category='Inbound route')
-            for dp in dps:
-                cache.delete('dialplan:%s:%s' % (dp.context, dp.number))
+            ns.invalidate(domain_name)
+            ns.invalidate('public')
             return
-        dps = Dialplan.objects.filter(enabled='true')
-        for dp in dps:
-            if dp.domain_id:
-                cache.delete('dialplan:%s' % dp.domain_id.name)
-            cache.delete('dialplan:%s:%s' % (dp.context, dp.number))
+        ns.invalidate()
         return
 
-
     def languages(self):
-        del_list = [
-            'xmlhandler:lang:default_language',
-            'xmlhandler:lang:default_dialect',
-            'xmlhandler:lang:default_voice',
-            'xmlhandler:lang:sounds_dir'
-        ]
-        cache.delete_many(del_list)
+        CacheNamespace('languages').invalidate()
         return
 
     def phrases(self, domain_name):
-        if phrases_available:
-            ps = Phrases.objects.filter(enabled='true', domain_id__name=domain_name)
-            for p in ps:
-                cache.delete('languages:%s:%s' % (p.language, str(p.id)))
+        CacheNamespace('languages').invalidate()
         return
 
     def configuration(self):
-        del_list = [
-            'xmlhandler:allowed_addresses',
-            'configuration:acl.conf',
-            'configuration:sofia.conf',
-            'configuration:local_stream.conf',
-            'configuration:translate.conf',
-            'configuration:callcentre.conf'
-            'configuration:conference.conf'
-        ]
-        cache.delete_many(del_list)
+        CacheNamespace('configuration').invalidate()
+        return
+
+    def sofia(self, profile=None):
+        # With no profile the gateways of every profile are rebuilt.
+        ns = CacheNamespace('configuration')
+        ns.invalidate('sofia.conf')
+        if profile:
+            ns.invalidate('sofia.conf:%s' % profile)
+            return
+        for p in SipProfile.objects.values_list('name', flat=True).distinct():
+            ns.invalidate('sofia.conf:%s' % p)
         return
 
     def ivrmenus(self, domain_name):
-        if ivrmenus_available:
-            ivrs = IvrMenus.objects.filter(enabled='true', domain_id__name=domain_name)
-            for ivr in ivrs:
-                cache.delete('configuration:ivr.conf:%s' % str(ivr.id))
+        CacheNamespace('configuration').invalidate()
         return
 
     def clearall(self):
-        cache.clear()
+        CacheNamespace.invalidate_all()
         return
@@ -36,7 +36,7 @@ class ClearCacheForm(forms.Form):
     dialplan      = forms.BooleanField(label=_('Dialplan'), widget=forms.CheckboxInput(attrs={'class': 'form-check'}), required=False, help_text=_('Check to clear cache entries related to the dialplan.'))                # noqa: E501, E221
     languages     = forms.BooleanField(label=_('Languages'), widget=forms.CheckboxInput(attrs={'class': 'form-check'}), required=False, help_text=_('Check to clear cache entries related languages.'))                     # noqa: E501, E221
     configuration = forms.BooleanField(label=_('Configuration'), widget=forms.CheckboxInput(attrs={'class': 'form-check'}), required=False, help_text=_('Check to clear cache entries related to configuration.'))          # noqa: E501, E221
-    clearall      = forms.BooleanField(label=_('Clear Server Cache'), widget=forms.CheckboxInput(attrs={'class': 'form-check'}), required=False, help_text=_('Check to clear the entire server cache - USE WITH CAUTION.')) # noqa: E501, E221
+    clearall      = forms.BooleanField(label=_('Clear Server Cache'), widget=forms.CheckboxInput(attrs={'class': 'form-check'}), required=False, help_text=_('Check to clear all directory, dialplan, language and configuration cache entries.')) # noqa: E501, E221
 
 
 class ReloadXmlForm(forms.Form):
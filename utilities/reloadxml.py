@@ -42,17 +42,16 @@ class ReloadXml():
         return False
 
     def xml(self, host=None):
-        self.es.send('api reloadxml', host)
-        self.process()
-        return
+        return self.process('api reloadxml', host)
 
     def acl(self, host=None):
-        self.es.send('api reloadacl', host)
-        self.process()
-        return
+        return self.process('api reloadacl', host)
 
-    def process(self):
-        self.es.process_events()
-        self.es.get_responses()
+    def process(self, payload, host=None):
+        # Returns {host: response}, None for a switch that did not reply.
+        results = self.es.scatter(payload, None if host is None else [host])
         self.es.disconnect()
-        return
+        return results
+
+    def failed(self, results):
+        return [h for h, r in results.items() if r is None or '-ERR' in r]
@@ -3,7 +3,7 @@
 #
 #    MIT License
 #
-#    Copyright (c) 2016 - 2023 Adrian Fretwell <adrian@djangopbx.com>
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
 #
 #    Permission is hereby granted, free of charge, to any person obtaining a copy
 #    of this software and associated documentation files (the "Software"), to deal
@@ -27,6 +27,29 @@
 #    Adrian Fretwell <adrian@djangopbx.com>
 #
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from pbx.cachenamespace import CacheNamespace
+from utilities.clearcache import ClearCache
 
-# Create your tests here.
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ClearCacheDialplanTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_domain_clears_context_type(self):
+        ns = CacheNamespace('dialplan')
+        cache.set(ns.key('context_type'), 'multiple')
+        domain_key = ns.key('test.example.com', 'test.example.com')
+        cache.set(domain_key, '<xml/>')
+        ClearCache().dialplan('test.example.com')
+        ns = CacheNamespace('dialplan')
+        self.assertIsNone(cache.get(ns.key('context_type')))
+        self.assertNotEqual(ns.key('test.example.com', 'test.example.com'), domain_key)
+
+    def test_section_clears_context_type(self):
+        cache.set(CacheNamespace('dialplan').key('context_type'), 'single')
+        ClearCache().dialplan()
+        self.assertIsNone(cache.get(CacheNamespace('dialplan').key('context_type')))
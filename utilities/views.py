@@ -108,11 +108,17 @@ class ReloadXmlView(View):
             if xml or acl:
                 if not rload.connect():
                     return render(request, 'error.html', {'back': '/portal/', 'info': {'Message': _('Unable to connect to the FreeSWITCH Event Socket')}, 'title': 'Broker/Socket Error'})
+            failed = []
             if xml:
-                 rload.xml(host)
+                 failed.extend(rload.failed(rload.xml(host)))
             if acl:
-                 rload.acl(host)
-            messages.add_message(request, messages.INFO, _('XML/ACL Reloaded'))
+                 failed.extend(rload.failed(rload.acl(host)))
+            if failed:
+                messages.add_message(
+                    request, messages.WARNING, _('XML/ACL Reload failed') + ': ' + ', '.join(sorted(set(failed)))
+                    )
+            else:
+                messages.add_message(request, messages.INFO, _('XML/ACL Reloaded'))
         return render(request, self.template_name, {'form': form, 'refresher': 'reloadxml'})
 
 
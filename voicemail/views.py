@@ -28,14 +28,16 @@
 #
 
 import os
+import asyncio
 from datetime import datetime
+from asgiref.sync import async_to_sync
 from django.shortcuts import render
 from rest_framework import viewsets
 from rest_framework import permissions
 from django_filters.rest_framework import DjangoFilterBackend
 from django.contrib.auth.decorators import login_required
 from django.utils.translation import gettext_lazy as _
-from pbx.fscmdabslayer import FsCmdAbsLayer
+from pbx.asyncfscmdabslayer import AsyncFsCmdAbsLayer
 from accounts.accountfunctions import AccountFunctions
 
 from pbx.restpermissions import (
@@ -89,6 +91,21 @@ class VoicemailGreetingViewSet(viewsets.ModelViewSet):
         serializer.save(updated_by=self.request.user.username)
 
 
+async def get_vm_lists(extension_list, domain_name, delete=None):
+    # Returns {extension: vm_list responses}, the extensions are listed at the same
+    #  time, or None if the FreeSWITCH cannot be reached.
+    es = AsyncFsCmdAbsLayer()
+    if not await es.connect():
+        return None
+    if delete:
+        await es.send('api vm_delete %s@%s %s' % (delete[0], domain_name, delete[1]), timeout=0.25)
+    vm_lists = await asyncio.gather(
+        *[es.send('api vm_list %s@%s' % (e, domain_name), timeout=2) for e in extension_list]
+        )
+    await es.disconnect()
+    return dict(zip(extension_list, vm_lists))
+
+
 @login_required
 def listvoicemails(request, vmuuid=None, vmext=None, action=None):
     extension_list = request.session['extension_list'].split(',')
@@ -96,22 +113,15 @@ def listvoicemails(request, vmuuid=None, vmext=None, action=None):
         extension_list = AccountFunctions().list_superuser_extensions(request.session['domain_uuid'])
     th = [_('Extension'), _('Date Time'), _('From'), _('Duration'), _('Message'), _('Action')]
     info = {}
-    es = FsCmdAbsLayer()
-    if not es.connect():
+    vm_lists = async_to_sync(get_vm_lists)(
+        extension_list, request.session['domain_name'], (vmext, vmuuid) if action == 'delete' else None
+        )
+    if vm_lists is None:
         return render(request, 'error.html', {'back': '/portal/',
             'info': {'Message': _('Unable to connect to the FreeSWITCH')}, 'title': 'Broker/Socket Error'})
-    if action == 'delete':
-        es.clear_responses()
-        es.send('api vm_delete %s@%s %s' % (vmext, request.session['domain_name'], vmuuid))
-        es.process_events(0.25)
-        es.get_responses()
 
     for e in extension_list:
-        es.clear_responses()
-        es.send('api vm_list %s@%s' % (e, request.session['domain_name']))
-        es.process_events(2)
-        es.get_responses()
-        valid_resp_list = [x for x in es.responses if not '-ERR no reply' in x]
+        valid_resp_list = [x for x in vm_lists[e] if not '-ERR no reply' in x]
         vmstr = '\n'.join(valid_resp_list)
         if not len(vmstr) < 1:
             # '1670780459:0:201:test1.djangopbx.com:inbox:/var/lib/freeswitch/storage/voicemail/default/test1.djangopbx.com/201/msg_2740d2b1-de55-4425-b71e-4215647642ea.wav:68d2c984-78da-4d13-a48e-2e800fc7506f:Test1:202:7'  # noqa: E501
@@ -142,7 +152,6 @@ def listvoicemails(request, vmuuid=None, vmext=None, action=None):
                         '<a href=\"/voicemail/listvoicemails/%s/%s/delete/\">%s</a>' % (v[6], v[2], _('Delete'))
                         ]
 
-    es.disconnect()
     return render(
             request, 'infotablemulti.html',
             {'refresher': '/voicemail/listvoicemails/', 'th': th, 'info': info, 'title': 'Voicemails'}
@@ -3,7 +3,7 @@
 #
 #    MIT License
 #
-#    Copyright (c) 2016 - 2022 Adrian Fretwell <adrian@djangopbx.com>
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
 #
 #    Permission is hereby granted, free of charge, to any person obtaining a copy
 #    of this software and associated documentation files (the "Software"), to deal
@@ -27,6 +27,119 @@
 #    Adrian Fretwell <adrian@djangopbx.com>
 #
 
-# from django.test import TestCase
+import xmltodict
+from django.test import SimpleTestCase
+from .xmlcdrparser import XmlCdrParser
 
-# Create your tests here.
+CDR = '''<?xml version="1.0"?>
+<cdr core-uuid="c0a2c8d4-2d4f-4a38-bb1a-0e9b2b0c6d01" switchname="fs1">
+  <channel_data>
+    <state>CS_REPORTING</state>
+    <direction>inbound</direction>
+  </channel_data>
+  <variables>
+    <uuid>5b8f3c2e-1f0a-4e52-9f4c-6d7e8a9b0c1d</uuid>
+    <domain_name>test.example.com</domain_name>
+    <caller_id_name>Alice%20Smith</caller_id_name>
+    <effective_caller_id_name></effective_caller_id_name>
+    <sip_req_host/>
+    <billsec>40</billsec>
+  </variables>
+  <app_log>
+    <application app_name="set" app_data="continue_on_fail=true" app_stamp="1714557600000000"></application>
+    <application app_name="bridge" app_data="user/201@test.example.com" app_stamp="1714557601000000"></application>
+  </app_log>
+  <callflow dialplan="XML" unique-id="5b8f3c2e-1f0a-4e52-9f4c-6d7e8a9b0c1d" profile_index="2">
+    <extension name="local_extension" number="201">
+      <application app_name="bridge" app_data="user/201@test.example.com"></application>
+    </extension>
+    <caller_profile>
+      <username>200</username>
+      <caller_id_name>Alice</caller_id_name>
+      <caller_id_number>200</caller_id_number>
+      <network_addr>192.168.10.20</network_addr>
+      <destination_number>201</destination_number>
+      <context>test.example.com</context>
+      <originatee>
+        <originatee_caller_profile type="originatee">
+          <caller_id_name>Bob</caller_id_name>
+          <destination_number>9999</destination_number>
+          <context>other.example.com</context>
+        </originatee_caller_profile>
+      </originatee>
+    </caller_profile>
+    <times>
+      <created_time>1714557600000000</created_time>
+    </times>
+  </callflow>
+  <callflow dialplan="XML" profile_index="1">
+    <caller_profile>
+      <caller_id_number>200</caller_id_number>
+      <destination_number>*98</destination_number>
+      <context>test.example.com</context>
+    </caller_profile>
+  </callflow>
+</cdr>
+'''
+
+VARIABLES = ['uuid', 'domain_name', 'caller_id_name', 'effective_caller_id_name', 'sip_req_host', 'billsec']
+
+
+def cdr_element(uuid, billsec):
+    return (
+        '<cdr uuid="%s"><variables><uuid>%s</uuid><billsec>%s</billsec><hangup_cause>NORMAL_CLEARING</hangup_cause>'
+        '</variables><callflow><caller_profile><destination_number>20%s</destination_number></caller_profile>'
+        '</callflow></cdr>' % (uuid, uuid[2:], billsec, billsec)
+        )
+
+
+class XmlCdrParserTests(SimpleTestCase):
+
+    def test_element_dict(self):
+        cdrs = list(XmlCdrParser(VARIABLES, 'dict').parse(CDR))
+        self.assertEqual(len(cdrs), 1)
+        self.assertTrue(cdrs[0]['root'])
+        self.assertIsNone(cdrs[0]['uuid'])
+        self.assertEqual(cdrs[0]['dict'], xmltodict.parse(CDR)['cdr'])
+
+    def test_variables(self):
+        cdr = next(XmlCdrParser(VARIABLES).parse(CDR))
+        self.assertEqual(cdr['variables'], {
+            'uuid': '5b8f3c2e-1f0a-4e52-9f4c-6d7e8a9b0c1d', 'domain_name': 'test.example.com',
+            'caller_id_name': 'Alice%20Smith', 'effective_caller_id_name': None, 'sip_req_host': None,
+            'billsec': '40',
+            })
+        self.assertIsNone(cdr['dict'])
+        self.assertIsNone(cdr['xml'])
+
+    def test_callflow_caller_profiles(self):
+        cdr = next(XmlCdrParser(VARIABLES).parse(CDR))
+        self.assertEqual(cdr['callflows'], [
+            {'caller_id_name': 'Alice', 'caller_id_number': '200', 'network_addr': '192.168.10.20',
+             'destination_number': '201', 'context': 'test.example.com'},
+            {'caller_id_number': '200', 'destination_number': '*98', 'context': 'test.example.com'},
+            ])
+
+    def test_batch(self):
+        xml = '<cdrs>%s%s</cdrs>' % (cdr_element('a_uuid-1', '30'), cdr_element('b_uuid-1', '31'))
+        parser = XmlCdrParser(['uuid', 'billsec'], 'xml')
+        cdrs = list(parser.parse(xml))
+        self.assertEqual(parser.count, 2)
+        self.assertEqual([c['uuid'] for c in cdrs], ['a_uuid-1', 'b_uuid-1'])
+        self.assertEqual([c['root'] for c in cdrs], [False, False])
+        self.assertEqual([c['variables'] for c in cdrs], [
+            {'uuid': 'uuid-1', 'billsec': '30'}, {'uuid': 'uuid-1', 'billsec': '31'}
+            ])
+        self.assertEqual([c['callflows'] for c in cdrs], [
+            [{'destination_number': '2030'}], [{'destination_number': '2031'}]
+            ])
+        self.assertEqual(cdrs[0]['xml'], cdr_element('a_uuid-1', '30'))
+        self.assertEqual(cdrs[1]['xml'], cdr_element('b_uuid-1', '31'))
+
+    def test_batch_dict(self):
+        xml = '<cdrs>%s%s</cdrs>' % (cdr_element('a_uuid-2', '10'), cdr_element('b_uuid-2', '11'))
+        cdrs = list(XmlCdrParser(['billsec'], 'dict').parse(xml))
+        self.assertEqual([c['dict'] for c in cdrs], xmltodict.parse(xml)['cdrs']['cdr'])
+
+    def test_not_a_cdr(self):
+        self.assertEqual(list(XmlCdrParser(VARIABLES).parse('<other><variables/></other>')), [])
@@ -53,7 +53,8 @@ from pbx.commonvalidators import clean_uuid4_list
 from pbx.restpermissions import (
     AdminApiAccessPermission
 )
-from pbx.pbxipaddresscheck import pbx_ip_address_check, loopback_default
+from pbx.pbxipaddresscheck import pbx_ip_address_check, AllowedAddresses
+from pbx.cachenamespace import CacheNamespace
 from .models import (
     XmlCdr, CallTimeline,
 )
@@ -69,23 +70,19 @@ logger = logging.getLogger(__name__)
 @csrf_exempt
 def xml_cdr_import(request):
     debug = False
-    aa_cache_key = 'xmlcdr:allowed_addresses'
-    aa = cache.get(aa_cache_key)
-    if not aa:
-        aa = PbxSettings().default_settings('cdr', 'allowed_address', 'array')
-        if not aa:
-            aa = loopback_default
-        cache.set(aa_cache_key, aa)
-
-    if not pbx_ip_address_check(request, aa):
+    if not pbx_ip_address_check(request, AllowedAddresses('cdr').matcher()):
         return HttpResponseNotFound()
 
     if request.method == 'POST':
         if debug:
             logger.info('XML CDR request: {}'.format(request.POST))
-        XmlCdrFunctions().xml_cdr_import(request.GET.get('uuid', 'a_none'), request.POST.get(
-            'cdr', '<?xml version=\"1.0\"?><none switchname=\"django-pbx-dev1\">'
-            ))
+        # A batch may be posted as several cdr fields, or as one with a root element around the CDRs.
+        cdrs = request.POST.getlist('cdr')
+        if not cdrs:
+            cdrs = ['<?xml version=\"1.0\"?><none switchname=\"django-pbx-dev1\">']
+        xcf = XmlCdrFunctions()
+        for xml in cdrs:
+            xcf.xml_cdr_import(request.GET.get('uuid', 'a_none'), xml)
 
     return HttpResponse('')
 
@@ -199,13 +196,14 @@ class CdrViewer(tables.SingleTableMixin, FilterView):
 
 @login_required
 def selectcdr(request, cdruuid=None):
-    cache_key = 'xmlcdr:record_path'
+    cns = CacheNamespace('configuration')
+    cache_key = cns.key('xmlcdr:record_path')
     cdr_record_path = cache.get(cache_key)
     if not cdr_record_path:
         cdr_record_path = PbxSettings().default_settings('cdr', 'recordings', 'text', '/fs/recordings', True)
         cache.set(cache_key, cdr_record_path)
 
-    cache_key = 'switch:record_path'
+    cache_key = cns.key('switch:record_path')
     switch_record_path = cache.get(cache_key)
     if not switch_record_path:
         switch_record_path = PbxSettings().default_settings(
@@ -30,27 +30,51 @@
 import os.path
 import datetime
 import logging
-import xmltodict
-from xml.parsers.expat import ExpatError
+from lxml import etree
 from urllib.parse import unquote
 from django.core.cache import cache
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from django.db.models import Q
-from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 from .models import XmlCdr
+from .xmlcdrparser import XmlCdrParser
 from recordings.models import CallRecording
-from tenants.models import Domain
-from accounts.models import Extension
 from tenants.pbxsettings import PbxSettings
+from pbx.cachenamespace import CacheNamespace
+from switch.extensionindex import ExtensionIndex
+from switch.recordingindex import RecordingIndex
 
 logger = logging.getLogger(__name__)
 
 
 class XmlCdrFunctions():
 
+    # Shared by the requests handled by a worker, see ExtensionIndex and RecordingIndex.
+    extensions = ExtensionIndex(shared=True)
+    recordings = RecordingIndex()
+    # What the parser keeps of each CDR for the cdr format setting.
+    keep = {'json': 'dict', 'xml': 'xml'}
+    # The variables read by new_cdr(), the parser ignores the rest.
+    cdr_variables = [
+        'accountcode', 'answer_epoch', 'answer_stamp', 'api_on_answer', 'billmsec', 'billsec',
+        'bridge_uuid', 'call_direction', 'caller_destination', 'caller_id_name', 'caller_id_number',
+        'cc_agent', 'cc_agent_bridged', 'cc_agent_type', 'cc_agent_uuid', 'cc_cancel_reason', 'cc_cause',
+        'cc_member_session_id', 'cc_member_uuid', 'cc_queue', 'cc_queue_answered_epoch',
+        'cc_queue_canceled_epoch', 'cc_queue_joined_epoch', 'cc_queue_terminated_epoch',
+        'cc_record_filename', 'cc_side', 'conference_member_id', 'conference_name', 'conference_uuid',
+        'current_application_data', 'dialed_user', 'domain_name', 'duration', 'effective_caller_id_name',
+        'effective_caller_id_number', 'end_epoch', 'end_stamp', 'extension_uuid', 'hangup_cause',
+        'hangup_cause_q850', 'last_app', 'last_arg', 'last_sent_callee_id_number', 'mduration',
+        'missed_call', 'pin_number', 'progress_mediamsec', 'progressmsec', 'read_codec', 'read_rate',
+        'record_name', 'record_path', 'record_seconds', 'record_session', 'referred_by_user',
+        'remote_media_ip', 'rtp_audio_in_mos', 'sip_hangup_disposition', 'sip_req_host', 'sofia_record_file',
+        'start_epoch', 'start_stamp', 'uuid', 'waitsec', 'write_codec', 'write_rate',
+        ]
+
+    def __init__(self):
+        self.cns = CacheNamespace('configuration')
+
     def accept_b_leg(self, direction):
-        cache_key = 'xmlcdr:b_leg'
+        cache_key = self.cns.key('xmlcdr:b_leg')
         b_leg = cache.get(cache_key)
         if not b_leg:
             b_leg = PbxSettings().default_settings('cdr', 'b_leg', 'array')
@@ -79,7 +103,45 @@ class XmlCdrFunctions():
             number = 0.0
         return number
 
+    def import_settings(self):
+        cache_key = self.cns.key('xmlcdr:switch_recordings')
+        switch_recordings_path = cache.get(cache_key)
+        if not switch_recordings_path:
+            switch_recordings_path = PbxSettings().default_settings('switch', 'recordings', 'dir')
+            cache.set(cache_key, switch_recordings_path)
+
+        cache_key = self.cns.key('xmlcdr:populate_call_recordings')
+        populate_call_recordings = cache.get(cache_key)
+        if not populate_call_recordings:
+            populate_call_recordings = PbxSettings().default_settings(
+                'cdr', 'populate_call_recordings', 'boolean', True, True)
+            cache.set(cache_key, populate_call_recordings)
+
+        call_recordings_path = None
+        if populate_call_recordings:
+            cache_key = self.cns.key('xmlcdr:recordings')
+            call_recordings_path = cache.get(cache_key)
+            if not call_recordings_path:
+                call_recordings_path = PbxSettings().default_settings(
+                    'cdr', 'recordings', 'text', '/fs/recordings', True)
+                cache.set(cache_key, call_recordings_path)
+
+        cache_key = self.cns.key('xmlcdr:format')
+        format = cache.get(cache_key)
+        if not format:
+            format = PbxSettings().default_settings('cdr', 'format', 'text', 'json', True)
+            cache.set(cache_key, format)
+
+        return {
+            'switch_recordings_path': switch_recordings_path,
+            'populate_call_recordings': populate_call_recordings,
+            'call_recordings_path': call_recordings_path,
+            'format': format,
+            }
+
     def xml_cdr_import(self, t_uuid, xml):
+        # Imports the CDR, or batch of CDRs, in a mod_xml_cdr document.  A CDR in a
+        #  batch may carry its own uuid attribute, otherwise t_uuid gives the leg.
         if not xml:
             logger.warn('XML CDR request: Contained no data.')
             return False
@@ -88,22 +150,35 @@ class XmlCdrFunctions():
             logger.warn('XML CDR request: Contained no UUID.')
             return False
 
-        if t_uuid[:2] == 'a_':
-            leg = 'a'
-        else:
-            leg = 'b'
-
+        options = self.import_settings()
+        parser = XmlCdrParser(self.cdr_variables, self.keep.get(options['format']))
+        cdrs = []
         try:
-            cdr_dict = xmltodict.parse(xml)
-        except ExpatError:
+            for cdr in parser.parse(xml):
+                xcdr = self.new_cdr(cdr.get('uuid') or t_uuid, cdr, options)
+                if xcdr:
+                    if options['format'] == 'xml' and cdr['root']:
+                        xcdr.xml = xml
+                    cdrs.append(xcdr)
+        except etree.XMLSyntaxError:
             logger.warn('XML CDR request {}: Error parsing xml.'.format(t_uuid))
-            cdr_dict = {}
 
-        if 'cdr' not in cdr_dict:  # check root has children
+        if not parser.count:
             logger.warn('XML CDR request {}: Contained no cdr element.'.format(t_uuid))
             return False
+
+        if cdrs:
+            XmlCdr.objects.bulk_create(cdrs)
+        return len(cdrs) > 0
+
+    def new_cdr(self, t_uuid, cdr, options):
+        if t_uuid[:2] == 'a_':
+            leg = 'a'
+        else:
+            leg = 'b'
+
         nonestr = 'None'
-        cdr_variables = cdr_dict['cdr'].get('variables')
+        cdr_variables = cdr['variables']
 
         if leg == 'b':
             if not self.accept_b_leg(cdr_variables.get('call_direction', nonestr)):
@@ -116,77 +191,38 @@ class XmlCdrFunctions():
             logger.warn('XML CDR request {}: No domain name provided.'.format(t_uuid))
             return False
 
-        try:
-            d = Domain.objects.get(name=domain_name)
-        except ObjectDoesNotExist:
+        d = self.extensions.domain(domain_name)
+        if not d:
             logger.warn('XML CDR request {}: Unable to find domain {}.'.format(t_uuid, domain_name))
             return False
-        except MultipleObjectsReturned:
-            logger.warn('XML CDR request {}: Multiple domain record found for {}.'.format(t_uuid, domain_name))
-            return False
 
-        extension_found = False
+        extension_id = None
         extension_uuid = cdr_variables.get('extension_uuid')
         if extension_uuid:
-            try:
-                e = Extension.objects.get(pk=extension_uuid)
-            except ObjectDoesNotExist:
+            extension_id = self.extensions.by_uuid(domain_name, extension_uuid)
+            if not extension_id:
                 logger.debug('XML CDR request {}: Unable to find extension by uuid {}.'.format(t_uuid, extension_uuid))
-            else:
-                extension_found = True
         else:
-            tmpstr = cdr_variables.get('dialed_user')
-            if tmpstr and not extension_found:
-                try:
-                    e = Extension.objects.get((Q(extension=tmpstr) | Q(number_alias=tmpstr)), domain_id=d.id)
-                except ObjectDoesNotExist:
-                    logger.debug(
-                        'XML CDR request {}: Unable to find extension by number dialled_user {}.'.
-                        format(t_uuid, tmpstr)
-                        )
-                except MultipleObjectsReturned:
-                    logger.warn(
-                        'XML CDR request {}: Multiple extension records found for dialed_user {}.'.
-                        format(t_uuid, tmpstr)
-                        )
-                else:
-                    extension_found = True
-
-            tmpstr = cdr_variables.get('referred_by_user')
-            if tmpstr and not extension_found:
-                try:
-                    e = Extension.objects.get((Q(extension=tmpstr) | Q(number_alias=tmpstr)), domain_id=d.id)
-                except ObjectDoesNotExist:
-                    logger.debug(
-                        'XML CDR request {}: Unable to find extension by number referred_by_user {}.'.
-                        format(t_uuid, tmpstr)
-                        )
-                except MultipleObjectsReturned:
+            for variable in ('dialed_user', 'referred_by_user', 'last_sent_callee_id_number'):
+                tmpstr = cdr_variables.get(variable)
+                if not tmpstr:
+                    continue
+                extension_id = self.extensions.by_number(domain_name, tmpstr)
+                if extension_id is self.extensions.ambiguous:
+                    extension_id = None
                     logger.warn(
-                        'XML CDR request {}: Multiple extension records found for referred_by_user {}.'.
-                        format(t_uuid, tmpstr)
+                        'XML CDR request {}: Multiple extension records found for {} {}.'.
+                        format(t_uuid, variable, tmpstr)
                         )
+                elif extension_id:
+                    break
                 else:
-                    extension_found = True
-
-            tmpstr = cdr_variables.get('last_sent_callee_id_number')
-            if tmpstr and not extension_found:
-                try:
-                    e = Extension.objects.get((Q(extension=tmpstr) | Q(number_alias=tmpstr)), domain_id=d.id)
-                except ObjectDoesNotExist:
                     logger.debug(
-                        'XML CDR request {}: Unable to find extension by number last_sent_callee_id_number {}.'.
-                        format(t_uuid, tmpstr)
-                        )
-                except MultipleObjectsReturned:
-                    logger.warn(
-                        'XML CDR request {}: Multiple extension records found for last_sent_callee_id_number {}.'.
-                        format(t_uuid, tmpstr)
+                        'XML CDR request {}: Unable to find extension by number {} {}.'.
+                        format(t_uuid, variable, tmpstr)
                         )
-                else:
-                    extension_found = True
 
-            if not extension_found:
+            if not extension_id:
                 logger.info('XML CDR request {}: Unable to find extension.'.format(t_uuid))
 
         caller_id_name = cdr_variables.get('effective_caller_id_name')
@@ -195,38 +231,25 @@ class XmlCdrFunctions():
 
         caller_id_number = cdr_variables.get('effective_caller_id_number')
         if not caller_id_number:
-            caller_id_name = cdr_variables.get('caller_id_number')
+            caller_id_number = cdr_variables.get('caller_id_number')
 
         context = nonestr
         destination_number = '-'
         network_addr = '-'
 
-        callflows = cdr_dict['cdr'].get('callflow')
-        if type(callflows) is dict:
-            context = self.uq(callflows['caller_profile'].get('context'))
-            destination_number = self.uq(callflows['caller_profile'].get('destination_number'))
-            network_addr = self.uq(callflows['caller_profile'].get('network_addr'))
-            tmpstr = callflows['caller_profile'].get('caller_id_name')
+        i = 0
+        for caller_profile in cdr['callflows']:
+            if i == 0:
+                context = self.uq(caller_profile.get('context'))
+                destination_number = self.uq(caller_profile.get('destination_number'))
+                network_addr = self.uq(caller_profile.get('network_addr'))
+            tmpstr = caller_profile.get('caller_id_name')
             if tmpstr:
                 caller_id_name = tmpstr
-                tmpstr = callflows['caller_profile'].get('caller_id_number')
-                if tmpstr:
-                    caller_id_number = tmpstr
-
-        elif type(callflows) is list:
-            i = 0
-            for callflow in callflows:
-                if i == 0:
-                    context = self.uq(callflow['caller_profile'].get('context'))
-                    destination_number = self.uq(callflow['caller_profile'].get('destination_number'))
-                    network_addr = self.uq(callflow['caller_profile'].get('network_addr'))
-                tmpstr = callflow['caller_profile'].get('caller_id_name')
-                if tmpstr:
-                    caller_id_name = tmpstr
-                tmpstr = callflow['caller_profile'].get('caller_id_number')
-                if tmpstr:
-                    caller_id_number = tmpstr
-                i += 1
+            tmpstr = caller_profile.get('caller_id_number')
+            if tmpstr:
+                caller_id_number = tmpstr
+            i += 1
 
         tmpstr = cdr_variables.get('last_sent_callee_id_number')
         if tmpstr and leg == 'a':
@@ -238,7 +261,7 @@ class XmlCdrFunctions():
         if start_stamp:
             start_time = datetime.datetime.strptime(start_stamp, '%Y-%m-%d %H:%M:%S')
         else:
-            start_stamp = datetime.datetime.now()
+            start_time = timezone.localtime(timezone=tz).replace(tzinfo=None, microsecond=0)
 
         start_year = start_time.strftime('%Y')
         start_month = start_time.strftime('%b')
@@ -290,53 +313,29 @@ class XmlCdrFunctions():
                         record_name = os.path.basename(recording)
                         record_length = self.str2int(cdr_variables.get('duration'))
 
-        cache_key = 'xmlcdr:switch_recordings'
-        switch_recordings_path = cache.get(cache_key)
-        if not switch_recordings_path:
-            switch_recordings_path = PbxSettings().default_settings('switch', 'recordings', 'dir')
-            cache.set(cache_key, switch_recordings_path)
+        switch_recordings_path = options['switch_recordings_path']
 
         uuid = cdr_variables.get('uuid', nonestr)
 
         if not record_name:
+            # An mp3 is preferred to a wav, and the bridge UUID to the UUID.
             bridge_uuid = cdr_variables.get('bridge_uuid', nonestr)
-            path = '%s/%s/archive/%s/%s/%s/%s.wav' % (
-                    switch_recordings_path, domain_name, start_year, start_month, start_day, bridge_uuid
-                    )
-            if os.path.exists(path):
-                record_path = os.path.dirname(path)
-                record_name = os.path.basename(path)
-                record_length = self.str2int(cdr_variables.get('duration'))
-            path = '%s/%s/archive/%s/%s/%s/%s.mp3' % (
-                    switch_recordings_path, domain_name, start_year, start_month, start_day, bridge_uuid
-                    )
-            if os.path.exists(path):
-                record_path = os.path.dirname(path)
-                record_name = os.path.basename(path)
-                record_length = self.str2int(cdr_variables.get('duration'))
-
-        if not record_name:
-            bridge_uuid = cdr_variables.get('bridge_uuid', nonestr)
-            path = '%s/%s/archive/%s/%s/%s/%s.wav' % (
-                    switch_recordings_path, domain_name, start_year, start_month, start_day, uuid
-                    )
-            if os.path.exists(path):
-                record_path = os.path.dirname(path)
-                record_name = os.path.basename(path)
-                record_length = self.str2int(cdr_variables.get('duration'))
-            path = '%s/%s/archive/%s/%s/%s/%s.mp3' % (
-                    switch_recordings_path, domain_name, start_year, start_month, start_day, uuid
+            path = '%s/%s/archive/%s/%s/%s' % (
+                    switch_recordings_path, domain_name, start_year, start_month, start_day
                     )
-            if os.path.exists(path):
-                record_path = os.path.dirname(path)
-                record_name = os.path.basename(path)
+            name = self.recordings.find(path, (
+                    '%s.mp3' % bridge_uuid, '%s.wav' % bridge_uuid, '%s.mp3' % uuid, '%s.wav' % uuid
+                    ), self.str2int(cdr_variables.get('end_epoch')))
+            if name:
+                record_path = path
+                record_name = name
                 record_length = self.str2int(cdr_variables.get('duration'))
 
         xcdr = XmlCdr(domain_id=d)
 #        crec = CallRecording()
 
-        if extension_found:
-            xcdr.extension_id=e
+        if extension_id:
+            xcdr.extension_id_id = extension_id
         xcdr.domain_name = domain_name
         xcdr.accountcode = cdr_variables.get('accountcode')
         xcdr.direction = cdr_variables.get('call_direction', nonestr)
@@ -352,7 +351,7 @@ class XmlCdrFunctions():
 
         xcdr.start_epoch = self.str2int(cdr_variables.get('start_epoch'))
         xcdr.start_stamp = timezone.make_aware(start_time, tz)
-        xcdr.answer_epoch = self.str2int(cdr_variables.get('answer'))
+        xcdr.answer_epoch = self.str2int(cdr_variables.get('answer_epoch'))
 
         answer_stamp = self.uq(cdr_variables.get('answer_stamp'))
         if answer_stamp:
@@ -382,24 +381,12 @@ class XmlCdrFunctions():
                 xcdr.record_path = record_path
                 xcdr.record_name = record_name
                 # record_description = cdr_variables.get('record_description', nonestr)
-                cache_key = 'xmlcdr:populate_call_recordings'
-                populate_call_recordings = cache.get(cache_key)
-                if not populate_call_recordings:
-                    populate_call_recordings = PbxSettings().default_settings(
-                        'cdr', 'populate_call_recordings', 'boolean', True, True)
-                    cache.set(cache_key, populate_call_recordings)
-                if populate_call_recordings:
-                    cache_key = 'xmlcdr:recordings'
-                    call_recordings_path = cache.get(cache_key)
-                    if not call_recordings_path:
-                        call_recordings_path = PbxSettings().default_settings(
-                            'cdr', 'recordings', 'text', '/fs/recordings', True)
-                        cache.set(cache_key, call_recordings_path)
-
+                if options['populate_call_recordings']:
+                    call_recordings_path = options['call_recordings_path']
                     path_parts = record_path.split('/')[-5:]
                     if len(path_parts) == 5:
                         local_path = '%s/%s' % (switch_recordings_path, '/'.join(path_parts))
-                        if os.path.exists('%s/%s' % (local_path, record_name)):
+                        if self.recordings.find(local_path, (record_name,)):
                             call_rec_path = '%s/%s' % (call_recordings_path[1:], '/'.join(path_parts))
                             try:
                                 CallRecording.objects.create(name=record_name,
@@ -427,7 +414,7 @@ class XmlCdrFunctions():
 
         xcdr.cc_side = cdr_variables.get('cc_side')
         xcdr.cc_member_uuid = cdr_variables.get('cc_member_uuid')
-        xcdr.cc_queue_joined_epoch = self.str2int(cdr_variables.get('cc_queue_joinded_epoch'))
+        xcdr.cc_queue_joined_epoch = self.str2int(cdr_variables.get('cc_queue_joined_epoch'))
         xcdr.cc_queue = cdr_variables.get('cc_queue')
         xcdr.cc_member_session_uuid = cdr_variables.get('cc_member_session_id')
         xcdr.cc_agent_uuid = cdr_variables.get('cc_agent_uuid')
@@ -452,21 +439,13 @@ class XmlCdrFunctions():
         xcdr.hangup_cause_q850 = self.str2int(cdr_variables.get('hangup_cause_q850'))
         xcdr.sip_hangup_disposition = cdr_variables.get('sip_hangup_disposition')
 
-        cache_key = 'xmlcdr:format'
-        format = cache.get(cache_key)
-        if not format:
-            format = PbxSettings().default_settings('cdr', 'format', 'text', 'json', True)
-            cache.set(cache_key, format)
-
-        if format == 'xml':
-            xcdr.xml = xml
-        if format == 'json':
-            xcdr.json = cdr_dict['cdr']
+        if options['format'] == 'xml':
+            xcdr.xml = cdr['xml']
+        if options['format'] == 'json':
+            xcdr.json = cdr['dict']
 
         xcdr.updated_by = 'system'
-        xcdr.save()
-
-        return True
+        return xcdr
 
     @staticmethod
     def get_call_status(record):
@@ -0,0 +1,133 @@
+#
+#    DjangoPBX
+#
+#    MIT License
+#
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
+#
+#    Permission is hereby granted, free of charge, to any person obtaining a copy
+#    of this software and associated documentation files (the "Software"), to deal
+#    in the Software without restriction, including without limitation the rights
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#    copies of the Software, and to permit persons to whom the Software is
+#    furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in all
+#    copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#    SOFTWARE.
+#
+#    Contributor(s):
+#    Adrian Fretwell <adrian@djangopbx.com>
+#
+
+from io import BytesIO
+from lxml import etree
+
+
+class XmlCdrParser():
+
+    # Pulls the variables and caller profiles needed for an import out of mod_xml_cdr
+    #  documents with lxml iterparse, rather than converting the whole CDR into nested
+    #  dicts.  A document may be a single <cdr> or a batch of them under any root
+    #  element, e.g. <cdrs><cdr uuid="a_...">...</cdr>...</cdrs>.
+    #
+    # parse() yields a dict for each <cdr>:
+    #    uuid       the uuid attribute of the <cdr> element, if any
+    #    root       True if the <cdr> is the document element
+    #    variables  the wanted variables, as found (url encoded)
+    #    callflows  the wanted caller_profile fields of each callflow, in order
+    #    dict       the whole CDR as xmltodict would have returned it, if keep='dict'
+    #    xml        the CDR element as a string, if keep='xml'
+    #
+    # Each CDR is discarded once yielded so a large batch is never held in memory.
+
+    profile_fields = frozenset(['context', 'destination_number', 'network_addr', 'caller_id_name', 'caller_id_number'])
+
+    def __init__(self, variables, keep=None):
+        self.variables = frozenset(variables)
+        self.keep = keep
+        self.count = 0
+
+    def parse(self, xml):
+        if isinstance(xml, str):
+            xml = xml.encode('utf-8')
+        cdr = self.new_cdr()
+        profile = None
+        for event, elem in etree.iterparse(
+                BytesIO(xml), events=('end',), resolve_entities=False, no_network=True, huge_tree=False):
+            parent = elem.getparent()
+            if parent is None:
+                if elem.tag == 'cdr':
+                    yield self.end_cdr(cdr, elem, True)
+                return
+            tag = elem.tag
+            ptag = parent.tag
+            if ptag == 'variables':
+                if tag in self.variables:
+                    cdr['variables'][tag] = elem.text
+            elif ptag == 'caller_profile':
+                if tag in self.profile_fields and parent.getparent().tag == 'callflow':
+                    if profile is None:
+                        profile = {}
+                    profile[tag] = elem.text
+            elif tag == 'caller_profile' and ptag == 'callflow':
+                cdr['callflows'].append(profile or {})
+                profile = None
+            elif tag == 'cdr':
+                yield self.end_cdr(cdr, elem, False)
+                cdr = self.new_cdr()
+                # The root keeps a reference to every finished <cdr> unless removed.
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del parent[0]
+            if self.keep is None and ptag == 'cdr':
+                elem.clear()
+
+    def new_cdr(self):
+        return {'uuid': None, 'root': False, 'variables': {}, 'callflows': [], 'dict': None, 'xml': None}
+
+    def end_cdr(self, cdr, elem, root):
+        self.count += 1
+        cdr['uuid'] = elem.get('uuid')
+        cdr['root'] = root
+        if self.keep == 'dict':
+            cdr['dict'] = self.element_dict(elem)
+        elif self.keep == 'xml':
+            cdr['xml'] = etree.tostring(elem, encoding='unicode', with_tail=False)
+        return cdr
+
+    def element_dict(self, elem):
+        # The xmltodict.parse() representation: attributes as @name, repeated
+        #  elements as lists, whitespace stripped text as the value or as #text.
+        item = None
+        if elem.attrib:
+            item = {'@' + k: v for k, v in elem.attrib.items()}
+        data = [elem.text] if elem.text else []
+        for child in elem:
+            if child.tail:
+                data.append(child.tail)
+            if not isinstance(child.tag, str):
+                continue
+            if item is None:
+                item = {}
+            value = self.element_dict(child)
+            existing = item.get(child.tag)
+            if existing is None and child.tag not in item:
+                item[child.tag] = value
+            elif isinstance(existing, list):
+                existing.append(value)
+            else:
+                item[child.tag] = [existing, value]
+        data = ''.join(data).strip() or None
+        if item is None:
+            return data
+        if data:
+            item['#text'] = data
+        return item
@@ -28,6 +28,7 @@
 #
 
 from django.apps import AppConfig
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.utils.translation import gettext_lazy as _
 
 
@@ -43,3 +44,51 @@ class XmlhandlerConfig(AppConfig):
     xml_config_allowed_addresses = ['127.0.0.1', '::1']
     context_type = 'multiple'  # Can be multiple or single
     number_as_presence_id = False
+
+    def ready(self):
+        from accounts.models import Extension, ExtensionUser, Gateway
+        from switch.models import SipProfile, SipProfileDomain, SipProfileSetting
+        from voicemail.models import Voicemail
+        from dialplans.models import Dialplan
+        from . import signals
+        for signal in (post_save, post_delete):
+            signal.connect(
+                signals.directory_extension_changed,
+                sender=Extension, weak=False, dispatch_uid="xmlhandler:accounts_Extension"
+                )
+            signal.connect(
+                signals.directory_extension_related_changed,
+                sender=ExtensionUser, weak=False, dispatch_uid="xmlhandler:accounts_ExtensionUser"
+                )
+            signal.connect(
+                signals.directory_extension_related_changed,
+                sender=Voicemail, weak=False, dispatch_uid="xmlhandler:voicemail_Voicemail"
+                )
+            signal.connect(
+                signals.dialplan_changed,
+                sender=Dialplan, weak=False, dispatch_uid="xmlhandler:dialplans_Dialplan"
+                )
+            signal.connect(
+                signals.sofia_gateway_changed,
+                sender=Gateway, weak=False, dispatch_uid="xmlhandler:accounts_Gateway"
+                )
+            signal.connect(
+                signals.sofia_profile_changed,
+                sender=SipProfile, weak=False, dispatch_uid="xmlhandler:switch_SipProfile"
+                )
+            signal.connect(
+                signals.sofia_profile_related_changed,
+                sender=SipProfileDomain, weak=False, dispatch_uid="xmlhandler:switch_SipProfileDomain"
+                )
+            signal.connect(
+                signals.sofia_profile_related_changed,
+                sender=SipProfileSetting, weak=False, dispatch_uid="xmlhandler:switch_SipProfileSetting"
+                )
+        pre_save.connect(
+            signals.sofia_gateway_pre_save,
+            sender=Gateway, weak=False, dispatch_uid="xmlhandler:accounts_Gateway"
+            )
+        pre_save.connect(
+            signals.dialplan_pre_save,
+            sender=Dialplan, weak=False, dispatch_uid="xmlhandler:dialplans_Dialplan"
+            )
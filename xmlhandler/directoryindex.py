@@ -0,0 +1,177 @@
+#
+#    DjangoPBX
+#
+#    MIT License
+#
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
+#
+#    Permission is hereby granted, free of charge, to any person obtaining a copy
+#    of this software and associated documentation files (the "Software"), to deal
+#    in the Software without restriction, including without limitation the rights
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#    copies of the Software, and to permit persons to whom the Software is
+#    furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in all
+#    copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#    SOFTWARE.
+#
+#    Contributor(s):
+#    Adrian Fretwell <adrian@djangopbx.com>
+#
+
+import time
+import threading
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+from lxml import etree
+from accounts.models import Extension, ExtensionUser
+from voicemail.models import Voicemail
+from tenants.pbxsettings import PbxSettings
+from pbx.cachenamespace import CacheNamespace
+
+
+class DirectoryIndex():
+
+    # A per worker (process) index of prebuilt directory user XML.
+    #
+    # Each domain is loaded in bulk on first use and maps extension and number
+    # alias to the bytes of its <user> element, so a directory request is answered
+    # without touching the database or building any XML.
+    #
+    # Workers are kept in step through the directory cache namespace generation of
+    # the domain.  A change to an Extension, Voicemail or ExtensionUser increments
+    # the generation and records the changed extension against it, other workers
+    # then refresh just those extensions the next time they see the domain.  A new
+    # generation with no change record, e.g. from ClearCache, or a new section
+    # generation causes the whole domain to be reloaded.
+
+    domains = {}
+    lock = threading.Lock()
+    change_key = 'xmlhandler:dirindex:%s:%s'
+    max_changes = 64
+    max_domains = 10000
+    marker = b'<user id="__directory_index__"/>'
+
+    def __init__(self, xmlhf=None):
+        self.xmlhf = xmlhf
+        self.ttl = getattr(settings, 'PBX_XMLHANDLER_DIRECTORY_INDEX_TTL', 3600)
+
+    @staticmethod
+    def enabled():
+        return getattr(settings, 'PBX_XMLHANDLER_DIRECTORY_INDEX', True)
+
+    def get(self, domain, user):
+        entry = self.domains.get(domain)
+        generation = CacheNamespace('directory').generation(domain)
+        if entry is None or (time.monotonic() - entry['built']) > self.ttl:
+            entry = self.build(domain, generation)
+        elif generation != entry['generation']:
+            entry = self.catch_up(domain, entry, generation)
+
+        xml = entry['users'].get(user)
+        if xml is None:
+            return self.xmlhf.NotFoundXml()
+        return b''.join((entry['prefix'], xml, entry['suffix']))
+
+    def changed(self, domain, extension_id=None):
+        # Called when something affecting the directory of a domain has been saved.
+        #  With no extension_id the whole domain will be rebuilt.
+        generation = CacheNamespace('directory').invalidate(domain)
+        if generation is None:
+            # The cache is unavailable so the other workers cannot be told,
+            #  the best we can do is make sure this one is not stale.
+            with self.lock:
+                self.domains.pop(domain, None)
+            return
+        if extension_id:
+            cache.set(self.change_key % (domain, generation), str(extension_id), self.ttl)
+
+    def catch_up(self, domain, entry, generation):
+        section_generation, domain_generation = generation
+        local_section_generation, local_domain_generation = entry['generation']
+        if (section_generation != local_section_generation or domain_generation < local_domain_generation or
+                (domain_generation - local_domain_generation) > self.max_changes):
+            return self.build(domain, generation)
+        keys = [
+            self.change_key % (domain, g) for g in range(local_domain_generation + 1, domain_generation + 1)
+            ]
+        changes = cache.get_many(keys)
+        if len(changes) < len(keys):
+            return self.build(domain, generation)
+        self.refresh(domain, entry, set(changes.values()), generation)
+        return entry
+
+    def queryset(self):
+        return Extension.objects.select_related('domain_id').prefetch_related(
+            Prefetch(
+                'voicemail', queryset=Voicemail.objects.filter(enabled='true'),
+                to_attr='enabled_voicemails'
+                ),
+            Prefetch(
+                'extensionuser', queryset=ExtensionUser.objects.select_related('user_uuid').filter(
+                    default_user='true'
+                    ), to_attr='default_users'
+                )
+            )
+
+    def new_entry(self, domain, generation):
+        x_root = self.xmlhf.XrootDynamic()
+        x_section = etree.SubElement(x_root, "section", name='directory')
+        x_users = self.xmlhf.DirectoryAddDomain(domain, x_section)
+        etree.SubElement(x_users, "user", id='__directory_index__')
+        etree.indent(x_root)
+        prefix, suffix = etree.tostring(x_root).split(self.marker)
+        return {
+            'generation': generation, 'built': time.monotonic(),
+            'number_as_presence_id': PbxSettings().default_settings(
+                'xmlhandler', 'number_as_presence_id', 'boolean'
+                ),
+            'prefix': prefix, 'suffix': suffix, 'users': {}, 'keys': {}
+            }
+
+    def build(self, domain, generation):
+        entry = self.new_entry(domain, generation)
+        for e in self.queryset().filter(domain_id__name=domain, enabled='true'):
+            self.add_extension(domain, entry, e)
+        if entry['users'] or len(self.domains) < self.max_domains:
+            with self.lock:
+                self.domains[domain] = entry
+        return entry
+
+    def refresh(self, domain, entry, extension_ids, generation):
+        es = self.queryset().filter(pk__in=extension_ids)
+        with self.lock:
+            for extension_id in extension_ids:
+                for key in entry['keys'].pop(extension_id, []):
+                    entry['users'].pop(key, None)
+            for e in es:
+                if e.enabled == 'true' and e.domain_id and e.domain_id.name == domain:
+                    self.add_extension(domain, entry, e)
+            entry['generation'] = generation
+        return
+
+    def add_extension(self, domain, entry, e):
+        v = (e.enabled_voicemails[0] if e.enabled_voicemails else None)
+        eu = (e.default_users[0] if e.default_users else None)
+        keys = []
+        # The number alias goes in first so that a clash with another extension
+        #  number resolves to the extension, as the database lookup would.
+        for user in (e.number_alias, e.extension):
+            if not user:
+                continue
+            x_users = etree.Element("users")
+            self.xmlhf.DirectoryAddUser(domain, user, entry['number_as_presence_id'], x_users, e, eu, v, True)
+            etree.indent(x_users[0], level=6)
+            entry['users'][user] = etree.tostring(x_users[0], with_tail=False)
+            keys.append(user)
+        entry['keys'][str(e.id)] = keys
+        return
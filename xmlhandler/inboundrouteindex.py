@@ -0,0 +1,212 @@
+#
+#    DjangoPBX
+#
+#    MIT License
+#
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
+#
+#    Permission is hereby granted, free of charge, to any person obtaining a copy
+#    of this software and associated documentation files (the "Software"), to deal
+#    in the Software without restriction, including without limitation the rights
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#    copies of the Software, and to permit persons to whom the Software is
+#    furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in all
+#    copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#    SOFTWARE.
+#
+#    Contributor(s):
+#    Adrian Fretwell <adrian@djangopbx.com>
+#
+
+import re
+import time
+import html
+import bisect
+import threading
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from dialplans.models import Dialplan
+from pbx.commonfunctions import str2regex
+from pbx.cachenamespace import CacheNamespace
+
+
+class InboundRouteIndex():
+
+    # A per worker (process) index of the public context dialplan, used when the
+    #  xmlhandler context_type is single.
+    #
+    # Inbound routes are held in a hash on their destination number, backed by a
+    #  list of compiled destination number expressions in sequence order for
+    #  anything the hash does not answer.  Public context dialplans with no domain
+    #  are returned with every lookup, as they are by the database query.
+    #
+    # Hostnames are loaded, and workers kept in step, as domains are by
+    #  DirectoryIndex, through the public domain of the dialplan cache namespace.
+
+    hosts = {}
+    lock = threading.Lock()
+    change_key = 'xmlhandler:ibrindex:%s'
+    namespace_domain = 'public'
+    max_changes = 64
+    max_fallback = 10000
+    lead_re = re.compile(r'\^((?:\\\+|[0-9])*)')
+    expression_re = re.compile(r'<condition\s[^>]*?field="destination_number"[^>]*?expression="([^"]*)"')
+
+    def __init__(self, xmlhf=None):
+        self.xmlhf = xmlhf
+        self.ttl = getattr(settings, 'PBX_XMLHANDLER_INBOUND_ROUTE_INDEX_TTL', 3600)
+
+    @staticmethod
+    def enabled():
+        return getattr(settings, 'PBX_XMLHANDLER_INBOUND_ROUTE_INDEX', True)
+
+    def get(self, hostname, call_context, destination_number):
+        entry = self.hosts.get(hostname)
+        generation = CacheNamespace('dialplan').generation(self.namespace_domain)
+        if entry is None or (time.monotonic() - entry['built']) > self.ttl:
+            entry = self.build(hostname, generation)
+        elif generation != entry['generation']:
+            entry = self.catch_up(hostname, entry, generation)
+
+        routes = self.match(entry, destination_number)
+        xml_list = [self.xmlhf.XmlHeader('dialplan', call_context)]
+        if routes:
+            xml_list.extend(r[2] for r in sorted(entry['common'] + routes))
+        else:
+            xml_list.extend(r[2] for r in entry['common'])
+            xml_list = self.xmlhf.NotFoundPublic(xml_list)
+        xml_list.append(self.xmlhf.XmlFooter())
+        return '\n'.join(xml_list)
+
+    def match(self, entry, destination_number):
+        routes = entry['numbers'].get(destination_number)
+        if routes:
+            return routes
+        routes = entry['fallback'].get(destination_number)
+        if routes is not None:
+            return routes
+        routes = [
+            r[:3] for r in entry['patterns']
+            if destination_number.startswith(r[3]) and r[4].match(destination_number)
+            ]
+        # Remember the outcome, so a flood of calls to a number that is not
+        #  routed costs one dictionary lookup each.
+        if len(entry['fallback']) >= self.max_fallback:
+            entry['fallback'].clear()
+        entry['fallback'][destination_number] = routes
+        return routes
+
+    def changed(self, dialplan_id=None):
+        # Called when a public context dialplan has been saved or deleted.
+        #  With no dialplan_id every hostname will be rebuilt.
+        generation = CacheNamespace('dialplan').invalidate(self.namespace_domain)
+        if generation is None:
+            with self.lock:
+                self.hosts.clear()
+            return
+        if dialplan_id:
+            cache.set(self.change_key % generation, str(dialplan_id), self.ttl)
+
+    def catch_up(self, hostname, entry, generation):
+        section_generation, public_generation = generation
+        local_section_generation, local_public_generation = entry['generation']
+        if (section_generation != local_section_generation or public_generation < local_public_generation or
+                (public_generation - local_public_generation) > self.max_changes):
+            return self.build(hostname, generation)
+        keys = [self.change_key % g for g in range(local_public_generation + 1, public_generation + 1)]
+        changes = cache.get_many(keys)
+        if len(changes) < len(keys):
+            return self.build(hostname, generation)
+        self.refresh(hostname, entry, set(changes.values()), generation)
+        return entry
+
+    def queryset(self, hostname):
+        return Dialplan.objects.filter(
+            (Q(category='Inbound route') | Q(context__contains='public', domain_id__isnull=True)),
+            (Q(hostname=hostname) | Q(hostname__isnull=True)), enabled='true'
+            ).only('id', 'context', 'category', 'number', 'sequence', 'domain_id', 'xml')
+
+    def build(self, hostname, generation):
+        entry = {
+            'generation': generation, 'built': time.monotonic(),
+            'common': [], 'numbers': {}, 'patterns': [], 'fallback': {}
+            }
+        for dp in self.queryset(hostname).order_by('sequence'):
+            self.add_dialplan(entry, dp)
+        with self.lock:
+            self.hosts[hostname] = entry
+        return entry
+
+    def refresh(self, hostname, entry, dialplan_ids, generation):
+        dps = self.queryset(hostname).filter(pk__in=dialplan_ids)
+        with self.lock:
+            self.remove_dialplans(entry, dialplan_ids)
+            for dp in dps:
+                self.add_dialplan(entry, dp)
+            entry['fallback'] = {}
+            entry['generation'] = generation
+        return
+
+    def remove_dialplans(self, entry, dialplan_ids):
+        entry['common'] = [r for r in entry['common'] if r[1] not in dialplan_ids]
+        entry['patterns'] = [r for r in entry['patterns'] if r[1] not in dialplan_ids]
+        for number in list(entry['numbers']):
+            routes = [r for r in entry['numbers'][number] if r[1] not in dialplan_ids]
+            if routes:
+                entry['numbers'][number] = routes
+            else:
+                del entry['numbers'][number]
+
+    def add_dialplan(self, entry, dp):
+        # Entries are (sequence, id, xml) so a list of them sorts the way the
+        #  database query orders them.
+        if dp.xml is None:
+            return
+        route = (int(dp.sequence), str(dp.id), dp.xml)
+        if dp.context and 'public' in dp.context and not dp.domain_id_id:
+            bisect.insort(entry['common'], route)
+            return
+        if dp.category != 'Inbound route':
+            return
+        if dp.number:
+            bisect.insort(entry['numbers'].setdefault(dp.number, []), route)
+        expression = self.expression(dp)
+        if expression is None:
+            return
+        bisect.insort(entry['patterns'], route + (self.lead(expression.pattern), expression))
+
+    def lead(self, pattern):
+        # The literal digits an expression must start with, checked before the
+        #  expression itself is tried.
+        m = self.lead_re.match(pattern)
+        if not m or '|' in pattern:
+            return ''
+        lead = m.group(1)
+        if pattern[m.end():m.end() + 1] in ('?', '*', '{'):
+            lead = lead[:-1]
+            if lead[-1:] == '\\':
+                lead = lead[:-1]
+        return lead.replace('\\', '')
+
+    def expression(self, dp):
+        m = self.expression_re.search(dp.xml)
+        if m:
+            expression = html.unescape(m.group(1))
+        elif dp.number:
+            expression = str2regex(dp.number)
+        else:
+            return None
+        try:
+            return re.compile(expression)
+        except re.error:
+            return None
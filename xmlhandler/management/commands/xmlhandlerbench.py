@@ -0,0 +1,316 @@
+#
+#    DjangoPBX
+#
+#    MIT License
+#
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
+#
+#    Permission is hereby granted, free of charge, to any person obtaining a copy
+#    of this software and associated documentation files (the "Software"), to deal
+#    in the Software without restriction, including without limitation the rights
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#    copies of the Software, and to permit persons to whom the Software is
+#    furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in all
+#    copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#    SOFTWARE.
+#
+#    Contributor(s):
+#    Adrian Fretwell <adrian@djangopbx.com>
+#
+
+import json
+import time
+import random
+from contextlib import ExitStack
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils.translation import gettext_lazy as _
+from tenants.models import Domain
+from accounts.models import Extension, Gateway
+from voicemail.models import Voicemail
+from dialplans.models import Dialplan
+from dialplans.inboundroute import InboundRoute
+from ivrmenus.models import IvrMenus
+from callcentres.models import CallCentreQueues
+from switch.models import SipProfile
+from utilities.clearcache import ClearCache
+
+
+class CacheCounter():
+
+    # Counts the calls made on the default cache backend while active, each one
+    #  being a round trip to memcached.
+
+    methods = [
+        'get', 'get_many', 'set', 'set_many', 'add', 'delete', 'delete_many',
+        'incr', 'decr', 'touch', 'has_key', 'get_or_set'
+        ]
+
+    def __init__(self):
+        self.count = 0
+        self.backend = caches['default']
+
+    def wrap(self, method):
+        def counted(*args, **kwargs):
+            self.count += 1
+            return method(*args, **kwargs)
+        return counted
+
+    def __enter__(self):
+        for m in self.methods:
+            setattr(self.backend, m, self.wrap(getattr(self.backend, m)))
+        return self
+
+    def __exit__(self, *exc):
+        for m in self.methods:
+            delattr(self.backend, m)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the mod_xml_curl (xmlhandler) endpoints'
+
+    domain_suffix = 'xmlbench.invalid'
+    hostname = 'xmlbench'
+    request_types = [
+        'directory', 'reverse-auth', 'group-call', 'dialplan-public', 'dialplan-domain',
+        'sofia', 'callcentre', 'ivr'
+        ]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true', help=_('Create the benchmark domains before running'))
+        parser.add_argument('--remove', action='store_true', help=_('Remove the benchmark domains and exit'))
+        parser.add_argument('--domains', type=int, default=2, help=_('Number of domains to seed (default 2)'))
+        parser.add_argument('--extensions', type=int, default=100,
+                            help=_('Extensions per domain to seed (default 100)'))
+        parser.add_argument('--routes', type=int, default=50, help=_('Inbound routes per domain to seed (default 50)'))
+        parser.add_argument('--gateways', type=int, default=10, help=_('Gateways to seed (default 10)'))
+        parser.add_argument('--requests', type=int, default=500, help=_('Requests per request type (default 500)'))
+        parser.add_argument('--types', help=_('Comma separated request types to run (default all)'))
+        parser.add_argument('--replay', help=_('JSON lines file of recorded requests: {"type", "path", "data"}'))
+        parser.add_argument('--cold', action='store_true',
+                            help=_('Invalidate the xmlhandler cache before each request type'))
+        parser.add_argument('--save', help=_('Write the results as JSON to this file'))
+        parser.add_argument('--compare', help=_('Compare the results with a file written by --save'))
+        parser.add_argument('--threshold', type=float, default=20,
+                            help=_('Allowed regression in percent (default 20)'))
+
+    def handle(self, *args, **kwargs):
+        if kwargs['remove']:
+            self.remove()
+            return
+        if kwargs['seed']:
+            self.remove()
+            self.seed(kwargs['domains'], kwargs['extensions'], kwargs['routes'], kwargs['gateways'])
+
+        if kwargs['replay']:
+            workload = self.load_replay(kwargs['replay'])
+        else:
+            workload = self.synthetic(kwargs['requests'])
+        if kwargs['types']:
+            types = kwargs['types'].split(',')
+            workload = {k: v for k, v in workload.items() if k in types}
+        if not workload:
+            raise CommandError(_('Nothing to run, seed the benchmark domains with --seed or use --replay'))
+
+        results = {}
+        # The benchmark requests arrive from the loopback address, the default
+        #  allowed address, and from a host name that must be accepted.
+        with override_settings(ALLOWED_HOSTS=['*']):
+            client = Client(REMOTE_ADDR='127.0.0.1')
+            for request_type, requests in workload.items():
+                if kwargs['cold']:
+                    ClearCache().clearall()
+                results[request_type] = self.run(client, requests)
+                self.report(request_type, results[request_type])
+
+        if kwargs['save']:
+            with open(kwargs['save'], 'w') as f:
+                json.dump(results, f, indent=2)
+        if kwargs['compare']:
+            self.compare(results, kwargs['compare'], kwargs['threshold'])
+
+    def run(self, client, requests):
+        latencies = []
+        queries = 0
+        cache_calls = 0
+        errors = 0
+        start = time.perf_counter()
+        for path, data in requests:
+            with ExitStack() as stack:
+                # Every alias, reads may be routed to the xmlhandler database.
+                qs = [stack.enter_context(CaptureQueriesContext(conn)) for conn in connections.all()]
+                c = stack.enter_context(CacheCounter())
+                t = time.perf_counter()
+                response = client.post(path, data)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                else:
+                    response.content
+                latencies.append(time.perf_counter() - t)
+            queries += sum(len(q) for q in qs)
+            cache_calls += c.count
+            if not response.status_code == 200:
+                errors += 1
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        n = len(latencies)
+        return {
+            'requests': n,
+            'rps': n / elapsed,
+            'p50_ms': latencies[int(n * 0.50)] * 1000,
+            'p99_ms': latencies[min(int(n * 0.99), n - 1)] * 1000,
+            'queries': queries / n,
+            'cache_calls': cache_calls / n,
+            'errors': errors,
+            }
+
+    def report(self, request_type, r):
+        self.stdout.write(
+            '%-16s %6d req %9.1f req/s  p50 %7.2f ms  p99 %7.2f ms  %6.2f queries/req  %6.2f cache/req  %d errors' % (
+                request_type, r['requests'], r['rps'], r['p50_ms'], r['p99_ms'], r['queries'], r['cache_calls'],
+                r['errors']
+                )
+            )
+
+    def compare(self, results, filename, threshold):
+        with open(filename) as f:
+            baseline = json.load(f)
+        t = threshold / 100
+        regressions = []
+        for request_type, r in results.items():
+            b = baseline.get(request_type)
+            if not b:
+                continue
+            if r['rps'] < b['rps'] * (1 - t):
+                regressions.append('%s: %.1f req/s was %.1f' % (request_type, r['rps'], b['rps']))
+            if r['p99_ms'] > b['p99_ms'] * (1 + t):
+                regressions.append('%s: p99 %.2f ms was %.2f' % (request_type, r['p99_ms'], b['p99_ms']))
+            if r['queries'] > b['queries'] * (1 + t):
+                regressions.append('%s: %.2f queries/req was %.2f' % (request_type, r['queries'], b['queries']))
+            if r['cache_calls'] > b['cache_calls'] * (1 + t):
+                regressions.append('%s: %.2f cache/req was %.2f' % (request_type, r['cache_calls'], b['cache_calls']))
+        if regressions:
+            raise CommandError('Regressions over %s%%:\n%s' % (threshold, '\n'.join(regressions)))
+        self.stdout.write('No regressions over %s%%' % threshold)
+
+    def load_replay(self, filename):
+        workload = {}
+        with open(filename) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                r = json.loads(line)
+                workload.setdefault(r.get('type', r['path']), []).append((r['path'], r['data']))
+        return workload
+
+    def synthetic(self, count):
+        # Builds count POST bodies for each request type from the seeded
+        #  domains, as sent by mod_xml_curl.
+        es = list(Extension.objects.filter(
+            domain_id__name__endswith=self.domain_suffix
+            ).values_list('extension', 'domain_id__name'))
+        if not es:
+            return {}
+        domains = sorted(set(e[1] for e in es))
+        numbers = list(Dialplan.objects.filter(
+            domain_id__name__endswith=self.domain_suffix, category='Inbound route'
+            ).values_list('number', flat=True))
+        ivrs = [str(i) for i in IvrMenus.objects.filter(
+            domain_id__name__endswith=self.domain_suffix
+            ).values_list('id', flat=True)]
+        rnd = random.Random(1)
+        workload = {t: [] for t in self.request_types}
+        for i in range(count):
+            user, domain = es[i % len(es)]
+            workload['directory'].append(('/xmlhandler/directory/', {
+                'section': 'directory', 'tag_name': 'domain', 'key_name': 'name', 'key_value': domain,
+                'Event-Calling-Function': 'sofia_reg_parse_auth', 'action': 'sip_auth',
+                'user': user, 'domain': domain, 'sip_auth_method': 'REGISTER'
+                }))
+            workload['reverse-auth'].append(('/xmlhandler/directory/', {
+                'section': 'directory', 'action': 'reverse-auth-lookup', 'user': user, 'domain': domain
+                }))
+            workload['group-call'].append(('/xmlhandler/directory/', {
+                'section': 'directory', 'action': 'group_call', 'domain': domain
+                }))
+            # One in four public calls is to a number with no inbound route.
+            if numbers and i % 4:
+                number = numbers[rnd.randrange(len(numbers))]
+            else:
+                number = '0%09d' % rnd.randrange(10 ** 9)
+            workload['dialplan-public'].append(('/xmlhandler/dialplan/', {
+                'section': 'dialplan', 'Caller-Context': 'public', 'Caller-Destination-Number': number,
+                'FreeSWITCH-Switchname': self.hostname
+                }))
+            workload['dialplan-domain'].append(('/xmlhandler/dialplan/', {
+                'section': 'dialplan', 'Caller-Context': domains[i % len(domains)],
+                'Caller-Destination-Number': user, 'FreeSWITCH-Switchname': self.hostname
+                }))
+            workload['sofia'].append(('/xmlhandler/configuration/', {
+                'section': 'configuration', 'key_value': 'sofia.conf', 'hostname': self.hostname
+                }))
+            workload['callcentre'].append(('/xmlhandler/configuration/', {
+                'section': 'configuration', 'key_value': 'callcenter.conf', 'hostname': self.hostname
+                }))
+            if ivrs:
+                workload['ivr'].append(('/xmlhandler/configuration/', {
+                    'section': 'configuration', 'key_value': 'ivr.conf', 'hostname': self.hostname,
+                    'Menu-Name': ivrs[i % len(ivrs)]
+                    }))
+        return {k: v for k, v in workload.items() if v}
+
+    def seed(self, domain_count, extension_count, route_count, gateway_count):
+        profiles = list(
+            SipProfile.objects.filter(enabled='true').values_list('name', flat=True)
+            ) or ['external']
+        for d_no in range(domain_count):
+            d = Domain.objects.create(
+                name='d%d.%s' % (d_no, self.domain_suffix), enabled='true', updated_by='xmlbench'
+                )
+            for e_no in range(extension_count):
+                e = Extension.objects.create(
+                    domain_id=d, extension=str(1000 + e_no), password='xmlbench%d' % e_no,
+                    user_context=d.name, updated_by='xmlbench'
+                    )
+                if e_no % 2:
+                    Voicemail.objects.create(extension_id=e, password=str(1000 + e_no), updated_by='xmlbench')
+            for r_no in range(route_count):
+                number = '44%03d%06d' % (d_no, r_no)
+                dp = Dialplan.objects.create(
+                    domain_id=d, app_id='c03b422e-13a8-bd1b-e42b-b6b9b4d27ce4', name=number, number=number,
+                    context='public', category='Inbound route', dp_continue='false', sequence=100,
+                    enabled='true', updated_by='xmlbench'
+                    )
+                dp.xml = InboundRoute(
+                    number=number, context=d.name, domain_id=d.name,
+                    data='%d XML %s' % (1000 + r_no % extension_count, d.name)
+                    ).generate_xml(dp)
+                dp.save()
+            IvrMenus.objects.create(domain_id=d, name='xmlbench', extension='5000', updated_by='xmlbench')
+            CallCentreQueues.objects.create(
+                domain_id=d, name='xmlbench', extension='6000', moh_sound='local_stream://default',
+                updated_by='xmlbench'
+                )
+        for g_no in range(gateway_count):
+            Gateway.objects.create(
+                gateway='xmlbench%d' % g_no, username='xmlbench', password='xmlbench',
+                proxy='192.0.2.%d' % (g_no % 250 + 1),
+                profile=profiles[g_no % len(profiles)], hostname=self.hostname, updated_by='xmlbench'
+                )
+        self.stdout.write('Seeded %d domains' % domain_count)
+
+    def remove(self):
+        Gateway.objects.filter(gateway__startswith='xmlbench', hostname=self.hostname).delete()
+        Domain.objects.filter(name__endswith='.%s' % self.domain_suffix).delete()
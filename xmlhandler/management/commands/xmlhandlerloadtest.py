@@ -0,0 +1,178 @@
+#
+#    DjangoPBX
+#
+#    MIT License
+#
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
+#
+#    Permission is hereby granted, free of charge, to any person obtaining a copy
+#    of this software and associated documentation files (the "Software"), to deal
+#    in the Software without restriction, including without limitation the rights
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#    copies of the Software, and to permit persons to whom the Software is
+#    furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in all
+#    copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#    SOFTWARE.
+#
+#    Contributor(s):
+#    Adrian Fretwell <adrian@djangopbx.com>
+#
+
+import json
+import time
+import queue
+import socket
+import threading
+import http.client
+from urllib.parse import urlsplit, urlencode
+from django.core.management.base import CommandError
+from django.utils.translation import gettext_lazy as _
+from .xmlhandlerbench import Command as BenchCommand
+
+
+class Command(BenchCommand):
+    help = 'Load test a running xmlhandler deployment (uwsgi or ASGI) with concurrent mod_xml_curl requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help=_('Base URL of the deployment, eg. http://127.0.0.1:8008'))
+        parser.add_argument('--concurrency', type=int, default=50, help=_('Requests in flight (default 50)'))
+        parser.add_argument('--requests', type=int, default=2000, help=_('Requests per request type (default 2000)'))
+        parser.add_argument('--timeout', type=float, default=5,
+                            help=_('Request timeout in seconds, as xml_curl (default 5)'))
+        parser.add_argument('--types', help=_('Comma separated request types to run (default all)'))
+        parser.add_argument('--replay', help=_('JSON lines file of recorded requests: {"type", "path", "data"}'))
+        parser.add_argument('--save', help=_('Write the results as JSON to this file'))
+        parser.add_argument('--compare', help=_('Compare the results with a file written by --save'))
+
+    def handle(self, *args, **kwargs):
+        # The workload is built from the domains seeded by xmlhandlerbench --seed
+        #  so this must be run with the same database as the deployment.
+        if kwargs['replay']:
+            workload = self.load_replay(kwargs['replay'])
+        else:
+            workload = self.synthetic(kwargs['requests'])
+        if kwargs['types']:
+            types = kwargs['types'].split(',')
+            workload = {k: v for k, v in workload.items() if k in types}
+        if not workload:
+            raise CommandError(
+                _('Nothing to run, seed the benchmark domains with xmlhandlerbench --seed or use --replay')
+                )
+
+        url = urlsplit(kwargs['url'])
+        if url.scheme not in ('http', 'https'):
+            raise CommandError(_('URL must be http or https'))
+        self.url = url
+        self.prefix = url.path.rstrip('/')
+        self.timeout = kwargs['timeout']
+
+        results = {}
+        for request_type, requests in workload.items():
+            results[request_type] = self.load(requests, kwargs['concurrency'])
+            self.report(request_type, results[request_type])
+
+        if kwargs['save']:
+            with open(kwargs['save'], 'w') as f:
+                json.dump(results, f, indent=2)
+        if kwargs['compare']:
+            self.compare(results, kwargs['compare'])
+
+    def connect(self):
+        if self.url.scheme == 'https':
+            return http.client.HTTPSConnection(self.url.netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(self.url.netloc, timeout=self.timeout)
+
+    def worker(self, work, latencies, counts, lock):
+        # Each worker keeps one connection alive, as a FreeSWITCH curl handle does.
+        conn = self.connect()
+        headers = {'Content-Type': 'application/x-www-form-urlencoded', 'Connection': 'keep-alive'}
+        while True:
+            try:
+                path, data = work.get_nowait()
+            except queue.Empty:
+                break
+            status = 'ok'
+            t = time.perf_counter()
+            try:
+                conn.request('POST', self.prefix + path, urlencode(data), headers)
+                response = conn.getresponse()
+                response.read()
+                if not response.status == 200:
+                    status = 'errors'
+                if response.will_close:
+                    conn.close()
+            except (socket.timeout, TimeoutError):
+                status = 'timeouts'
+                conn.close()
+            except (OSError, http.client.HTTPException):
+                status = 'errors'
+                conn.close()
+            elapsed = time.perf_counter() - t
+            with lock:
+                latencies.append(elapsed)
+                counts[status] += 1
+        conn.close()
+
+    def load(self, requests, concurrency):
+        work = queue.Queue()
+        for r in requests:
+            work.put(r)
+        latencies = []
+        counts = {'ok': 0, 'errors': 0, 'timeouts': 0}
+        lock = threading.Lock()
+        threads = [
+            threading.Thread(target=self.worker, args=(work, latencies, counts, lock), daemon=True)
+            for i in range(min(concurrency, len(requests)))
+            ]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        n = len(latencies)
+        return {
+            'requests': n,
+            'concurrency': len(threads),
+            'rps': counts['ok'] / elapsed,
+            'p50_ms': latencies[int(n * 0.50)] * 1000,
+            'p99_ms': latencies[min(int(n * 0.99), n - 1)] * 1000,
+            'max_ms': latencies[-1] * 1000,
+            'errors': counts['errors'],
+            'timeouts': counts['timeouts'],
+            }
+
+    def report(self, request_type, r):
+        self.stdout.write(
+            '%-16s %6d req x%-4d %9.1f req/s  p50 %7.2f ms  p99 %7.2f ms  max %8.2f ms  %d errors  %d timeouts' % (
+                request_type, r['requests'], r['concurrency'], r['rps'], r['p50_ms'], r['p99_ms'], r['max_ms'],
+                r['errors'], r['timeouts']
+                )
+            )
+
+    def compare(self, results, filename):
+        # Side by side with another deployment, eg. the ASGI workers against
+        #  a file saved from the uwsgi workers.
+        with open(filename) as f:
+            baseline = json.load(f)
+        self.stdout.write('%-16s %11s %11s %8s %11s %11s %8s' % (
+            'type', 'base req/s', 'req/s', 'change', 'base p99', 'p99', 'change'
+            ))
+        for request_type, r in results.items():
+            b = baseline.get(request_type)
+            if not b:
+                continue
+            self.stdout.write('%-16s %11.1f %11.1f %+7.1f%% %11.2f %11.2f %+7.1f%%' % (
+                request_type, b['rps'], r['rps'], (r['rps'] / b['rps'] - 1) * 100 if b['rps'] else 0,
+                b['p99_ms'], r['p99_ms'], (r['p99_ms'] / b['p99_ms'] - 1) * 100 if b['p99_ms'] else 0
+                ))
@@ -0,0 +1,105 @@
+#
+#    DjangoPBX
+#
+#    MIT License
+#
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
+#
+#    Permission is hereby granted, free of charge, to any person obtaining a copy
+#    of this software and associated documentation files (the "Software"), to deal
+#    in the Software without restriction, including without limitation the rights
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#    copies of the Software, and to permit persons to whom the Software is
+#    furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in all
+#    copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#    SOFTWARE.
+#
+#    Contributor(s):
+#    Adrian Fretwell <adrian@djangopbx.com>
+#
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from .directoryindex import DirectoryIndex
+from .inboundrouteindex import InboundRouteIndex
+from utilities.clearcache import ClearCache
+
+
+def directory_extension_changed(sender, instance, **kwargs):
+    try:
+        d = instance.domain_id
+    except ObjectDoesNotExist:
+        return
+    if d:
+        name = d.name
+        extension_id = instance.id
+        transaction.on_commit(lambda: DirectoryIndex().changed(name, extension_id))
+
+
+def directory_extension_related_changed(sender, instance, **kwargs):
+    try:
+        e = instance.extension_id
+        d = e.domain_id if e else None
+    except ObjectDoesNotExist:
+        return
+    if d:
+        name = d.name
+        extension_id = e.id
+        transaction.on_commit(lambda: DirectoryIndex().changed(name, extension_id))
+
+
+def inbound_route(category, context):
+    return category == 'Inbound route' or bool(context and 'public' in context)
+
+
+def dialplan_pre_save(sender, instance, **kwargs):
+    previous = sender.objects.filter(pk=instance.pk).values_list('category', 'context').first()
+    instance.inbound_route_previous = bool(previous and inbound_route(*previous))
+
+
+def dialplan_changed(sender, instance, **kwargs):
+    # A route edited out of the inbound routes must leave the index as well.
+    if inbound_route(instance.category, instance.context) or getattr(instance, 'inbound_route_previous', False):
+        dialplan_id = instance.id
+        transaction.on_commit(lambda: InboundRouteIndex().changed(dialplan_id))
+
+
+def sofia_gateway_pre_save(sender, instance, **kwargs):
+    instance.sofia_previous_profile = sender.objects.filter(pk=instance.pk).values_list('profile', flat=True).first()
+
+
+def sofia_gateway_changed(sender, instance, **kwargs):
+    profiles = [instance.profile]
+    previous_profile = getattr(instance, 'sofia_previous_profile', None)
+    if previous_profile and not previous_profile == instance.profile:
+        profiles.append(previous_profile)
+    transaction.on_commit(lambda: sofia_changed(profiles))
+
+
+def sofia_profile_changed(sender, instance, **kwargs):
+    profiles = [instance.name]
+    transaction.on_commit(lambda: sofia_changed(profiles))
+
+
+def sofia_profile_related_changed(sender, instance, **kwargs):
+    try:
+        p = instance.sip_profile_id
+    except ObjectDoesNotExist:
+        return
+    profiles = [p.name]
+    transaction.on_commit(lambda: sofia_changed(profiles))
+
+
+def sofia_changed(profiles):
+    cc = ClearCache()
+    for profile in profiles:
+        cc.sofia(profile)
@@ -3,7 +3,7 @@
 #
 #    MIT License
 #
-#    Copyright (c) 2016 - 2022 Adrian Fretwell <adrian@djangopbx.com>
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
 #
 #    Permission is hereby granted, free of charge, to any person obtaining a copy
 #    of this software and associated documentation files (the "Software"), to deal
@@ -27,6 +27,65 @@
 #    Adrian Fretwell <adrian@djangopbx.com>
 #
 
-# from django.test import TestCase
+import ipaddress
+from django.test import SimpleTestCase, RequestFactory
+from accounts.models import Extension
+from pbx.dbconnections import XmlHandlerRouter
+from pbx.pbxipaddresscheck import AllowedAddressMatcher, pbx_ip_address_check
 
-# Create your tests here.
+
+class XmlHandlerRouterTests(SimpleTestCase):
+
+    def test_write_through_alias(self):
+        extension = Extension(extension='201')
+        extension._state.db = 'xmlhandler'
+        self.assertEqual(XmlHandlerRouter().db_for_write(Extension, instance=extension), 'default')
+
+    def test_write_elsewhere(self):
+        extension = Extension(extension='201')
+        extension._state.db = 'freeswitch'
+        self.assertIsNone(XmlHandlerRouter().db_for_write(Extension, instance=extension))
+        self.assertIsNone(XmlHandlerRouter().db_for_write(Extension))
+
+
+class AllowedAddressMatcherTests(SimpleTestCase):
+
+    def setUp(self):
+        self.matcher = AllowedAddressMatcher([
+            '127.0.0.1/32', '192.168.10.0/24', '10.0.0.0/8', '2001:db8::/32', '::1/128'
+            ])
+
+    def match(self, address):
+        return self.matcher.match(ipaddress.ip_address(address))
+
+    def test_prefixes(self):
+        self.assertTrue(self.match('127.0.0.1'))
+        self.assertFalse(self.match('127.0.0.2'))
+        self.assertTrue(self.match('192.168.10.254'))
+        self.assertFalse(self.match('192.168.11.1'))
+        self.assertTrue(self.match('10.200.3.4'))
+        self.assertFalse(self.match('11.0.0.1'))
+
+    def test_ipv6(self):
+        self.assertTrue(self.match('::1'))
+        self.assertTrue(self.match('2001:db8:1::5'))
+        self.assertFalse(self.match('2001:db9::5'))
+
+    def test_ipv4_mapped(self):
+        self.assertTrue(self.match('::ffff:192.168.10.7'))
+        self.assertFalse(self.match('::ffff:172.16.0.1'))
+
+    def test_invalid_networks_ignored(self):
+        with self.assertLogs('pbx.pbxipaddresscheck', 'WARNING'):
+            matcher = AllowedAddressMatcher(['192.168.1.5/24', 'not an address', '172.16.0.0/12'])
+        self.assertFalse(matcher.match(ipaddress.ip_address('192.168.1.5')))
+        self.assertTrue(matcher.match(ipaddress.ip_address('172.20.1.1')))
+
+    def test_no_address(self):
+        self.assertFalse(self.matcher.match(None))
+
+    def test_request(self):
+        request = RequestFactory().get('/xmlhandler/directory/', REMOTE_ADDR='192.168.10.20')
+        self.assertTrue(pbx_ip_address_check(request, self.matcher))
+        self.assertTrue(pbx_ip_address_check(request, ['192.168.10.0/24']))
+        self.assertFalse(pbx_ip_address_check(request, ['127.0.0.1/32']))
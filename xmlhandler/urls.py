@@ -27,14 +27,26 @@
 #    Adrian Fretwell <adrian@djangopbx.com>
 #
 
+from django.conf import settings
 from django.urls import path
 from . import views
 
-urlpatterns = [
-    path('dialplan/', views.dialplan, name='dialplan'),
-    path('directory/', views.directory, name='directory'),
-    path('languages/', views.languages, name='languages'),
-    path('configuration/', views.configuration, name='configuration'),
+if getattr(settings, 'PBX_XMLHANDLER_ASYNC_VIEWS', False):
+    urlpatterns = [
+        path('dialplan/', views.adialplan, name='dialplan'),
+        path('directory/', views.adirectory, name='directory'),
+        path('languages/', views.alanguages, name='languages'),
+        path('configuration/', views.aconfiguration, name='configuration'),
+    ]
+else:
+    urlpatterns = [
+        path('dialplan/', views.dialplan, name='dialplan'),
+        path('directory/', views.directory, name='directory'),
+        path('languages/', views.languages, name='languages'),
+        path('configuration/', views.configuration, name='configuration'),
+    ]
+
+urlpatterns += [
     path('static/dialplan.xml', views.staticdialplan, name='staticdialplan'),
     path('static/directory.xml', views.staticdirectory, name='staticdirectory'),
 ]
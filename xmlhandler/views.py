@@ -3,7 +3,7 @@
 #
 #    MIT License
 #
-#    Copyright (c) 2016 - 2023 Adrian Fretwell <adrian@djangopbx.com>
+#    Copyright (c) 2016 - 2024 Adrian Fretwell <adrian@djangopbx.com>
 #
 #    Permission is hereby granted, free of charge, to any person obtaining a copy
 #    of this software and associated documentation files (the "Software"), to deal
@@ -28,13 +28,27 @@
 #
 
 import logging
-from django.http import HttpResponse, HttpResponseNotFound
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse, HttpResponseNotFound, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from pbx.pbxipaddresscheck import pbx_ip_address_check
+from pbx.dbconnections import xmlhandler_database, xmlhandler_stream
 from .xmlhandlerclasses import DirectoryHandler, DialplanHandler, LanguagesHandler, ConfigHandler
 
 logger = logging.getLogger(__name__)
 
+# Thread pool shared by the async views of an ASGI worker.  Handler code, the
+# pymemcache client and the ORM are all synchronous so each request is built on
+# one of these threads while the event loop keeps accepting further requests.
+# Each thread holds its own database connection so the pool is sized from the
+# worker's share of PBX_XMLHANDLER_ASYNC_DB_CONNECTIONS, which is then the limit
+# on the requests the worker builds at once, cache hits included.
+async_executor = None
+
+
 def check_ok_to_process(request, allowed_addresses, method='POST'):
     if not pbx_ip_address_check(request, allowed_addresses):
         return False
@@ -42,22 +56,13 @@ def check_ok_to_process(request, allowed_addresses, method='POST'):
         return False
     return True
 
-@csrf_exempt
-def dialplan(request):
-    debug = False
-    xmlhf = DialplanHandler()
-    allowed_addresses = xmlhf.get_allowed_addresses()
-    if not check_ok_to_process(request, allowed_addresses):
-        return HttpResponseNotFound()
-
-    if debug:
-        logger.info('XML Handler request: {}'.format(request.POST))
 
-    call_context = request.POST.get('Caller-Context', '')
-    hostname = request.POST.get('FreeSWITCH-Switchname', '')
-    destination_number = request.POST.get('Caller-Destination-Number', '')
-    hunt_context = request.POST.get('Hunt-Context')
-    hunt_destination_number = request.POST.get('Hunt-Destination-Number')
+def dialplan_xml(xmlhf, post):
+    call_context = post.get('Caller-Context', '')
+    hostname = post.get('FreeSWITCH-Switchname', '')
+    destination_number = post.get('Caller-Destination-Number', '')
+    hunt_context = post.get('Hunt-Context')
+    hunt_destination_number = post.get('Hunt-Destination-Number')
 
     if hunt_context:
         call_context = hunt_context
@@ -65,42 +70,16 @@ def dialplan(request):
     if hunt_destination_number:
         destination_number = hunt_destination_number
 
-    xml = xmlhf.GetDialplan(call_context, hostname, destination_number)
-    if debug:
-        logger.info('XML Handler response: {}'.format(xml))
-
-    return HttpResponse(xml, content_type='application/xml')
-
-
-def staticdialplan(request):
-    xmlhf = DialplanHandler()
-    allowed_addresses = xmlhf.get_allowed_addresses()
-    if not check_ok_to_process(request, allowed_addresses, 'GET'):
-        return HttpResponseNotFound()
-
-    hostname = request.GET.get('hostname', 'None')
-    xml = xmlhf.GetDialplanStatic(hostname)
-
-    return HttpResponse(xml, content_type='application/xml')
-
-
-@csrf_exempt
-def directory(request):
-    debug = False
-    xmlhf = DirectoryHandler()
-    allowed_addresses = xmlhf.get_allowed_addresses()
-    if not check_ok_to_process(request, allowed_addresses):
-        return HttpResponseNotFound()
+    return xmlhf.GetDialplan(call_context, hostname, destination_number)
 
-    if debug:
-        logger.info('XML Handler request: {}'.format(request.POST))
 
-    purpose = request.POST.get('purpose', '')
-    action = request.POST.get('action', '')
-    domain = request.POST.get('domain')
-    user = request.POST.get('user')
-    event_calling_function = request.POST.get('Event-Calling-Function', '')
-    event_calling_file = request.POST.get('Event-Calling-File', '')
+def directory_xml(xmlhf, post):
+    purpose = post.get('purpose', '')
+    action = post.get('action', '')
+    domain = post.get('domain')
+    user = post.get('user')
+    event_calling_function = post.get('Event-Calling-Function', '')
+    event_calling_file = post.get('Event-Calling-File', '')
 
     if purpose == 'gateways':
         xml = xmlhf.GetDomain()
@@ -115,9 +94,61 @@ def directory(request):
     elif event_calling_function == 'switch_load_network_lists':
         xml = xmlhf.GetAcl(domain)
     elif event_calling_function == 'populate_database' and event_calling_file == 'mod_directory.c':
+        # A generator of bytes, streamed by the caller.
         xml = xmlhf.GetPopulateDirectory(domain)
     else:
         xml = xmlhf.GetDirectory(domain, user)
+    return xml
+
+
+def languages_xml(xmlhf, post):
+    lang = post.get('lang', '')
+    macro_name = post.get('macro_name', '')
+
+    return xmlhf.GetLanguage(lang, macro_name)
+
+
+def configuration_xml(xmlhf, post):
+    hostname = post.get('hostname', '')
+    if not hostname:
+        return xmlhf.NotFoundXml()
+
+    key_value = post.get('key_value', '')
+    if key_value == 'acl.conf':
+        xml = xmlhf.GetACL()
+    elif key_value == 'sofia.conf':
+        xml = xmlhf.GetSofia(hostname)
+    elif key_value == 'local_stream.conf':
+        xml = xmlhf.GetLocalStream()
+    elif key_value == 'translate.conf':
+        xml = xmlhf.GetTranslate()
+    elif key_value == 'ivr.conf':
+        xml = xmlhf.GetIvr(post.get('Menu-Name', ''))
+    elif key_value == 'callcenter.conf':
+        cc_queue = post.get('CC-Queue', False)
+        if cc_queue:
+            xml = xmlhf.GetCallcentreQueue(cc_queue)
+        else:
+            xml = xmlhf.GetCallcentre()
+    else:
+        xml = xmlhf.NotFoundXml()
+    return xml
+
+
+def xml_response(request, handler_class, build):
+    debug = False
+    with xmlhandler_database():
+        xmlhf = handler_class()
+        allowed_addresses = xmlhf.get_allowed_addresses()
+        if not check_ok_to_process(request, allowed_addresses):
+            return HttpResponseNotFound()
+
+        if debug:
+            logger.info('XML Handler request: {}'.format(request.POST))
+
+        xml = build(xmlhf, request.POST)
+    if not isinstance(xml, (str, bytes)):
+        return StreamingHttpResponse(xmlhandler_stream(xml), content_type='application/xml')
 
     if debug:
         logger.info('XML Handler response: {}'.format(xml))
@@ -125,68 +156,113 @@ def directory(request):
     return HttpResponse(xml, content_type='application/xml')
 
 
+@csrf_exempt
+def dialplan(request):
+    return xml_response(request, DialplanHandler, dialplan_xml)
+
+
+def staticdialplan(request):
+    xmlhf = DialplanHandler()
+    allowed_addresses = xmlhf.get_allowed_addresses()
+    if not check_ok_to_process(request, allowed_addresses, 'GET'):
+        return HttpResponseNotFound()
+
+    hostname = request.GET.get('hostname', 'None')
+
+    return StreamingHttpResponse(xmlhandler_stream(xmlhf.GetDialplanStatic(hostname)), content_type='application/xml')
+
+
+@csrf_exempt
+def directory(request):
+    return xml_response(request, DirectoryHandler, directory_xml)
+
+
 def staticdirectory(request):
     xmlhf = DirectoryHandler()
     allowed_addresses = xmlhf.get_allowed_addresses()
 
     if not check_ok_to_process(request, allowed_addresses, 'GET'):
         return HttpResponseNotFound()
-    xml = xmlhf.GetDirectoryStatic()
 
-    return HttpResponse(xml, content_type='application/xml')
+    return StreamingHttpResponse(xmlhandler_stream(xmlhf.GetDirectoryStatic()), content_type='application/xml')
+
 
 @csrf_exempt
 def languages(request):
-    debug = False
-    xmlhf = LanguagesHandler()
-    allowed_addresses = xmlhf.get_allowed_addresses()
+    return xml_response(request, LanguagesHandler, languages_xml)
 
-    if not check_ok_to_process(request, allowed_addresses):
-        return HttpResponseNotFound()
 
-    if debug:
-        logger.info('XML Handler request: {}'.format(request.POST))
+@csrf_exempt
+def configuration(request):
+    return xml_response(request, ConfigHandler, configuration_xml)
 
-    lang = request.POST.get('lang', '')
-    macro_name = request.POST.get('macro_name', '')
 
-    xml = xmlhf.GetLanguage(lang, macro_name)
+# Async versions of the mod_xml_curl views for use under pbx/asgi.py, selected
+# in urls.py by PBX_XMLHANDLER_ASYNC_VIEWS.
+
+def async_threads():
+    connections = getattr(settings, 'PBX_XMLHANDLER_ASYNC_DB_CONNECTIONS', 32)
+    workers = getattr(settings, 'PBX_ASGI_WORKERS', 2)
+    return max(connections // max(workers, 1), 1)
+
+
+def get_async_executor():
+    global async_executor
+    if async_executor is None:
+        threads = async_threads()
+        async_executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='xmlhandler')
+        logger.info('XML Handler: building at most {} async responses at once, one per database connection.'.format(
+            threads))
+    return async_executor
+
+
+def build_in_thread(request, handler_class, build):
+    # request_started and request_finished are sent on the event loop thread so
+    # connections belonging to this pool thread are checked here instead.
+    close_old_connections()
+    try:
+        return xml_response(request, handler_class, build)
+    finally:
+        close_old_connections()
+
+
+async def stream_in_thread(streaming_content):
+    # GetPopulateDirectory reads through a database cursor so every chunk must be
+    # produced on the same thread, the per request thread of sync_to_async.
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    while True:
+        chunk = await next_chunk(streaming_content, None)
+        if chunk is None:
+            break
+        yield chunk
+
+
+async def async_xml_response(request, handler_class, build):
+    response = await sync_to_async(
+        build_in_thread, thread_sensitive=False, executor=get_async_executor()
+    )(request, handler_class, build)
+    if response.streaming and not response.is_async:
+        response = StreamingHttpResponse(
+            stream_in_thread(iter(response.streaming_content)), content_type='application/xml'
+        )
+    return response
 
-    return HttpResponse(xml, content_type='application/xml')
 
 @csrf_exempt
-def configuration(request):
-    debug = False
+async def adialplan(request):
+    return await async_xml_response(request, DialplanHandler, dialplan_xml)
 
-    xmlhf = ConfigHandler()
-    allowed_addresses = xmlhf.get_allowed_addresses()
-    if not check_ok_to_process(request, allowed_addresses):
-        return HttpResponseNotFound()
-    if debug:
-        logger.info('XML Handler request: {}'.format(request.POST))
 
-    hostname = request.POST.get('hostname', '')
-    if not hostname:
-        xml = xmlhf.NotFoundXml()
+@csrf_exempt
+async def adirectory(request):
+    return await async_xml_response(request, DirectoryHandler, directory_xml)
 
-    key_value = request.POST.get('key_value', '')
-    if key_value == 'acl.conf':
-        xml = xmlhf.GetACL()
-    elif key_value == 'sofia.conf':
-        xml = xmlhf.GetSofia(hostname)
-    elif key_value == 'local_stream.conf':
-        xml = xmlhf.GetLocalStream()
-    elif key_value == 'translate.conf':
-        xml = xmlhf.GetTranslate()
-    elif key_value == 'ivr.conf':
-        xml = xmlhf.GetIvr(request.POST.get('Menu-Name', ''))
-    elif key_value == 'callcenter.conf':
-        cc_queue = request.POST.get('CC-Queue', False)
-        if cc_queue:
-            xml = xmlhf.GetCallcentreQueue(cc_queue)
-        else:
-            xml = xmlhf.GetCallcentre()
-    else:
-        xml = xmlhf.NotFoundXml()
 
-    return HttpResponse(xml, content_type='application/xml')
+@csrf_exempt
+async def alanguages(request):
+    return await async_xml_response(request, LanguagesHandler, languages_xml)
+
+
+@csrf_exempt
+async def aconfiguration(request):
+    return await async_xml_response(request, ConfigHandler, configuration_xml)
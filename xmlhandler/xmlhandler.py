@@ -27,16 +27,36 @@
 #    Adrian Fretwell <adrian@djangopbx.com>
 #
 
+import io
+import time
+from contextlib import ExitStack
+from django.conf import settings
 from django.core.cache import cache
 from lxml import etree
-from tenants.pbxsettings import PbxSettings
 from switch.models import SwitchVariable
-from pbx.pbxipaddresscheck import loopback_default
+from pbx.pbxipaddresscheck import AllowedAddresses
+from pbx.cachenamespace import CacheNamespace
 
 class XmlHandler():
 
+    # Bytes of XML collected before a chunk is handed to a StreamingHttpResponse.
+    stream_chunk_size = 65536
+    # Rows fetched from the database at a time by streamed responses.
+    stream_fetch_size = 2000
+
+    # Seconds a cached document is considered fresh.
+    cache_timeout = 300
+    # Seconds a build lock is held for before another worker may take over.
+    build_lock_timeout = 10
+    # Seconds between checks for a document being built by another worker.
+    build_wait_step = 0.05
+
     def __init__(self):
         self.debug = False
+        self.namespaces = {}
+        self.build_locks = set()
+        self.cache_stale = getattr(settings, 'PBX_XMLHANDLER_CACHE_STALE', 60)
+        self.build_wait = getattr(settings, 'PBX_XMLHANDLER_BUILD_WAIT', 1.0)
 
     def NotFoundXml(self):
         return '''<?xml version="1.0" encoding="UTF-8" standalone="no"?>
@@ -80,21 +100,98 @@ class XmlHandler():
     def XrootStatic(self):
         return etree.XML(b'<?xml version=\"1.0\" encoding=\"UTF-8\"?><include></include>\n')
 
+    def StreamOpen(self):
+        # Returns a buffer, an lxml incremental writer on it and an ExitStack
+        #  that holds the open elements.  Everything written is collected from
+        #  the buffer with StreamChunk.
+        buf = io.BytesIO()
+        stack = ExitStack()
+        xf = stack.enter_context(etree.xmlfile(buf, encoding='UTF-8'))
+        return buf, xf, stack
+
+    def StreamElement(self, xf, stack, level, tag, attrib=None):
+        # Open an element that stays open until stack is closed, indented to
+        #  match etree.indent.
+        if level:
+            xf.write('\n' + '  ' * level)
+        stack.enter_context(xf.element(tag, attrib if attrib else {}))
+        stack.callback(xf.write, '\n' + '  ' * level)
+
+    def StreamWrite(self, xf, element, level):
+        etree.indent(element, level=level)
+        xf.write('\n' + '  ' * level)
+        xf.write(element)
+
+    def StreamChunk(self, buf, xf=None, size=0):
+        # Returns what has been written since the last chunk, or b'' if that
+        #  is still less than size bytes.
+        if xf is not None:
+            xf.flush()
+        if buf.tell() < size:
+            return b''
+        chunk = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return chunk
+
+    def cache_key(self, section, key, domain=None):
+        if section not in self.namespaces:
+            self.namespaces[section] = CacheNamespace(section)
+        return self.namespaces[section].key(key, domain)
+
+    # Coalesced cache access for built XML documents.
+    #
+    # Documents are stored with the time they stop being fresh and are kept in
+    #  the cache for cache_stale seconds after that.  A caller that gets None
+    #  from cache_get must build the document and pass it to cache_set, or call
+    #  cache_release if it gives up.  Only one worker at a time is asked to
+    #  build a given key, the rest are handed the stale copy if there is one,
+    #  otherwise they wait up to build_wait seconds for the builder to finish.
+    #  If the cache is unavailable every caller builds, as before.
+
+    def cache_get(self, key):
+        entry = cache.get(key)
+        if isinstance(entry, str):
+            return entry
+        if entry is not None:
+            xml, fresh_until = entry
+            if fresh_until > time.time() or not self.cache_build_lock(key):
+                return xml
+            return None
+        if self.cache_build_lock(key):
+            return None
+        if cache.get('%s:lock' % key) is None:
+            # The lock could not be taken and is not there, the cache is down.
+            return None
+        waited = 0
+        while waited < self.build_wait:
+            time.sleep(self.build_wait_step)
+            waited += self.build_wait_step
+            entry = cache.get(key)
+            if entry is not None:
+                return entry if isinstance(entry, str) else entry[0]
+        return None
+
+    def cache_build_lock(self, key):
+        if cache.add('%s:lock' % key, 1, self.build_lock_timeout):
+            self.build_locks.add(key)
+            return True
+        return False
+
+    def cache_set(self, key, xml):
+        cache.set(key, (xml, time.time() + self.cache_timeout), self.cache_timeout + self.cache_stale)
+        self.cache_release(key)
+
+    def cache_release(self, key):
+        if key in self.build_locks:
+            self.build_locks.discard(key)
+            cache.delete('%s:lock' % key)
+
     def get_allowed_addresses(self):
-        cache_key = 'xmlhandler:allowed_addresses'
-        aa = cache.get(cache_key)
-        if aa:
-            return aa
-        aa = PbxSettings().default_settings('xmlhandler', 'allowed_address', 'array')
-        if aa:
-            cache.set(cache_key, aa)
-            return aa
-        aa = loopback_default
-        cache.set(cache_key, aa)
-        return aa
+        return AllowedAddresses('xmlhandler').matcher()
 
     def get_default_language(self):
-        cache_key = 'xmlhandler:lang:default_language'
+        cache_key = self.cache_key('languages', 'default_language')
         cv = cache.get(cache_key)
         if cv:
             return cv
@@ -107,7 +204,7 @@ class XmlHandler():
         return cv
 
     def get_default_dialect(self):
-        cache_key = 'xmlhandler:lang:default_dialect'
+        cache_key = self.cache_key('languages', 'default_dialect')
         cv = cache.get(cache_key)
         if cv:
             return cv
@@ -120,7 +217,7 @@ class XmlHandler():
         return cv
 
     def get_default_voice(self):
-        cache_key = 'xmlhandler:lang:default_voice'
+        cache_key = self.cache_key('languages', 'default_voice')
         cv = cache.get(cache_key)
         if cv:
             return cv
@@ -28,17 +28,20 @@
 #
 
 from django.core.cache import cache
+from contextlib import ExitStack
 from lxml import etree
 from pbx.commonvalidators import valid_uuid4
-from django.db.models import Q
+from django.db.models import Q, Prefetch
 from .xmlhandler import XmlHandler
+from .directoryindex import DirectoryIndex
+from .inboundrouteindex import InboundRouteIndex
 from dialplans.models import Dialplan, DialplanExcludes
 from tenants.models import Domain
 from tenants.pbxsettings import PbxSettings
 from accounts.models import Extension, ExtensionUser, Gateway
 from voicemail.models import Voicemail
 from switch.models import (
-    AccessControl, AccessControlNode, SipProfile, SwitchVariable
+    AccessControl, AccessControlNode, SipProfile, SipProfileDomain, SipProfileSetting, SwitchVariable
     )
 from phrases.models import PhraseDetails
 from musiconhold.models import MusicOnHold
@@ -297,7 +300,10 @@ class DirectoryHandler(XmlHandler):
             xml = self.NotFoundXml()
             return xml
 
-        cache_key = 'xmlhandler:number_as_presence_id'
+        if cacheable and DirectoryIndex.enabled():
+            return DirectoryIndex(self).get(domain, user)
+
+        cache_key = self.cache_key('directory', 'number_as_presence_id')
         number_as_presence_id = cache.get(cache_key)
         if not number_as_presence_id:
             number_as_presence_id = PbxSettings().default_settings(
@@ -305,8 +311,8 @@ class DirectoryHandler(XmlHandler):
                     )
             cache.set(cache_key, number_as_presence_id)
 
-        directory_cache_key = 'directory:%s@%s' % (user, domain)
-        xml = cache.get(directory_cache_key)
+        directory_cache_key = self.cache_key('directory', '%s@%s' % (user, domain), domain)
+        xml = self.cache_get(directory_cache_key)
         if xml:
             return xml
 
@@ -315,7 +321,7 @@ class DirectoryHandler(XmlHandler):
                 ).first()
         if e is None:
             xml = self.NotFoundXml()
-            cache.set(directory_cache_key, xml)
+            self.cache_set(directory_cache_key, xml)
             return xml
 
         v = Voicemail.objects.filter(extension_id__extension=user, enabled='true').first()
@@ -329,7 +335,7 @@ class DirectoryHandler(XmlHandler):
 
         etree.indent(x_root)
         xml = str(etree.tostring(x_root), "utf-8")
-        cache.set(directory_cache_key, xml)
+        self.cache_set(directory_cache_key, xml)
         if self.debug:
             print(xml)
         return xml
@@ -375,8 +381,8 @@ class DirectoryHandler(XmlHandler):
             xml = self.NotFoundXml()
             return xml
 
-        directory_cache_key = 'directory:groups:%s' % domain
-        xml = cache.get(directory_cache_key)
+        directory_cache_key = self.cache_key('directory', 'groups:%s' % domain, domain)
+        xml = self.cache_get(directory_cache_key)
         if xml:
             return xml
 
@@ -406,7 +412,7 @@ class DirectoryHandler(XmlHandler):
 
         etree.indent(x_root)
         xml = str(etree.tostring(x_root), "utf-8")
-        cache.set(directory_cache_key, xml)
+        self.cache_set(directory_cache_key, xml)
         if self.debug:
             print(xml)
         return xml
@@ -418,8 +424,8 @@ class DirectoryHandler(XmlHandler):
         if not user:
             xml = self.NotFoundXml()
             return xml
-        directory_cache_key = 'directory:reverseauth:%s@%s' % (user, domain)
-        xml = cache.get(directory_cache_key)
+        directory_cache_key = self.cache_key('directory', 'reverseauth:%s@%s' % (user, domain), domain)
+        xml = self.cache_get(directory_cache_key)
         if xml:
             return xml
 
@@ -428,7 +434,7 @@ class DirectoryHandler(XmlHandler):
                 ).first()
         if e is None:
             xml = self.NotFoundXml()
-            cache.set(directory_cache_key, xml)
+            self.cache_set(directory_cache_key, xml)
             return xml
 
         x_root = self.XrootDynamic()
@@ -439,56 +445,78 @@ class DirectoryHandler(XmlHandler):
 
         etree.indent(x_root)
         xml = str(etree.tostring(x_root), "utf-8")
-        cache.set(directory_cache_key, xml)
+        self.cache_set(directory_cache_key, xml)
         if self.debug:
             print(xml)
         return xml
 
+    def DirectoryStreamDomain(self, xf, stack, level, domain, params=True, variables=True):
+        # Open the domain, groups, group and users elements of domain on xf.
+        #  Users are then written at level + 4.
+        x_domain = self.DirectoryAddDomain(domain, etree.Element("section"), params, variables, False)
+        self.StreamElement(xf, stack, level, 'domain', x_domain.attrib)
+        for x_child in x_domain:
+            self.StreamWrite(xf, x_child, level + 1)
+        self.StreamElement(xf, stack, level + 1, 'groups')
+        self.StreamElement(xf, stack, level + 2, 'group', {'name': 'default'})
+        self.StreamElement(xf, stack, level + 3, 'users')
+
     def GetPopulateDirectory(self, domain=None):
+        # Returns an iterator of XML bytes, for a StreamingHttpResponse.
+        es = Extension.objects.select_related('domain_id').filter(
+            (Q(directory_visible='true') | Q(directory_exten_visible='true')),
+            enabled='true'
+            ).order_by('domain_id')
         if domain:
-            es = Extension.objects.select_related('domain_id').filter(
-                (Q(directory_visible='true') | Q(directory_exten_visible='true')),
-                domain_id__name=domain, enabled='true'
-                ).order_by('domain_id')
-        else:
-            es = Extension.objects.select_related('domain_id').filter(
-                (Q(directory_visible='true') | Q(directory_exten_visible='true')),
-                enabled='true'
-                ).order_by('domain_id')
-
-        x_root = self.XrootDynamic()
-        x_section = etree.SubElement(x_root, "section", name='directory')
-
-        last_domain = 'None'
-        for e in es:
-            if not last_domain == e.domain_id.name:
-                last_domain = e.domain_id.name
-                x_users = self.DirectoryAddDomain(e.domain_id.name, x_section, False, False)
-            self.DirectoryPopulate(domain, x_users, e)
-
-        etree.indent(x_root)
-        xml = str(etree.tostring(x_root), "utf-8")
-        return xml
-
-    def GetDirectoryStatic(self, number_as_presence_id, cacheable=False):
+            es = es.filter(domain_id__name=domain)
+
+        buf, xf, stack = self.StreamOpen()
+        with stack:
+            xf.write_declaration(standalone=False)
+            self.StreamElement(xf, stack, 0, 'document', {'type': 'freeswitch/xml'})
+            self.StreamElement(xf, stack, 1, 'section', {'name': 'directory'})
+            with ExitStack() as x_domain:
+                last_domain = 'None'
+                for e in es.iterator(chunk_size=self.stream_fetch_size):
+                    if not last_domain == e.domain_id.name:
+                        last_domain = e.domain_id.name
+                        x_domain.close()
+                        self.DirectoryStreamDomain(xf, x_domain, 2, last_domain, False, False)
+                    x_users = etree.Element("users")
+                    self.DirectoryPopulate(domain, x_users, e)
+                    self.StreamWrite(xf, x_users[0], 6)
+                    chunk = self.StreamChunk(buf, xf, self.stream_chunk_size)
+                    if chunk:
+                        yield chunk
+        yield self.StreamChunk(buf)
+
+    def GetDirectoryStatic(self, cacheable=False):
+        # Returns an iterator of XML bytes, for a StreamingHttpResponse.
         number_as_presence_id = PbxSettings().default_settings('xmlhandler', 'number_as_presence_id', 'boolean')
-
-        x_root = self.XrootStatic()
-        es = Extension.objects.select_related('domain_id').prefetch_related('extensionuser', 'voicemail').filter(
-                enabled='true'
-                ).order_by('domain_id')
-        last_domain = 'None'
-        for e in es:
-            if not last_domain == e.domain_id.name:
-                last_domain = e.domain_id.name
-                x_users = self.DirectoryAddDomain(e.domain_id.name, x_root)
-            v = e.voicemail.filter(enabled='true').first()
-            eu = e.extensionuser.filter(default_user='true').first()
-            self.DirectoryAddUser(e.domain_id.name, e.extension, number_as_presence_id, x_users, e, eu, v, cacheable)
-
-        etree.indent(x_root)
-        xml = str(etree.tostring(x_root), "utf-8")
-        return xml
+        es = DirectoryIndex().queryset().filter(enabled='true').order_by('domain_id')
+
+        buf, xf, stack = self.StreamOpen()
+        with stack:
+            xf.write_declaration()
+            self.StreamElement(xf, stack, 0, 'include')
+            with ExitStack() as x_domain:
+                last_domain = 'None'
+                for e in es.iterator(chunk_size=self.stream_fetch_size):
+                    if not last_domain == e.domain_id.name:
+                        last_domain = e.domain_id.name
+                        x_domain.close()
+                        self.DirectoryStreamDomain(xf, x_domain, 1, last_domain)
+                    v = (e.enabled_voicemails[0] if e.enabled_voicemails else None)
+                    eu = (e.default_users[0] if e.default_users else None)
+                    x_users = etree.Element("users")
+                    self.DirectoryAddUser(
+                        e.domain_id.name, e.extension, number_as_presence_id, x_users, e, eu, v, cacheable
+                        )
+                    self.StreamWrite(xf, x_users[0], 5)
+                    chunk = self.StreamChunk(buf, xf, self.stream_chunk_size)
+                    if chunk:
+                        yield chunk
+        yield self.StreamChunk(buf)
 
 
 class DialplanHandler(XmlHandler):
@@ -502,17 +530,20 @@ class DialplanHandler(XmlHandler):
         if call_context == 'public' or call_context[:7] == 'public@' or call_context[-7:] == '.public':
             context_name = 'public'
 
-        cache_key = 'xmlhandler:context_type'
+        cache_key = self.cache_key('dialplan', 'context_type')
         context_type = cache.get(cache_key)
         if not context_type:
             context_type = PbxSettings().default_settings('xmlhandler', 'context_type', 'text')
             cache.set(cache_key, context_type)
 
-        dialplan_cache_key = 'dialplan:%s' % call_context
+        if context_name == 'public' and context_type == 'single' and InboundRouteIndex.enabled():
+            return InboundRouteIndex(self).get(hostname, call_context, destination_number)
+
+        dialplan_cache_key = self.cache_key('dialplan', call_context, context_name)
         if context_name == 'public' and context_type == "single":
-            dialplan_cache_key = 'dialplan:%s:%s' % (context_name, destination_number)
+            dialplan_cache_key = self.cache_key('dialplan', '%s:%s' % (context_name, destination_number), context_name)
 
-        xml = cache.get(dialplan_cache_key)
+        xml = self.cache_get(dialplan_cache_key)
         if xml:
             return xml
 
@@ -534,7 +565,7 @@ class DialplanHandler(XmlHandler):
                     context=call_context, enabled='true'
                     ).values_list('xml', flat=True).order_by('sequence'))
             else:
-                dialplan_excludes_cache_key = 'dialplanexclude:%s' % call_context
+                dialplan_excludes_cache_key = self.cache_key('dialplan', 'exclude:%s' % call_context, call_context)
                 excludeList = cache.get(dialplan_excludes_cache_key)
                 if excludeList is None:
                     excludeList = list(DialplanExcludes.objects.values_list('app_id', flat=True).filter(domain_name=call_context))
@@ -551,44 +582,49 @@ class DialplanHandler(XmlHandler):
                         ).values_list('xml', flat=True).order_by('sequence'))
 
         if len(xml_list) == 0:
+            self.cache_release(dialplan_cache_key)
             return self.NotFoundXml()
 
         xml_list.append(self.XmlFooter())
 
         xml = '\n'
         xml = xml.join(xml_list)
-        cache.set(dialplan_cache_key, xml)
+        self.cache_set(dialplan_cache_key, xml)
         if self.debug:
             print(xml)
         return xml
 
     def GetDialplanStatic(self, hostname):
-        xml_list = list()
-        xml_list.append('<?xml version=\"1.0\" encoding=\"utf-8\"?>\n<include>\n')
+        # Returns an iterator of XML bytes, for a StreamingHttpResponse.
+        # The dialplan xml is stored as text and is not always well formed
+        #  (see InboundRoute.generate_xml), so it is passed through as it is
+        #  rather than written with etree.xmlfile.
         dps = Dialplan.objects.filter(
-                (Q(hostname=hostname) | Q(hostname__isnull=True)), enabled='true'
-                ).order_by('context', 'sequence')
-        start = True
-        dp_count = 0
-        for d in dps:
-            dp_count += 1
-            if start:
-                start = False
-                last_context = d.context
-                xml_list.append('<context name=\"{}\">\n'.format(d.context))
-            if not last_context == d.context:
-                last_context = d.context
-                xml_list.append('</context>\n<context name=\"{}\">\n'.format(d.context))
-            xml_list.append(d.xml)
+                (Q(hostname=hostname) | Q(hostname__isnull=True)), xml__isnull=False, enabled='true'
+                ).order_by('context', 'sequence').values_list('context', 'xml')
+        xml_list = list()
+        size = 0
+        last_context = None
+        for context, xml in dps.iterator(chunk_size=self.stream_fetch_size):
+            if last_context is None:
+                xml_list.append('<?xml version=\"1.0\" encoding=\"utf-8\"?>\n<include>\n')
+                xml_list.append('<context name=\"{}\">\n'.format(context))
+            elif not last_context == context:
+                xml_list.append('</context>\n<context name=\"{}\">\n'.format(context))
+            last_context = context
+            xml_list.append(xml)
+            size += len(xml)
+            if size >= self.stream_chunk_size:
+                yield ('\n'.join(xml_list) + '\n').encode('utf-8')
+                xml_list = list()
+                size = 0
+
+        if last_context is None:
+            yield self.NotFoundXml().encode('utf-8')
+            return
 
         xml_list.append('</context>\n</include>\n')
-
-        if dp_count > 0:
-            xml = '\n'
-            xml = xml.join(xml_list)
-            return xml
-
-        return self.NotFoundXml()
+        yield '\n'.join(xml_list).encode('utf-8')
 
 
 class LanguagesHandler(XmlHandler):
@@ -597,12 +633,12 @@ class LanguagesHandler(XmlHandler):
         if not valid_uuid4(macro_name):
             return self.NotFoundXml()
 
-        languages_cache_key = 'languages:%s:%s' % (lang, macro_name)
-        xml = cache.get(languages_cache_key)
+        languages_cache_key = self.cache_key('languages', '%s:%s' % (lang, macro_name))
+        xml = self.cache_get(languages_cache_key)
         if xml:
             return xml
 
-        cache_key = 'xmlhandler:lang:sounds_dir'
+        cache_key = self.cache_key('languages', 'sounds_dir')
         sounds_dir = cache.get(cache_key)
         if not sounds_dir:
             sounds_dir = PbxSettings().default_settings('switch', 'sounds', 'dir', '/usr/share/freeswitch/sounds', True)
@@ -633,7 +669,7 @@ class LanguagesHandler(XmlHandler):
 
         etree.indent(x_root)
         xml = str(etree.tostring(x_root), "utf-8")
-        cache.set(languages_cache_key, xml)
+        self.cache_set(languages_cache_key, xml)
         if self.debug:
             print(xml)
         return xml
@@ -642,7 +678,7 @@ class LanguagesHandler(XmlHandler):
 class ConfigHandler(XmlHandler):
 
     def __init__(self):
-        self.debug = False
+        super().__init__()
         try:
             cs_dsn_r = SwitchVariable.objects.get(enabled='true', category='DSN', name='dsn_callcentre')
             self.cs_dsn = cs_dsn_r.value
@@ -650,8 +686,8 @@ class ConfigHandler(XmlHandler):
             self.cs_dsn = None
 
     def GetACL(self):
-        configuration_cache_key = 'configuration:acl.conf'
-        xml = cache.get(configuration_cache_key)
+        configuration_cache_key = self.cache_key('configuration', 'acl.conf')
+        xml = self.cache_get(configuration_cache_key)
         if xml:
             return xml
 
@@ -671,14 +707,103 @@ class ConfigHandler(XmlHandler):
 
         etree.indent(x_root)
         xml = str(etree.tostring(x_root), "utf-8")
-        cache.set(configuration_cache_key, xml)
+        self.cache_set(configuration_cache_key, xml)
         if self.debug:
             print(xml)
         return xml
 
+    def SofiaGatewayKeys(self, hostname, ps):
+        # The gateways of each profile are cached on their own, under a cache
+        #  namespace domain for the profile, so a change to the gateways of one
+        #  profile does not cause the gateways of every other profile to be
+        #  fetched again.
+        return {
+            p.name: self.cache_key(
+                'configuration', 'sofia.conf:gateways:%s:%s' % (p.name, hostname), 'sofia.conf:%s' % p.name
+                )
+            for p in ps
+            }
+
+    def SofiaAddGateway(self, x_gateways, gw):
+        x_gateway = etree.SubElement(x_gateways, 'gateway', name=str(gw.id))
+        if gw.username:
+            etree.SubElement(x_gateway, 'param', name='username', value=gw.username)
+        if gw.distinct_to:
+            etree.SubElement(x_gateway, 'param', name='distinct-to', value=gw.distinct_to)
+        if gw.auth_username:
+            etree.SubElement(x_gateway, 'param', name='auth-username', value=gw.auth_username)
+        if gw.password:
+            etree.SubElement(x_gateway, 'param', name='password', value=gw.password)
+        if gw.realm:
+            etree.SubElement(x_gateway, 'param', name='realm', value=gw.realm)
+        if gw.from_user:
+            etree.SubElement(x_gateway, 'param', name='from-user', value=gw.from_user)
+        if gw.from_domain:
+            etree.SubElement(x_gateway, 'param', name='from-domain', value=gw.from_domain)
+        if gw.proxy:
+            etree.SubElement(x_gateway, 'param', name='proxy', value=gw.proxy)
+        if gw.register_proxy:
+            etree.SubElement(x_gateway, 'param', name='register-proxy', value=gw.register_proxy)
+        if gw.outbound_proxy:
+            etree.SubElement(x_gateway, 'param', name='outbound-proxy', value=gw.outbound_proxy)
+        if gw.expire_seconds:
+            etree.SubElement(x_gateway, 'param', name='expire-seconds', value=str(gw.expire_seconds))
+        if gw.register:
+            etree.SubElement(x_gateway, 'param', name='register', value=gw.register)
+        if gw.register_transport:
+            if gw.register_transport == 'udp':
+                etree.SubElement(x_gateway, 'param', name='register-transport', value=gw.register_transport)
+            elif gw.register_transport == 'tcp':
+                etree.SubElement(x_gateway, 'param', name='register-transport', value=gw.register_transport)
+            elif gw.register_transport == 'tls':
+                etree.SubElement(x_gateway, 'param', name='register-transport', value=gw.register_transport)
+                etree.SubElement(x_gateway, 'param', name='contact-params', value='transport=tls')
+            else:
+                etree.SubElement(x_gateway, 'param', name='register-transport', value='udp')
+
+        if gw.retry_seconds:
+            etree.SubElement(x_gateway, 'param', name='retry-seconds', value=str(gw.retry_seconds))
+        if gw.extension:
+            etree.SubElement(x_gateway, 'param', name='extension', value=gw.extension)
+        if gw.ping:
+            etree.SubElement(x_gateway, 'param', name='ping', value=gw.ping)
+        if gw.context:
+            etree.SubElement(x_gateway, 'param', name='context', value=gw.context)
+        if gw.caller_id_in_from:
+            etree.SubElement(x_gateway, 'param', name='caller-id-in-from', value=gw.caller_id_in_from)
+        if gw.supress_cng:
+            etree.SubElement(x_gateway, 'param', name='supress-cng', value=gw.supress_cng)
+        if gw.extension_in_contact:
+            etree.SubElement(x_gateway, 'param', name='extension-in-contact', value=gw.extension_in_contact)
+        x_variables = etree.SubElement(x_gateway, 'variables')
+        if gw.sip_cid_type:
+            etree.SubElement(x_variables, 'variable', name='sip-cid-type', value=gw.sip_cid_type)
+        return
+
+    def SofiaGateways(self, hostname, ps):
+        # Returns a dictionary of profile name to serialised gateways element.
+        gateway_keys = self.SofiaGatewayKeys(hostname, ps)
+        gateways = cache.get_many(list(gateway_keys.values()))
+        x_gateways = {}
+        for p in ps:
+            if gateway_keys[p.name] in gateways:
+                continue
+            x_gateways[p.name] = etree.Element('gateways')
+            etree.SubElement(x_gateways[p.name], 'X-PRE-PROCESS', cmd='include', data='sip_profiles/%s/*.xml' % p.name)
+        if x_gateways:
+            gws = Gateway.objects.filter(
+                (Q(hostname=hostname) | Q(hostname__isnull=True)), enabled='true', profile__in=list(x_gateways)
+                )
+            for gw in gws:
+                self.SofiaAddGateway(x_gateways[gw.profile], gw)
+            built = {gateway_keys[name]: etree.tostring(x) for name, x in x_gateways.items()}
+            cache.set_many(built)
+            gateways.update(built)
+        return {name: gateways[key] for name, key in gateway_keys.items()}
+
     def GetSofia(self, hostname=''):
-        configuration_cache_key = 'configuration:sofia.conf'
-        xml = cache.get(configuration_cache_key)
+        configuration_cache_key = self.cache_key('configuration', 'sofia.conf:%s' % hostname, 'sofia.conf')
+        xml = self.cache_get(configuration_cache_key)
         if xml:
             return xml
         x_root = self.XrootDynamic()
@@ -690,76 +815,29 @@ class ConfigHandler(XmlHandler):
         etree.SubElement(x_global_settings, 'param', name='debug-presense', value='0')
         #etree.SubElement(x_global_settings, 'param', name='capture-serverlog-level', value='udp:homer.mydomain.com:5060')
         x_profiles = etree.SubElement(x_conf_name, 'profiles')
-        ps = SipProfile.objects.filter(enabled='true').order_by('name')
+        ps = SipProfile.objects.filter(
+            (Q(hostname=hostname) | Q(hostname__isnull=True)), enabled='true'
+            ).prefetch_related(
+            Prefetch(
+                'sipprofiledomain_set', queryset=SipProfileDomain.objects.order_by('name'), to_attr='sorted_domains'
+                ),
+            Prefetch(
+                'sipprofilesetting_set', queryset=SipProfileSetting.objects.filter(enabled='true').order_by('name'),
+                to_attr='enabled_settings'
+                )
+            ).order_by('name')
+        gateways = self.SofiaGateways(hostname, ps)
         for p in ps:
-            ds = p.sipprofiledomain_set.all().order_by('name')
-            ss = p.sipprofilesetting_set.filter(enabled='true').order_by('name')
-            gws = Gateway.objects.filter((Q(hostname=hostname) | Q(hostname__isnull=True)), enabled='true', profile=p.name)
             x_profile = etree.SubElement(x_profiles, 'profile', name=p.name)
             etree.SubElement(x_profile, 'aliases')
-            x_gateways = etree.SubElement(x_profile, 'gateways')
-            etree.SubElement(x_gateways, 'X-PRE-PROCESS', cmd='include', data='sip_profiles/%s/*.xml' % p.name)
-            for gw in gws:
-                x_gateway = etree.SubElement(x_gateways, 'gateway', name=str(gw.id))
-                if gw.username:
-                    etree.SubElement(x_gateway, 'param', name='username', value=gw.username)
-                if gw.distinct_to:
-                    etree.SubElement(x_gateway, 'param', name='distinct-to', value=gw.distinct_to)
-                if gw.auth_username:
-                    etree.SubElement(x_gateway, 'param', name='auth-username', value=gw.auth_username)
-                if gw.password:
-                    etree.SubElement(x_gateway, 'param', name='password', value=gw.password)
-                if gw.realm:
-                    etree.SubElement(x_gateway, 'param', name='realm', value=gw.realm)
-                if gw.from_user:
-                    etree.SubElement(x_gateway, 'param', name='from-user', value=gw.from_user)
-                if gw.from_domain:
-                    etree.SubElement(x_gateway, 'param', name='from-domain', value=gw.from_domain)
-                if gw.proxy:
-                    etree.SubElement(x_gateway, 'param', name='proxy', value=gw.proxy)
-                if gw.register_proxy:
-                    etree.SubElement(x_gateway, 'param', name='register-proxy', value=gw.register_proxy)
-                if gw.outbound_proxy:
-                    etree.SubElement(x_gateway, 'param', name='outbound-proxy', value=gw.outbound_proxy)
-                if gw.expire_seconds:
-                    etree.SubElement(x_gateway, 'param', name='expire-seconds', value=str(gw.expire_seconds))
-                if gw.register:
-                    etree.SubElement(x_gateway, 'param', name='register', value=gw.register)
-                if gw.register_transport:
-                    if gw.register_transport == 'udp':
-                        etree.SubElement(x_gateway, 'param', name='register-transport', value=gw.register_transport)
-                    elif gw.register_transport == 'tcp':
-                        etree.SubElement(x_gateway, 'param', name='register-transport', value=gw.register_transport)
-                    elif gw.register_transport == 'tls':
-                        etree.SubElement(x_gateway, 'param', name='register-transport', value=gw.register_transport)
-                        etree.SubElement(x_gateway, 'param', name='contact-params', value='transport=tls')
-                    else:
-                        etree.SubElement(x_gateway, 'param', name='register-transport', value='udp')
-
-                if gw.retry_seconds:
-                    etree.SubElement(x_gateway, 'param', name='retry-seconds', value=str(gw.retry_seconds))
-                if gw.extension:
-                    etree.SubElement(x_gateway, 'param', name='extension', value=gw.extension)
-                if gw.ping:
-                    etree.SubElement(x_gateway, 'param', name='ping', value=gw.ping)
-                if gw.context:
-                    etree.SubElement(x_gateway, 'param', name='context', value=gw.context)
-                if gw.caller_id_in_from:
-                    etree.SubElement(x_gateway, 'param', name='caller-id-in-from', value=gw.caller_id_in_from)
-                if gw.supress_cng:
-                    etree.SubElement(x_gateway, 'param', name='supress-cng', value=gw.supress_cng)
-                if gw.extension_in_contact:
-                    etree.SubElement(x_gateway, 'param', name='extension-in-contact', value=gw.extension_in_contact)
-                x_variables = etree.SubElement(x_gateway, 'variables')
-                if gw.sip_cid_type:
-                    etree.SubElement(x_variables, 'variable', name='sip-cid-type', value=gw.sip_cid_type)
+            x_profile.append(etree.fromstring(gateways[p.name]))
 
             x_domains = etree.SubElement(x_profile, 'domains')
-            for d in ds:
+            for d in p.sorted_domains:
                 etree.SubElement(x_domains, 'domain', name=d.name, alias=d.alias, parse=d.parse)
 
             x_settings = etree.SubElement(x_profile, 'settings')
-            for s in ss:
+            for s in p.enabled_settings:
                 if s.value is None:
                     s_value = ''
                 else:
@@ -769,14 +847,14 @@ class ConfigHandler(XmlHandler):
 
         etree.indent(x_root)
         xml = str(etree.tostring(x_root), "utf-8")
-        cache.set(configuration_cache_key, xml)
+        self.cache_set(configuration_cache_key, xml)
         if self.debug:
             print(xml)
         return xml
 
     def GetLocalStream(self):
-        configuration_cache_key = 'configuration:local_stream.conf'
-        xml = cache.get(configuration_cache_key)
+        configuration_cache_key = self.cache_key('configuration', 'local_stream.conf')
+        xml = self.cache_get(configuration_cache_key)
         if xml:
             return xml
         x_root = self.XrootDynamic()
@@ -799,14 +877,14 @@ class ConfigHandler(XmlHandler):
 
         etree.indent(x_root)
         xml = str(etree.tostring(x_root), "utf-8")
-        cache.set(configuration_cache_key, xml)
+        self.cache_set(configuration_cache_key, xml)
         if self.debug:
             print(xml)
         return xml
 
     def GetTranslate(self):
-        configuration_cache_key = 'configuration:translate.conf'
-        xml = cache.get(languages_cache_key)
+        configuration_cache_key = self.cache_key('configuration', 'translate.conf')
+        xml = self.cache_get(configuration_cache_key)
         if xml:
             return xml
         x_root = self.XrootDynamic()
@@ -822,14 +900,14 @@ class ConfigHandler(XmlHandler):
 
         etree.indent(x_root)
         xml = str(etree.tostring(x_root), "utf-8")
-        cache.set(configuration_cache_key, xml)
+        self.cache_set(configuration_cache_key, xml)
         if self.debug:
             print(xml)
         return xml
 
     def GetIvr(self, ivr_id):
-        configuration_cache_key = 'configuration:ivr.conf:%s' % ivr_id
-        xml = cache.get(configuration_cache_key)
+        configuration_cache_key = self.cache_key('configuration', 'ivr.conf:%s' % ivr_id)
+        xml = self.cache_get(configuration_cache_key)
         if xml:
             return xml
         x_root = self.XrootDynamic()
@@ -839,6 +917,7 @@ class ConfigHandler(XmlHandler):
         try:
             ivr = IvrMenus.objects.get(pk=ivr_id)
         except:
+            self.cache_release(configuration_cache_key)
             return self.NotFoundXml()
 
         x_menu = etree.SubElement(x_menus, "menu", name=str(ivr.id), description=ivr.name)
@@ -877,14 +956,14 @@ class ConfigHandler(XmlHandler):
 
         etree.indent(x_root)
         xml = str(etree.tostring(x_root), "utf-8")
-        cache.set(configuration_cache_key, xml)
+        self.cache_set(configuration_cache_key, xml)
         if self.debug:
             print(xml)
         return xml
 
     def GetConference(self):
-        configuration_cache_key = 'configuration:conference.conf'
-        xml = cache.get(configuration_cache_key)
+        configuration_cache_key = self.cache_key('configuration', 'conference.conf')
+        xml = self.cache_get(configuration_cache_key)
         if xml:
             return xml
 
@@ -909,14 +988,14 @@ class ConfigHandler(XmlHandler):
 
         etree.indent(x_root)
         xml = str(etree.tostring(x_root), "utf-8")
-        cache.set(configuration_cache_key, xml)
+        self.cache_set(configuration_cache_key, xml)
         if self.debug:
             print(xml)
         return xml
 
     def GetCallcentre(self):
-        configuration_cache_key = 'configuration:callcentre.conf'
-        xml = cache.get(configuration_cache_key)
+        configuration_cache_key = self.cache_key('configuration', 'callcentre.conf')
+        xml = self.cache_get(configuration_cache_key)
         if xml:
             return xml
 
@@ -977,7 +1056,7 @@ class ConfigHandler(XmlHandler):
 
         etree.indent(x_root)
         xml = str(etree.tostring(x_root), "utf-8")
-        cache.set(configuration_cache_key, xml)
+        self.cache_set(configuration_cache_key, xml)
         if self.debug:
             print(xml)
         return xml